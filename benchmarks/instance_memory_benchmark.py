@@ -0,0 +1,66 @@
+import json
+import sys
+import tracemalloc
+from typing import Optional
+
+from cloud_sql.instances import Instance
+
+
+class DictInstance(object):
+    # the dict based Instance that the slotted class replaced
+    def __init__(
+        self,
+        name: str,
+        region: str,
+        project: str,
+        connection_name: str,
+        enable_iam: bool,
+    ):
+        self.port = None
+        self.iam = enable_iam
+        self.default = False
+        self.name = name
+        self.nick_name = name[: name.find("-instance-")]
+        self.region = region
+        self.project = project
+        self.connection_name = connection_name
+        self.fingerprint: Optional[str] = None
+
+    def __repr__(self):  # pragma: no cover
+        return json.dumps(self.__dict__)
+
+
+def build(cls, count: int) -> list:
+    instances = []
+    for i in range(count):
+        # strings are built separately per instance, as they are when decoded
+        # from a state file or an API response
+        project = f"project-{i % 40}"
+        region = "-".join(["europe", "west2"])
+        name = f"service-{i}-instance-{1000000 + i}"
+        instance = cls(name, region, project, f"{project}:{region}:{name}", True)
+        instance.port = 5434 + i
+        instances.append(instance)
+    return instances
+
+
+def measure(cls, count: int) -> int:
+    tracemalloc.start()
+    instances = build(cls, count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del instances
+    return size
+
+
+def run(count: int):
+    dict_size = measure(DictInstance, count)
+    slotted_size = measure(Instance, count)
+    print(f"{count} instances")
+    print(f"dict:    {dict_size / 1024 / 1024:.1f}MiB, {dict_size // count} bytes each")
+    print(f"slotted: {slotted_size / 1024 / 1024:.1f}MiB, {slotted_size // count} bytes each")
+    print(f"saving:  {100 * (dict_size - slotted_size) / dict_size:.0f}%")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
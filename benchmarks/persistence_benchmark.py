@@ -0,0 +1,58 @@
+import sys
+import tempfile
+import time
+
+import jsonpickle
+
+from cloud_sql.instances import Instance, Site
+from cloud_sql.persistence import Persistence
+from cloud_sql.schema import orjson
+
+
+def build_site(count: int) -> Site:
+    instances = {}
+    for i in range(count):
+        project = f"project-{i % 40}"
+        name = f"service-{i}-instance-{1000000 + i}"
+        connection_name = f"{project}:europe-west2:{name}"
+        instance = Instance(name, "europe-west2", project, connection_name, True)
+        instance.port = 5434 + i
+        instances[connection_name] = instance
+    site = Site(instances)
+    site.set_up_nicknames()
+    return site
+
+
+def timed(function, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(count: int, repeat: int):
+    site = build_site(count)
+    with tempfile.TemporaryDirectory() as base_path:
+        persistence = Persistence(base_path)
+        save = timed(lambda: persistence.save_site(site), repeat)
+        load = timed(persistence.load_site, repeat)
+        with open(persistence.instance_filename) as f:
+            size = len(f.read())
+
+        legacy_text = jsonpickle.encode(site)
+        legacy_save = timed(lambda: jsonpickle.encode(site), repeat)
+        legacy_load = timed(lambda: jsonpickle.decode(legacy_text), repeat)
+
+    backend = "orjson" if orjson is not None else "json"
+    print(f"{count} instances, best of {repeat}")
+    print(f"schema ({backend}): save {save * 1000:.1f}ms, load {load * 1000:.1f}ms, {size} bytes")
+    print(
+        f"jsonpickle:      save {legacy_save * 1000:.1f}ms, load {legacy_load * 1000:.1f}ms, {len(legacy_text)} bytes"
+    )
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000, 5)
@@ -0,0 +1,69 @@
+import sys
+import time
+from typing import List
+
+import psutil
+
+from cloud_sql.cloud_sql_proxy import run_cloud_sql_proxy, run_cloud_sql_proxy_group
+
+
+# the proxy only connects to an instance when a client does, so made up
+# instances are enough to start it and measure it idle, as long as it can
+# find application default credentials
+def connection_names(count: int) -> List[str]:
+    return [
+        f"project-1:europe-west2:service-{i}-instance-{1000000 + i}"
+        for i in range(count)
+    ]
+
+
+def resident_memory(pids: List[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            total += psutil.Process(pid).memory_info().rss
+        except psutil.NoSuchProcess:
+            print(f"Proxy {pid} exited before it could be measured")
+    return total
+
+
+def stop(pids: List[int]):
+    processes = []
+    for pid in pids:
+        try:
+            process = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            continue
+        process.terminate()
+        processes.append(process)
+    psutil.wait_procs(processes, timeout=5)
+
+
+def measure(path: str, count: int, grouped: bool, settle: float) -> int:
+    names = connection_names(count)
+    ports = range(20000, 20000 + count)
+    if grouped:
+        pids = [run_cloud_sql_proxy_group(path, list(zip(names, ports)), False)]
+    else:
+        pids = [
+            run_cloud_sql_proxy(path, name, port, False)
+            for name, port in zip(names, ports)
+        ]
+    time.sleep(settle)
+    try:
+        return resident_memory(pids)
+    finally:
+        stop(pids)
+
+
+def run(path: str, count: int, settle: float = 3.0):
+    separate = measure(path, count, False, settle)
+    grouped = measure(path, count, True, settle)
+    print(f"{count} instances")
+    print(f"one proxy each: {separate / 1024 / 1024:.1f}MiB")
+    print(f"one proxy:      {grouped / 1024 / 1024:.1f}MiB")
+    print(f"saving:         {100 * (separate - grouped) / separate:.0f}%")
+
+
+if __name__ == "__main__":
+    run(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 50)
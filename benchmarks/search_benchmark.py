@@ -0,0 +1,60 @@
+import sys
+import time
+
+from cloud_sql.instances import Instance, Site
+
+QUERY = "service-1234"
+
+
+def build_site(count: int) -> Site:
+    instances = {}
+    for i in range(count):
+        project = f"project-{i % 40}"
+        name = f"service-{i}-instance-{1000000 + i}"
+        connection_name = f"{project}:europe-west2:{name}"
+        instance = Instance(name, "europe-west2", project, connection_name, True)
+        instance.port = 5434 + i
+        instances[connection_name] = instance
+    return Site(instances)
+
+
+def timed(function, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def render_scan(site: Site):
+    # the substring test over each rendered instance that list used to do
+    return [
+        instance
+        for instance in site.instances.values()
+        if QUERY in instance.print(None)
+    ]
+
+
+def one_shot(site: Site):
+    # a command run directly starts with no index on its site
+    site.search_index = None
+    return site.find(None, QUERY)
+
+
+def run(count: int, repeat: int):
+    site = build_site(count)
+    scan = timed(lambda: render_scan(site), repeat)
+    first = timed(lambda: one_shot(site), repeat)
+    site.find(None, QUERY)
+    site.find(None, QUERY)
+    indexed = timed(lambda: site.find(None, QUERY), repeat)
+    print(f"{count} instances")
+    print(f"rendered scan:          {scan * 1000:.1f}ms")
+    print(f"first search:           {first * 1000:.1f}ms")
+    print(f"searches in the daemon: {indexed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000, 5)
@@ -1,8 +1,20 @@
+import os
+import socket
 import subprocess
-from typing import Optional
+import time
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
-import psutil as psutil
-from psutil import NoSuchProcess
+if TYPE_CHECKING:  # pragma: no cover
+    import psutil
 
 
 class CloudProxyNotFoundError(Exception):
@@ -12,37 +24,225 @@ class CloudProxyNotFoundError(Exception):
 def run_cloud_sql_proxy(
     cloud_sql_proxy_path: str, connection_name: str, port: int, enable_iam: bool
 ) -> int:
-    instance_description = "-instances={}=tcp:{}".format(connection_name, port)
+    return run_cloud_sql_proxy_group(
+        cloud_sql_proxy_path, [(connection_name, port)], enable_iam
+    )
+
+
+def run_cloud_sql_proxy_group(
+    cloud_sql_proxy_path: str, instances: List[Tuple[str, int]], enable_iam: bool
+) -> int:
+    # one proxy process can serve any number of instances, each on its own port
+    command = proxy_command(
+        cloud_sql_proxy_path,
+        [(name, f"tcp:{port}") for name, port in instances],
+        enable_iam,
+    )
+
+    process = subprocess.Popen(command, start_new_session=True)
+
+    return process.pid
+
+
+def proxy_command(
+    cloud_sql_proxy_path: str, instances: List[Tuple[str, str]], enable_iam: bool
+) -> List[str]:
+    instance_description = "-instances={}".format(
+        ",".join(f"{name}={address}" for name, address in instances)
+    )
 
     if cloud_sql_proxy_path is None:
         raise CloudProxyNotFoundError("Could not find cloud_sql_proxy path")
 
     if enable_iam:
-        command = [cloud_sql_proxy_path, "-enable_iam_login", instance_description]
-    else:
-        command = [cloud_sql_proxy_path, instance_description]
+        return [cloud_sql_proxy_path, "-enable_iam_login", instance_description]
+    return [cloud_sql_proxy_path, instance_description]
 
-    process = subprocess.Popen(command, start_new_session=True)
 
-    return process.pid
+def wait_for_port(port: int, timeout: float, interval: float = 0.1) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=interval):
+                return True
+        except OSError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+
+
+def stop_cloud_sql_proxies(
+    targets: Dict[str, int], grace_period: float = 5.0, kill_wait: float = 1.0
+) -> Dict[str, Optional[Tuple[float, bool]]]:
+    import psutil
+
+    started = time.monotonic()
+    results: Dict[str, Optional[Tuple[float, bool]]] = {
+        name: None for name in targets.keys()
+    }
+    # instances sharing a grouped proxy share its pid and its result
+    groups: Dict[int, List[str]] = {}
+    for name, pid in targets.items():
+        groups.setdefault(pid, []).append(name)
+    names: Dict[int, List[str]] = {}
+    processes = []
+    # one scan confirms that every pid still belongs to the proxy it was
+    # started as, rather than reading each command line through psutil
+    cmdlines = scan_proxy_processes(groups.keys())
+    for pid, group in groups.items():
+        if group[0] not in cmdlines.get(pid, ""):
+            continue
+        try:
+            process = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            continue
+        try:
+            process.terminate()
+        except psutil.NoSuchProcess:
+            pass
+        names[pid] = group
+        processes.append(process)
+
+    def record(process: "psutil.Process", killed: bool):
+        for name in names[process.pid]:
+            results[name] = (time.monotonic() - started, killed)
+
+    def terminated(process: "psutil.Process"):
+        record(process, False)
+
+    def killed(process: "psutil.Process"):
+        record(process, True)
+
+    _, alive = psutil.wait_procs(processes, timeout=grace_period, callback=terminated)
+    for process in alive:
+        try:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+    _, alive = psutil.wait_procs(alive, timeout=kill_wait, callback=killed)
+    for process in alive:
+        record(process, True)
+    return results
+
+
+def process_start_time(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        if os.path.isdir("/proc/self"):
+            return None
+        import psutil
 
+        try:
+            return psutil.Process(pid).create_time()
+        except psutil.NoSuchProcess:
+            return None
+    # the process name in field 2 may contain spaces, so split after it
+    fields = stat[stat.rindex(b")") + 2 :].split()
+    return float(fields[19])
 
-def stop_cloud_sql_proxy(pid: int, name: str) -> bool:
-    process = check_if_proxy_is_running(pid, name)
-    if process:
-        process.kill()
-        return True
+
+def read_proc_cmdline(pid: int) -> Optional[str]:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return None
+
+
+def scan_proxy_processes(pids: Iterable[int]) -> Dict[int, str]:
+    wanted = set(pids)
+    processes: Dict[int, str] = {}
+    if not wanted:
+        return processes
+    if os.path.isdir("/proc/self"):
+        for pid in wanted:
+            cmdline = read_proc_cmdline(pid)
+            if cmdline is not None:
+                processes[pid] = cmdline
     else:
-        return False
+        import psutil
+
+        for process in psutil.process_iter(["cmdline"]):
+            if process.pid in wanted:
+                processes[process.pid] = " ".join(process.info["cmdline"] or [])
+    return processes
+
 
+TCP_ESTABLISHED = "01"
+TCP_LISTEN = "0A"
 
-def check_if_proxy_is_running(pid: int, name: str) -> Optional[psutil.Process]:
+
+def read_proc_tcp(path: str) -> Iterator[Tuple[int, str]]:
+    # (local port, state) for every socket in a /proc/net/tcp style table
     try:
-        process = psutil.Process(pid)
-    except NoSuchProcess:
-        process = None
-    if process:
-        cmdline = process.cmdline()
-        if name in str(cmdline):
-            return process
-    return None
+        with open(path, "r") as f:
+            next(f, None)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 3:
+                    yield int(fields[1].rsplit(":", 1)[1], 16), fields[3]
+    except OSError:
+        pass
+
+
+def read_proc_listening_ports(path: str) -> Set[int]:
+    return {port for port, state in read_proc_tcp(path) if state == TCP_LISTEN}
+
+
+def listening_ports() -> Set[int]:
+    # one pass over the socket table rather than a bind attempt per port
+    if os.path.isdir("/proc/self"):
+        return read_proc_listening_ports("/proc/net/tcp") | read_proc_listening_ports(
+            "/proc/net/tcp6"
+        )
+    import psutil
+
+    try:
+        connections = psutil.net_connections(kind="tcp")
+    except psutil.AccessDenied:
+        return set()
+    return {
+        connection.laddr.port
+        for connection in connections
+        if connection.status == psutil.CONN_LISTEN
+    }
+
+
+def established_connections(ports: Iterable[int]) -> Dict[int, int]:
+    # clients connected to each port, from one pass over the socket table
+    counts = {port: 0 for port in ports}
+    if os.path.isdir("/proc/self"):
+        for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+            for port, state in read_proc_tcp(path):
+                if state == TCP_ESTABLISHED and port in counts:
+                    counts[port] += 1
+        return counts
+    import psutil
+
+    try:
+        connections = psutil.net_connections(kind="tcp")
+    except psutil.AccessDenied:
+        return counts
+    for connection in connections:
+        port = connection.laddr.port
+        if connection.status == psutil.CONN_ESTABLISHED and port in counts:
+            counts[port] += 1
+    return counts
+
+
+def process_memory(pid: int) -> Optional[int]:
+    # resident set size in bytes
+    try:
+        with open(f"/proc/{pid}/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        if os.path.isdir("/proc/self"):
+            return None
+        import psutil
+
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.NoSuchProcess:
+            return None
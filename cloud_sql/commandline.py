@@ -1,5 +1,22 @@
 import argparse
-from typing import Dict, List
+from typing import Dict, List, Tuple
+
+from cloud_sql.output import FORMATS
+
+
+def port_range(value: str) -> Tuple[int, int]:
+    try:
+        start, end = value.split("-")
+        return int(start), int(end)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not in the format START-END")
+
+
+def project_port_range(value: str) -> Tuple[str, Tuple[int, int]]:
+    project, _, ports = value.partition("=")
+    if not project or not ports:
+        raise argparse.ArgumentTypeError(f"{value} is not in the format PROJECT=START-END")
+    return project, port_range(ports)
 
 
 def get_parameters(args: List[str]) -> Dict[str, str]:
@@ -13,20 +30,74 @@ def get_parameters(args: List[str]) -> Dict[str, str]:
         "filter", nargs="?", help="filter the list by this string"
     )
     parser_list.add_argument("-p", "--project", help="project name")
+    parser_list.add_argument(
+        "--format", choices=FORMATS, default="table", help="output format"
+    )
 
     parser_list_running = subparsers.add_parser(
         "list-running", help="list running instances"
     )
+    parser_list_running.add_argument(
+        "--format", choices=FORMATS, default="table", help="output format"
+    )
 
     parser_start = subparsers.add_parser("start", help="start instance")
     parser_start.add_argument(
         "name", help='instance nickname or "default" to start all default instances'
     )
     parser_start.add_argument("-p", "--project", help="project name")
+    parser_start.add_argument(
+        "-w",
+        "--wait",
+        action="store_true",
+        help="wait until each proxy is accepting connections on its port",
+    )
+    parser_start.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=30.0,
+        help="seconds to wait for each proxy to become ready when using --wait",
+    )
+    parser_start.add_argument(
+        "--parallel",
+        type=int,
+        default=8,
+        help="maximum number of proxies to start at the same time",
+    )
+    parser_start.add_argument(
+        "--group",
+        choices=("project", "iam"),
+        help="run the instances in one proxy per project or per IAM setting",
+    )
 
     parser_stop = subparsers.add_parser("stop", help="stop a running instance")
     parser_stop.add_argument("name", help='instance nickname or "all"')
     parser_stop.add_argument("-p", "--project", help="project name")
+    parser_stop.add_argument(
+        "-g",
+        "--grace",
+        type=float,
+        default=5.0,
+        help="seconds to wait after SIGTERM before killing proxies that are still running",
+    )
+
+    parser_reap = subparsers.add_parser(
+        "reap", help="stop proxies that have had no connections for a while"
+    )
+    parser_reap.add_argument(
+        "-i",
+        "--idle",
+        type=float,
+        default=900.0,
+        help="seconds without an established connection before a proxy is stopped",
+    )
+    parser_reap.add_argument("-p", "--project", help="project name")
+    parser_reap.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report the idle proxies without stopping them",
+    )
 
     parser_add = subparsers.add_parser("add", help="add a new instance")
     parser_add.add_argument("connection name", help="long connection name from gcp")
@@ -37,9 +108,35 @@ def get_parameters(args: List[str]) -> Dict[str, str]:
     parser_update.add_argument("-p", "--project", help="specify which project name")
 
     parser_import = subparsers.add_parser("import", help="import instances from gcp")
-    parser_import.add_argument("-p", "--project", help="project name")
+    parser_import.add_argument(
+        "-p", "--project", action="append", help="project name, can be repeated"
+    )
+    parser_import.add_argument(
+        "-f", "--projects-file", help="file listing one project name per line"
+    )
+    parser_import.add_argument(
+        "-a",
+        "--all-projects",
+        action="store_true",
+        help="import from every project the current credentials can access",
+    )
+    parser_import.add_argument(
+        "--parallel",
+        type=int,
+        default=8,
+        help="maximum number of projects to query at the same time",
+    )
+    parser_import.add_argument(
+        "--filter",
+        help='server-side instance filter, for example "settings.userLabels.team:data" or "region:europe-west2"',
+    )
     parser_import.add_argument('--tidy', action='store_true',
                     help='remove instances not found in project')
+    parser_import.add_argument(
+        "--refresh-discovery",
+        action="store_true",
+        help="discard the cached Cloud SQL Admin API discovery document and fetch it again",
+    )
 
     parser_update = subparsers.add_parser("update", help="update an existing instance")
     parser_update.add_argument("name", help="nickname of connection")
@@ -49,6 +146,13 @@ def get_parameters(args: List[str]) -> Dict[str, str]:
     parser_update.add_argument(
         "-d", "--default", help="set whether instance is a default instance"
     )
+    parser_update.add_argument(
+        "--port", type=int, help="pin the instance to this local port"
+    )
+    parser_update.add_argument(
+        "--pinned",
+        help="set whether the proxy is kept running when others are started over --max-proxies",
+    )
 
     parser_config = subparsers.add_parser("config", help="update configuration")
     parser_config.add_argument(
@@ -57,6 +161,62 @@ def get_parameters(args: List[str]) -> Dict[str, str]:
     parser_config.add_argument(
         "-i", "--iam_default", help="New connections have enable_iam set to this value"
     )
+    parser_config.add_argument(
+        "--port-range",
+        type=port_range,
+        help="range of local ports to assign to new instances, as START-END",
+    )
+    parser_config.add_argument(
+        "--project-port-range",
+        type=project_port_range,
+        help="sub-range of ports for one project's instances, as PROJECT=START-END",
+    )
+    parser_config.add_argument(
+        "--reserve",
+        type=int,
+        action="append",
+        help="never assign this port to new instances, can be repeated",
+    )
+    parser_config.add_argument(
+        "--max-proxies",
+        type=int,
+        help="most proxies to run at once, stopping the least recently used to start more, 0 for no limit",
+    )
+
+    parser_daemon = subparsers.add_parser(
+        "daemon",
+        help="keep state in memory and serve commands over a local socket until stopped",
+    )
+    parser_daemon.add_argument(
+        "--stop", action="store_true", help="stop the running daemon"
+    )
+    parser_daemon.add_argument(
+        "--supervise",
+        action="store_true",
+        help="restart proxies that exit without being stopped",
+    )
+    parser_daemon.add_argument(
+        "--max-restarts",
+        type=int,
+        default=5,
+        help="give up on a proxy after this many restarts within 10 minutes, default 5",
+    )
+    parser_daemon.add_argument(
+        "--lazy",
+        action="store_true",
+        help="listen on the port of every instance that is not running and start its proxy on the first connection",
+    )
+    parser_daemon.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=600.0,
+        help="seconds without connections before a proxy started by --lazy is stopped",
+    )
+    parser_daemon.add_argument(
+        "--reap-idle",
+        type=float,
+        help="every minute, stop proxies that have had no connections for this many seconds",
+    )
 
     args = vars(parser.parse_args(args))
     return args
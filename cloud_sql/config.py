@@ -1,5 +1,8 @@
 import os
 import shutil
+from typing import Dict, List, Optional, Tuple
+
+from cloud_sql.ports import DEFAULT_PORT_RANGE, PortAllocator
 
 
 class PathNotFoundError(Exception):
@@ -10,22 +13,52 @@ class Configuration(object):
     def __init__(self, cloud_sql_path, enable_iam_by_default):
         self.cloud_sql_path = cloud_sql_path
         self.enable_iam_by_default = enable_iam_by_default
+        self.port_range: Tuple[int, int] = DEFAULT_PORT_RANGE
+        self.project_port_ranges: Dict[str, Tuple[int, int]] = {}
+        self.reserved_ports: List[int] = []
+        self.max_proxies: Optional[int] = None
+        self.dirty = False
 
     def new_path(self, new_path):
         if os.path.exists(new_path):
             self.cloud_sql_path = new_path
+            self.dirty = True
         else:
             raise PathNotFoundError
 
     def set_enable_iam_by_default(self, new_enable_iam_by_default):
         self.enable_iam_by_default = new_enable_iam_by_default
+        self.dirty = True
+
+    def set_port_range(
+        self, port_range: Tuple[int, int], project: Optional[str] = None
+    ):
+        project_port_ranges = dict(self.project_port_ranges)
+        if project:
+            project_port_ranges[project] = port_range
+            new_range = self.port_range
+        else:
+            new_range = port_range
+        # raises PortRangeError before anything is changed
+        PortAllocator(new_range, project_port_ranges, self.reserved_ports)
+        self.port_range = new_range
+        self.project_port_ranges = project_port_ranges
+        self.dirty = True
+
+    def reserve_port(self, port: int):
+        if port not in self.reserved_ports:
+            self.reserved_ports.append(port)
+            self.dirty = True
 
-    def check(self):  # pragma: no cover
-        if not hasattr(self, "enable_iam_by_default"):
-            self.enable_iam_by_default = True
+    def set_max_proxies(self, max_proxies: int):
+        self.max_proxies = max_proxies or None
+        self.dirty = True
 
     def print(self) -> str:
-        return f"Cloud SQL Proxy path: {self.cloud_sql_path} Enable IAM by Default: {self.enable_iam_by_default}"
+        description = f"Cloud SQL Proxy path: {self.cloud_sql_path} Enable IAM by Default: {self.enable_iam_by_default} Ports: {self.port_range[0]}-{self.port_range[1]}"
+        if self.max_proxies:
+            description += f" Max proxies: {self.max_proxies}"
+        return description
 
 
 def default_configuration():
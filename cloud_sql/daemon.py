@@ -0,0 +1,421 @@
+import io
+import json
+import os
+import selectors
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from typing import Dict, List, Optional, Tuple
+
+from cloud_sql.commandline import get_parameters
+from cloud_sql.instance_manager import (
+    COMMAND_STATE,
+    execute_command,
+    reap,
+    refresh_running,
+    save_state,
+    start_group,
+)
+from cloud_sql.cloud_sql_proxy import CloudProxyNotFoundError, process_start_time
+from cloud_sql.lazy import LazyProxies, LazyProxy
+from cloud_sql.persistence import daemon_socket_path, open_persistence
+from cloud_sql.supervision import ProcessWatcher, RestartPolicy
+
+REAP_INTERVAL = 60.0
+# read by the google auth library and by import, so a command forwarded to the
+# daemon sees the caller's values rather than the daemon's
+FORWARDED_ENVIRONMENT = (
+    "GOOGLE_APPLICATION_CREDENTIALS",
+    "GOOGLE_CLOUD_PROJECT",
+    "CLOUDSDK_CONFIG",
+    "CLOUDSDK_CORE_PROJECT",
+    "CLOUD_SQL_ADMIN_ENDPOINT",
+)
+PATH_PARAMETERS = ("path", "projects_file")
+
+
+def socket_path(base_path: str) -> str:
+    return daemon_socket_path(base_path)
+
+
+class StreamWriter(io.TextIOBase):
+    # sends everything a command prints back to the client as it is written
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text: str) -> int:
+        if text:
+            self.wfile.write((json.dumps({"out": text}) + "\n").encode())
+        return len(text)
+
+    def flush(self):
+        self.wfile.flush()
+
+
+@contextmanager
+def client_environment(environment: Optional[Dict[str, Optional[str]]]):
+    if environment is None:
+        yield
+        return
+    saved = {name: os.environ.get(name) for name in FORWARDED_ENVIRONMENT}
+
+    def apply(values):
+        for name in FORWARDED_ENVIRONMENT:
+            if values.get(name) is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = values[name]
+
+    apply(environment)
+    try:
+        yield
+    finally:
+        apply(saved)
+
+
+def resolve_paths(parameters: Dict[str, str], cwd: Optional[str]):
+    if cwd is None:
+        return
+    for name in PATH_PARAMETERS:
+        if parameters.get(name):
+            parameters[name] = os.path.normpath(os.path.join(cwd, parameters[name]))
+
+
+class Supervisor(object):
+    def __init__(
+        self,
+        persistence,
+        policy: Optional[RestartPolicy] = None,
+        lazy_dir: Optional[str] = None,
+        idle_timeout: float = 600.0,
+        reap_idle: Optional[float] = None,
+    ):
+        self.persistence = persistence
+        self.config = persistence.load_config()
+        self.site = persistence.load_site()
+        self.running = persistence.load_running()
+        self.site.configure_ports(
+            self.config.port_range,
+            self.config.project_port_ranges,
+            self.config.reserved_ports,
+        )
+        self.stopping = False
+        self.policy = policy
+        self.selector = selectors.DefaultSelector()
+        self.watcher = ProcessWatcher(self.selector)
+        # connection name -> (when to restart, pid that exited, its exit code)
+        self.pending: Dict[str, Tuple[float, int, Optional[int]]] = {}
+        self.exit_codes: Dict[int, int] = {}
+        self.lazy: Optional[LazyProxies] = None
+        if lazy_dir is not None:
+            self.lazy = LazyProxies(lazy_dir, self.selector, idle_timeout)
+        self.reap_idle = reap_idle
+        self.next_reap = time.monotonic() + REAP_INTERVAL
+        self.watch_running()
+
+    def execute(
+        self,
+        args: List[str],
+        out,
+        cwd: Optional[str] = None,
+        environment: Optional[Dict[str, Optional[str]]] = None,
+    ) -> int:
+        with redirect_stdout(out), redirect_stderr(out), client_environment(
+            environment
+        ):
+            try:
+                parameters = get_parameters(args)
+                resolve_paths(parameters, cwd)
+                if "running" in COMMAND_STATE.get(parameters["command"], ()):
+                    refresh_running(self.running, keep=self.pending.keys())
+                if self.lazy is not None and parameters["command"] == "start":
+                    self.lazy.release_listeners(self.running)
+                exit_code = execute_command(
+                    parameters, self.config, self.site, self.running
+                )
+            except SystemExit as err:
+                return err.code if isinstance(err.code, int) else 1
+            except Exception as err:
+                print(f"Error: {err}")
+                exit_code = 1
+        self.watch_running()
+        self.save()
+        return exit_code
+
+    def save(self):
+        save_state(self.persistence, self.config, self.site, self.running)
+
+    def reap_children(self):
+        # proxies started by the daemon are its children, so collect them
+        # when they exit rather than leaving zombies that look alive
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if os.WIFEXITED(status):
+                self.exit_codes[pid] = os.WEXITSTATUS(status)
+            else:
+                self.exit_codes[pid] = -os.WTERMSIG(status)
+
+    def watch_running(self):
+        if self.lazy is not None:
+            self.lazy.sync(self.site, self.running)
+        if self.policy is None:
+            return
+        running = self.running.get_all_running_instances()
+        for name in list(self.pending):
+            if name not in running:
+                del self.pending[name]
+        for name in list(self.watcher.watched):
+            if name not in running:
+                self.watcher.unwatch(name)
+        for name, record in running.items():
+            if name not in self.pending:
+                self.watcher.watch(name, record.pid, record.start_time)
+
+    def next_timeout(self, poll_interval: float) -> float:
+        if not self.pending:
+            return poll_interval
+        due = min(when for when, _, _ in self.pending.values())
+        return max(0.0, min(poll_interval, due - time.monotonic()))
+
+    def accept(self, proxy: LazyProxy):
+        self.lazy.accept(proxy, self.config, self.running)
+        self.watch_running()
+
+    def supervise(self):
+        if self.lazy is not None:
+            self.lazy.reap_idle(self.running)
+            self.watch_running()
+        if self.reap_idle is not None and time.monotonic() >= self.next_reap:
+            self.next_reap = time.monotonic() + REAP_INTERVAL
+            refresh_running(self.running, keep=self.pending.keys())
+            reap(self.site, self.running, self.reap_idle, quiet=True)
+            self.watch_running()
+        if self.policy is not None:
+            self.restart_crashed()
+        self.save()
+
+    def restart_crashed(self):
+        for name, pid in self.watcher.collect():
+            self.crashed(name, pid)
+        now = time.monotonic()
+        for name, (when, pid, exit_code) in list(self.pending.items()):
+            if name in self.pending and when <= now:
+                # members of a grouped proxy are restarted together
+                group = [
+                    member
+                    for member, (_, exited, _) in self.pending.items()
+                    if exited == pid
+                ]
+                for member in group:
+                    del self.pending[member]
+                self.restart(group, pid, exit_code)
+
+    def crashed(self, name: str, pid: int):
+        record = self.running.get_running_instance(name)
+        if record is None or record.pid != pid:
+            return
+        if self.lazy is not None and name in self.lazy.proxies:
+            # started again by the next connection rather than restarted
+            self.running.remove_running(name)
+            return
+        exit_code = self.exit_codes.get(pid)
+        self.schedule_restart(
+            name, pid, exit_code, record.restarts, f"exited with code {exit_code}"
+        )
+
+    def schedule_restart(
+        self,
+        name: str,
+        pid: int,
+        exit_code: Optional[int],
+        history: List[dict],
+        reason: str,
+    ):
+        restarts = self.policy.recent_restarts(history, time.time())
+        if restarts >= self.policy.max_restarts:
+            print(
+                f"{name} {reason} after {restarts} restarts within {self.policy.window:.0f}s, not restarting it"
+            )
+            self.running.remove_running(name)
+            return
+        delay = self.policy.delay(restarts)
+        print(f"{name} {reason}, restarting in {delay:.1f}s")
+        self.pending[name] = (time.monotonic() + delay, pid, exit_code)
+
+    def restart(self, names: List[str], pid: int, exit_code: Optional[int]):
+        self.exit_codes.pop(pid, None)
+        names = [
+            name
+            for name in names
+            if self.running.get_running_instance(name) and name in self.site.instances
+        ]
+        if not names:
+            return
+        history = {
+            name: self.running.get_running_instance(name).restarts
+            + [{"time": time.time(), "pid": pid, "exit_code": exit_code}]
+            for name in names
+        }
+        instances = [self.site.instances[name] for name in names]
+        try:
+            new_pid, _ = start_group(self.config, instances, False, 0)
+        except (CloudProxyNotFoundError, OSError) as err:
+            # a failed restart counts as another crash, so it is tried again
+            # after a longer delay until the restart limit is reached
+            for name in names:
+                record = self.running.get_running_instance(name)
+                record.restarts = history[name][-self.policy.history :]
+                self.running.dirty = True
+                self.schedule_restart(
+                    name,
+                    pid,
+                    exit_code,
+                    record.restarts,
+                    f"could not be restarted ({err})",
+                )
+            return
+        start_time = process_start_time(new_pid)
+        for instance in instances:
+            self.running.add_running(
+                new_pid,
+                instance.connection_name,
+                start_time,
+                instance.port,
+                self.config.cloud_sql_path,
+                history[instance.connection_name][-self.policy.history :],
+            )
+            print(f"Restarted {instance.name} on port {instance.port}")
+        self.watch_running()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        supervisor: Supervisor = self.server.supervisor
+        request = json.loads(self.rfile.readline())
+        if request.get("ping"):
+            exit_code = 0
+        elif request.get("shutdown"):
+            supervisor.stopping = True
+            exit_code = 0
+        else:
+            exit_code = supervisor.execute(
+                request["args"],
+                StreamWriter(self.wfile),
+                request.get("cwd"),
+                request.get("environment"),
+            )
+        self.wfile.write((json.dumps({"exit": exit_code}) + "\n").encode())
+
+
+def send_request(base_path: str, request: dict) -> Optional[int]:
+    path = socket_path(base_path)
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    out = sys.stdout
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+    with client, client.makefile("rb") as responses:
+        client.sendall((json.dumps(request) + "\n").encode())
+        for line in responses:
+            response = json.loads(line)
+            if "out" in response:
+                out.write(response["out"])
+            else:
+                out.flush()
+                return response["exit"]
+    print("Lost the connection to the daemon")
+    return 1
+
+
+def forward_command(base_path: str, args: List[str]) -> Optional[int]:
+    cwd = os.getcwd()
+    environment = {name: os.environ.get(name) for name in FORWARDED_ENVIRONMENT}
+    credentials = environment["GOOGLE_APPLICATION_CREDENTIALS"]
+    if credentials:
+        environment["GOOGLE_APPLICATION_CREDENTIALS"] = os.path.abspath(credentials)
+    return send_request(
+        base_path, {"args": args, "cwd": cwd, "environment": environment}
+    )
+
+
+def stop_daemon(base_path: str) -> int:
+    if send_request(base_path, {"shutdown": True}) is None:
+        print("No daemon is running")
+        return 1
+    print("Daemon stopped")
+    return 0
+
+
+def serve(
+    base_path: str,
+    poll_interval: float = 0.5,
+    policy: Optional[RestartPolicy] = None,
+    lazy: bool = False,
+    idle_timeout: float = 600.0,
+    reap_idle: Optional[float] = None,
+) -> int:
+    path = socket_path(base_path)
+    if send_request(base_path, {"ping": True}) is not None:
+        print(f"A daemon is already listening on {path}")
+        return 1
+    if os.path.exists(path):
+        os.unlink(path)
+    if not os.path.exists(base_path):
+        os.makedirs(base_path)
+
+    supervisor = Supervisor(
+        open_persistence(base_path),
+        policy,
+        os.path.join(base_path, "lazy") if lazy else None,
+        idle_timeout,
+        reap_idle,
+    )
+    server = socketserver.UnixStreamServer(path, RequestHandler)
+    os.chmod(path, 0o600)
+    server.supervisor = supervisor
+    server.timeout = 0
+    supervisor.selector.register(server, selectors.EVENT_READ)
+
+    if threading.current_thread() is threading.main_thread():
+
+        def request_stop(signum, frame):
+            supervisor.stopping = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+    print(f"Listening on {path}")
+    try:
+        while not supervisor.stopping:
+            timeout = supervisor.next_timeout(poll_interval)
+            for key, _ in supervisor.selector.select(timeout):
+                if key.data is None:
+                    server.handle_request()
+                elif isinstance(key.data, LazyProxy):
+                    supervisor.accept(key.data)
+                else:
+                    supervisor.watcher.notify(key.data, key.fd)
+            supervisor.reap_children()
+            supervisor.supervise()
+    finally:
+        if supervisor.lazy is not None:
+            supervisor.lazy.close(supervisor.running)
+            supervisor.save()
+        supervisor.watcher.close()
+        supervisor.selector.close()
+        server.server_close()
+        os.unlink(path)
+    return 0
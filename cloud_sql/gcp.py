@@ -1,10 +1,17 @@
-from typing import List, Optional, Tuple
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 import google
 from googleapiclient import discovery
 
 from cloud_sql.config import Configuration
 from cloud_sql.instances import Instance, Site
+from cloud_sql.ports import PortsExhaustedError
 
 
 def get_credentials_and_project():
@@ -12,42 +19,315 @@ def get_credentials_and_project():
     return a
 
 
-def get_google_service(credentials):
-    return discovery.build("sqladmin", "v1beta4")
+SQLADMIN_API = "sqladmin"
+SQLADMIN_VERSION = "v1beta4"
+SQLADMIN_METHODS = {"instances": ["list"]}
+RESOURCE_MANAGER_API = "cloudresourcemanager"
+RESOURCE_MANAGER_VERSION = "v1"
+RESOURCE_MANAGER_METHODS = {"projects": ["list"]}
+# partial response mask covering only the fields that Instance is built from
+INSTANCE_LIST_FIELDS = (
+    "nextPageToken,items(name,region,project,connectionName,instanceType)"
+)
 
 
-def obtain_instances(
-    config: Configuration, site: Site, override_project: Optional[str], tidy: Optional[bool]
-) -> Tuple[int,int]:
-    credentials, project = get_credentials_and_project()
-    service = get_google_service(credentials)
-    if override_project:
-        project = override_project
-    req = service.instances().list(project=project)
-    resp = req.execute()
-    instances = [
-        Instance(
+class DiscoveryError(Exception):
+    pass
+
+
+def discovery_cache_path(cache_dir: str, api: str, version: str) -> str:
+    return os.path.join(cache_dir, f"{api}.{version}.json")
+
+
+def fetch_discovery_document(api: str, version: str) -> str:
+    from googleapiclient.discovery_cache import get_static_doc
+
+    document = get_static_doc(api, version)
+    if document is None:
+        import httplib2
+
+        response, content = httplib2.Http().request(
+            discovery.DISCOVERY_URI.format(api=api, apiVersion=version)
+        )
+        if response.status >= 400:
+            raise DiscoveryError(
+                f"Could not fetch discovery document for {api} {version}: {response.status}"
+            )
+        document = content.decode()
+    return document
+
+
+def trim_discovery_document(document: str, methods: Dict[str, List[str]]) -> str:
+    full = json.loads(document)
+    trimmed = {
+        key: value
+        for key, value in full.items()
+        if key not in ("resources", "schemas")
+    }
+    trimmed["resources"] = {}
+    trimmed["schemas"] = {}
+    for resource, names in methods.items():
+        resource_methods = full["resources"][resource]["methods"]
+        trimmed["resources"][resource] = {
+            "methods": {name: resource_methods[name] for name in names}
+        }
+        for name in names:
+            response = resource_methods[name].get("response")
+            if response:
+                # keep only the top level of the response schema, which is
+                # enough for the client to generate list_next paging methods
+                schema = full["schemas"][response["$ref"]]
+                properties = {}
+                for key, value in schema.get("properties", {}).items():
+                    if "$ref" in value:
+                        value = {"type": "object"}
+                    elif "items" in value:
+                        value = {**value, "items": {"type": "object"}}
+                    properties[key] = value
+                trimmed["schemas"][response["$ref"]] = {
+                    **schema,
+                    "properties": properties,
+                }
+    return json.dumps(trimmed)
+
+
+def load_discovery_document(
+    cache_dir: Optional[str],
+    api: str,
+    version: str,
+    methods: Dict[str, List[str]],
+    refresh: bool = False,
+) -> str:
+    if cache_dir:
+        path = discovery_cache_path(cache_dir, api, version)
+        if not refresh and os.path.exists(path):
+            with open(path, "r") as f:
+                return f.read()
+
+    document = trim_discovery_document(fetch_discovery_document(api, version), methods)
+
+    if cache_dir:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(f"{path}.tmp", "w") as f:
+            f.write(document)
+        os.replace(f"{path}.tmp", path)
+    return document
+
+
+def get_google_service(
+    credentials, cache_dir: Optional[str] = None, refresh_discovery: bool = False
+):
+    document = load_discovery_document(
+        cache_dir, SQLADMIN_API, SQLADMIN_VERSION, SQLADMIN_METHODS, refresh_discovery
+    )
+    endpoint = os.getenv("CLOUD_SQL_ADMIN_ENDPOINT")
+    return discovery.build_from_document(
+        document,
+        credentials=credentials,
+        client_options={"api_endpoint": endpoint} if endpoint else None,
+    )
+
+
+def list_accessible_projects(
+    credentials, cache_dir: Optional[str] = None, refresh_discovery: bool = False
+) -> List[str]:
+    document = load_discovery_document(
+        cache_dir,
+        RESOURCE_MANAGER_API,
+        RESOURCE_MANAGER_VERSION,
+        RESOURCE_MANAGER_METHODS,
+        refresh_discovery,
+    )
+    service = discovery.build_from_document(document, credentials=credentials)
+    projects = []
+    req = service.projects().list(filter="lifecycleState:ACTIVE")
+    while req is not None:
+        resp = req.execute()
+        projects.extend(project["projectId"] for project in resp.get("projects", []))
+        req = service.projects().list_next(req, resp)
+    return projects
+
+
+class ProjectImport(object):
+    def __init__(self, project: str):
+        self.project = project
+        self.inserted = 0
+        self.deleted = 0
+        self.changes: List[str] = []
+        self.removed: List[str] = []
+        self.unchanged = False
+        self.elapsed = 0.0
+        self.error: Optional[Exception] = None
+
+
+# a hash of only the fields the manager keeps; the etag also changes when
+# settings the manager ignores are edited
+def instance_fingerprint(item: dict) -> str:
+    fields = [item.get(key) for key in ("name", "region", "project", "connectionName")]
+    return hashlib.sha1(json.dumps(fields).encode()).hexdigest()
+
+
+def project_marker(seen: Dict[str, str]) -> str:
+    digest = hashlib.sha1()
+    for connection_name in sorted(seen):
+        digest.update(f"{connection_name}={seen[connection_name]}\n".encode())
+    return digest.hexdigest()
+
+
+def iter_project_pages(
+    service, project: str, http, instance_filter: Optional[str] = None
+) -> Iterator[List[dict]]:
+    kwargs = {"project": project, "fields": INSTANCE_LIST_FIELDS}
+    if instance_filter:
+        kwargs["filter"] = instance_filter
+    request = service.instances().list(**kwargs)
+    while request is not None:
+        response = request.execute(http=http)
+        yield response.get("items", [])
+        request = service.instances().list_next(request, response)
+
+
+def merge_page(
+    config: Configuration,
+    site: Site,
+    result: ProjectImport,
+    items: List[dict],
+    seen: Dict[str, str],
+):
+    for item in items:
+        if item.get("instanceType") != "CLOUD_SQL_INSTANCE":
+            continue
+        instance = Instance(
             item.get("name"),
             item.get("region"),
             item.get("project"),
             item.get("connectionName"),
             config.enable_iam_by_default,
         )
-        for item in resp.get("items")
-        if item.get("instanceType") == "CLOUD_SQL_INSTANCE"
-    ]
-    insert_count = 0
-    delete_count = 0
-    for instance in instances:
-        if site.update(instance):
-            insert_count += 1
-    if tidy:
-        project_instances : List[Instance] = [instance for instance in site.instances.values() if instance.project == project]
-        connection_names = [instance.connection_name for instance in instances]
-        for project_instance in project_instances:
-            if project_instance.connection_name not in connection_names:
-                site.remove_instance(project_instance.connection_name)
-                delete_count += 1
-
-    site.set_up_nicknames()
-    return (insert_count, delete_count)
\ No newline at end of file
+        instance.fingerprint = instance_fingerprint(item)
+        seen[instance.connection_name] = instance.fingerprint
+        try:
+            inserted = site.update(instance)
+        except PortsExhaustedError as err:
+            result.error = err
+            return
+        if inserted:
+            result.inserted += 1
+            result.changes.append(f"+ {instance.connection_name}")
+        else:
+            site.refresh(instance)
+
+
+def local_connection_names(site: Site, projects: List[str]) -> Dict[str, Set[str]]:
+    local: Dict[str, Set[str]] = {project: set() for project in projects}
+    for instance in site.instances.values():
+        if instance.project in local:
+            local[instance.project].add(instance.connection_name)
+    return local
+
+
+def reconcile_project(result: ProjectImport, local: Set[str], seen: Dict[str, str]):
+    result.removed = sorted(local.difference(seen))
+    result.deleted = len(result.removed)
+    result.changes.extend(f"- {connection_name}" for connection_name in result.removed)
+
+
+def obtain_instances_for_projects(
+    config: Configuration,
+    site: Site,
+    projects: Optional[List[str]],
+    tidy: Optional[bool],
+    cache_dir: Optional[str] = None,
+    refresh_discovery: bool = False,
+    all_projects: bool = False,
+    parallel: int = 8,
+    instance_filter: Optional[str] = None,
+) -> List[ProjectImport]:
+    from concurrent.futures import ThreadPoolExecutor
+
+    credentials, default_project = get_credentials_and_project()
+    service = get_google_service(credentials, cache_dir, refresh_discovery)
+    if all_projects:
+        projects = list_accessible_projects(credentials, cache_dir, refresh_discovery)
+    elif not projects:
+        projects = [default_project]
+    projects = list(dict.fromkeys(projects))
+
+    # httplib2 connections are not thread safe, so each worker gets its own
+    # transport while the credentials and the client are shared
+    local = threading.local()
+    # pages are merged on this thread as they arrive; the bounded queue holds
+    # back the workers so that memory does not grow with the project size
+    pages: "queue.Queue[Tuple[ProjectImport, Optional[List[dict]]]]" = queue.Queue(
+        maxsize=max(1, parallel) * 2
+    )
+    cancelled = threading.Event()
+
+    def fetch(result: ProjectImport):
+        started = time.monotonic()
+        try:
+            if cancelled.is_set():
+                return
+            if not hasattr(local, "http"):
+                import google_auth_httplib2
+                from googleapiclient.http import build_http
+
+                local.http = google_auth_httplib2.AuthorizedHttp(
+                    credentials, http=build_http()
+                )
+            for items in iter_project_pages(
+                service, result.project, local.http, instance_filter
+            ):
+                if cancelled.is_set():
+                    break
+                pages.put((result, items))
+        except Exception as err:
+            result.error = err
+        finally:
+            result.elapsed = time.monotonic() - started
+            pages.put((result, None))
+
+    results = [ProjectImport(project) for project in projects]
+    seen: Dict[str, Dict[str, str]] = {result.project: {} for result in results}
+    # taken before merging so that instances added by this import are never removed
+    known = local_connection_names(site, projects) if tidy else {}
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        for result in results:
+            executor.submit(fetch, result)
+        pending = len(results)
+        try:
+            while pending:
+                result, items = pages.get()
+                if items is not None:
+                    # a project that ran out of ports has failed, skip the rest of it
+                    if result.error is None:
+                        merge_page(config, site, result, items, seen[result.project])
+                else:
+                    pending -= 1
+                    if result.error is not None:
+                        continue
+                    if tidy:
+                        reconcile_project(
+                            result, known[result.project], seen[result.project]
+                        )
+                    # a filtered listing only covers part of the project
+                    if not instance_filter:
+                        site.set_project_marker(
+                            result.project, project_marker(seen[result.project])
+                        )
+                    result.unchanged = not (result.inserted or result.deleted)
+        except BaseException:
+            # workers blocked on the full queue would otherwise keep the
+            # executor from shutting down
+            cancelled.set()
+            while pending:
+                if pages.get()[1] is None:
+                    pending -= 1
+            raise
+
+    site.remove_instances(
+        connection_name for result in results for connection_name in result.removed
+    )
+    return results
+
@@ -1,10 +1,17 @@
+import os
 import sys
-from typing import Dict, Optional
-from cloud_sql.gcp import obtain_instances
+import time
+from typing import Collection, Dict, List, Optional, Tuple
 from cloud_sql.cloud_sql_proxy import (
+    established_connections,
+    process_memory,
+    run_cloud_sql_proxy_group,
+    listening_ports,
     run_cloud_sql_proxy,
-    stop_cloud_sql_proxy,
-    check_if_proxy_is_running,
+    stop_cloud_sql_proxies,
+    process_start_time,
+    scan_proxy_processes,
+    wait_for_port,
 )
 from cloud_sql.commandline import get_parameters
 from cloud_sql.config import Configuration, PathNotFoundError
@@ -15,17 +22,48 @@ from cloud_sql.instances import (
     Instance,
     InvalidConnectionName,
 )
-from cloud_sql.persistence import Persistence, default_base_path
+from cloud_sql.persistence import (
+    daemon_socket_path,
+    default_base_path,
+    open_persistence,
+)
+from cloud_sql.ports import PortInUseError, PortRangeError, PortsExhaustedError
 from cloud_sql.running_instances import RunningInstances
 
 
-def refresh_running(running_instances: RunningInstances):
-    running = running_instances.get_all_running()
-    old_running = list(running.items())
-    for connection_name, pid in old_running:
-        if not check_if_proxy_is_running(pid, connection_name):
+COMMAND_STATE = {
+    "list": ("site",),
+    "list-running": ("site", "running"),
+    "start": ("config", "site", "running"),
+    "stop": ("config", "site", "running"),
+    "reap": ("site", "running"),
+    "update": ("site",),
+    "import": ("config", "site", "running"),
+    "config": ("config",),
+    "add": ("config", "site"),
+    "remove": ("config", "site", "running"),
+}
+
+
+def refresh_running(
+    running_instances: RunningInstances, keep: Collection[str] = ()
+):
+    running = running_instances.get_all_running_instances()
+    unverified = []
+    for connection_name, record in list(running.items()):
+        if connection_name in keep:
+            continue
+        if record.start_time is None:
+            unverified.append((connection_name, record.pid))
+        elif process_start_time(record.pid) != record.start_time:
             running_instances.remove_running(connection_name)
 
+    if unverified:
+        processes = scan_proxy_processes(pid for _, pid in unverified)
+        for connection_name, pid in unverified:
+            if connection_name not in processes.get(pid, ""):
+                running_instances.remove_running(connection_name)
+
 
 def get_instance_from_nick(
     site: Site, nick: str, project: Optional[str]
@@ -42,28 +80,124 @@ def get_instance_from_nick(
         return None
 
 
-def print_list(site: Site, project: Optional[str], filter_string: Optional[str]):
-    lines = site.print_list(project, filter_string)
-    for line in lines:
-        print(line)
+def print_list(
+    site: Site,
+    project: Optional[str],
+    filter_string: Optional[str],
+    output_format: str = "table",
+):
+    from cloud_sql.output import write_instances
+    from cloud_sql.search import SearchQueryError
+
+    try:
+        instances = site.find(project, filter_string)
+    except SearchQueryError as err:
+        print(str(err))
+        return
+    write_instances(((instance, None) for instance in instances), output_format)
+
 
+def print_list_running(
+    site: Site, running_instances: RunningInstances, output_format: str = "table"
+):
+    from cloud_sql.output import write_instances
 
-def print_list_running(site: Site, running_instances: RunningInstances):
     running = running_instances.get_all_running()
-    for connection_name in running.keys():
-        instance = site.instances[connection_name]
-        print(instance.print(running[connection_name]))
-    if len(running) == 0:
+    count = write_instances(
+        (
+            (site.instances[connection_name], pid)
+            for connection_name, pid in running.items()
+        ),
+        output_format,
+        running=True,
+    )
+    if count == 0 and output_format == "table":
         print("No running instances")
 
 
+def start_instance(
+    config: Configuration, instance: Instance, wait: bool, timeout: float
+) -> Tuple[int, Optional[float]]:
+    started = time.monotonic()
+    pid = run_cloud_sql_proxy(
+        config.cloud_sql_path,
+        instance.connection_name,
+        instance.port,
+        instance.iam,
+    )
+    if wait and wait_for_port(instance.port, timeout):
+        return pid, time.monotonic() - started
+    return pid, None
+
+
+# instances in a group must share an IAM setting, as it applies to the whole proxy
+GROUP_KEYS = {
+    "project": lambda instance: (instance.project, instance.iam),
+    "iam": lambda instance: (instance.iam,),
+}
+
+
+def group_instances(
+    instances: List[Instance], group: Optional[str]
+) -> List[List[Instance]]:
+    if not group:
+        return [[instance] for instance in instances]
+    groups: Dict[tuple, List[Instance]] = {}
+    for instance in instances:
+        groups.setdefault(GROUP_KEYS[group](instance), []).append(instance)
+    return list(groups.values())
+
+
+def start_group(
+    config: Configuration, instances: List[Instance], wait: bool, timeout: float
+) -> Tuple[int, List[Optional[float]]]:
+    if len(instances) == 1:
+        pid, ready_in = start_instance(config, instances[0], wait, timeout)
+        return pid, [ready_in]
+    started = time.monotonic()
+    pid = run_cloud_sql_proxy_group(
+        config.cloud_sql_path,
+        [(instance.connection_name, instance.port) for instance in instances],
+        instances[0].iam,
+    )
+    ready = []
+    for instance in instances:
+        remaining = max(0.0, timeout - (time.monotonic() - started))
+        if wait and wait_for_port(instance.port, remaining):
+            ready.append(time.monotonic() - started)
+        else:
+            ready.append(None)
+    return pid, ready
+
+
+def add_running_group(
+    config: Configuration,
+    running_instances: RunningInstances,
+    instances: List[Instance],
+    pid: int,
+):
+    start_time = process_start_time(pid)
+    for instance in instances:
+        running_instances.add_running(
+            pid,
+            instance.connection_name,
+            start_time,
+            instance.port,
+            config.cloud_sql_path,
+        )
+
+
 def start(
     config: Configuration,
     site: Site,
     running_instances: RunningInstances,
     name: str,
     project: Optional[str],
-):
+    wait: bool = False,
+    timeout: float = 30.0,
+    parallel: int = 8,
+    group: Optional[str] = None,
+) -> bool:
     if name == "default":
         instances = site.get_default_instances(project)
         if len(instances) == 0:
@@ -73,20 +207,120 @@ def start(
         if instance:
             instances = [instance]
         else:
-            return
+            return True
 
+    to_start = []
     for instance in instances:
         if running_instances.get_running(instance.connection_name):
             print(f"{instance.nick_name} is already running.")
         else:
-            pid = run_cloud_sql_proxy(
-                config.cloud_sql_path,
-                instance.connection_name,
-                instance.port,
-                instance.iam,
+            to_start.append(instance)
+
+    if not to_start:
+        return True
+
+    busy = listening_ports()
+    for instance in to_start:
+        if instance.port in busy:
+            print(
+                f"Port {instance.port} for {instance.nick_name} is already in use by another process, not starting it."
             )
-            running_instances.add_running(pid, instance.connection_name)
-            print(f"Started {instance.name} on port {instance.port}")
+    all_ready = not any(instance.port in busy for instance in to_start)
+    to_start = [instance for instance in to_start if instance.port not in busy]
+    if not to_start:
+        return all_ready
+
+    groups = group_instances(to_start, group)
+    if config.max_proxies:
+        allowed = make_room(site, running_instances, groups, config.max_proxies)
+        all_ready = all_ready and len(allowed) == len(groups)
+        groups = allowed
+        if not groups:
+            return all_ready
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = [
+            executor.submit(start_group, config, members, wait, timeout)
+            for members in groups
+        ]
+        for members, future in zip(groups, futures):
+            pid, ready = future.result()
+            add_running_group(config, running_instances, members, pid)
+            for instance, ready_in in zip(members, ready):
+                if not wait:
+                    print(f"Started {instance.name} on port {instance.port}")
+                elif ready_in is not None:
+                    print(
+                        f"Started {instance.name} on port {instance.port}, ready in {ready_in:.2f}s"
+                    )
+                else:
+                    print(
+                        f"Started {instance.name} on port {instance.port} but it was not ready within {timeout}s"
+                    )
+                    all_ready = False
+            if len(members) > 1:
+                print(f"Started {len(members)} instances in one proxy with pid {pid}")
+    return all_ready
+
+
+def make_room(
+    site: Site,
+    running_instances: RunningInstances,
+    groups: List[List[Instance]],
+    max_proxies: int,
+    grace_period: float = 5.0,
+) -> List[List[Instance]]:
+    running = running_instances.get_all_running_instances()
+    proxies: Dict[int, List[str]] = {}
+    for name, record in running.items():
+        proxies.setdefault(record.pid, []).append(name)
+    excess = len(proxies) + len(groups) - max_proxies
+    if excess <= 0:
+        return groups
+
+    # proxies serving a pinned instance are never stopped to make room
+    candidates = {
+        pid: names
+        for pid, names in proxies.items()
+        if not any(
+            name in site.instances and site.instances[name].pinned for name in names
+        )
+    }
+    ports = {
+        name: running[name].port for names in candidates.values() for name in names
+    }
+    connections = established_connections({port for port in ports.values() if port})
+    now = time.time()
+    for name, port in ports.items():
+        if connections.get(port):
+            running_instances.mark_used(name, now)
+    least_recent = sorted(
+        candidates,
+        key=lambda pid: max(running[name].last_used or 0 for name in candidates[pid]),
+    )[:excess]
+
+    if least_recent:
+        names = [name for pid in least_recent for name in candidates[pid]]
+        stop_cloud_sql_proxies({name: running[name].pid for name in names}, grace_period)
+        for name in names:
+            instance = site.instances.get(name)
+            label = instance.nick_name if instance else name
+            print(
+                f"Stopped {label} on port {ports[name]} to stay within the limit of {max_proxies} proxies"
+            )
+            running_instances.remove_running(name)
+
+    excess -= len(least_recent)
+    if excess <= 0:
+        return groups
+    for members in groups[-excess:]:
+        for instance in members:
+            print(
+                f"Not starting {instance.nick_name}, it would go over the limit of {max_proxies} proxies"
+            )
+    return groups[:-excess]
 
 
 def stop(
@@ -94,6 +328,8 @@ def stop(
     running_instances: RunningInstances,
     nickname: str,
     project: Optional[str],
+    grace_period: float = 5.0,
+    config: Optional[Configuration] = None,
 ):
     if nickname == "all":
         instances = [
@@ -110,28 +346,254 @@ def stop(
         else:
             return
 
+    targets = {}
     for instance in instances:
         pid = running_instances.get_running(instance.connection_name)
         if pid:
-            if stop_cloud_sql_proxy(pid, instance.connection_name):
-                print(f"Stopped {instance.name} on port {instance.port}")
-            else:
+            targets[instance.connection_name] = pid
+        else:
+            print(f"{instance.nick_name} is not running")
+
+    if not targets:
+        return
+
+    survivors = group_survivors(running_instances, targets)
+    results = stop_cloud_sql_proxies(targets, grace_period)
+    for instance in instances:
+        if instance.connection_name not in targets:
+            continue
+        result = results[instance.connection_name]
+        if result:
+            latency, killed = result
+            if killed:
                 print(
-                    f"Could not locate process to stop for {instance.nick_name}, it has been removed from the running list"
+                    f"Killed {instance.name} on port {instance.port} after {latency:.2f}s, it did not exit within {grace_period}s"
                 )
-            running_instances.remove_running(instance.connection_name)
+            else:
+                print(f"Stopped {instance.name} on port {instance.port} in {latency:.2f}s")
         else:
-            print(f"{instance.nick_name} is not running")
+            print(
+                f"Could not locate process to stop for {instance.nick_name}, it has been removed from the running list"
+            )
+        running_instances.remove_running(instance.connection_name)
+
+    if config is not None:
+        restart_survivors(config, site, running_instances, survivors)
+
 
+def group_survivors(
+    running_instances: RunningInstances, targets: Dict[str, int]
+) -> Dict[int, List[str]]:
+    # members of a grouped proxy that are not being stopped go down with it,
+    # so they are started again in a proxy of their own afterwards
+    survivors: Dict[int, List[str]] = {}
+    for connection_name, pid in targets.items():
+        if pid not in survivors:
+            survivors[pid] = [
+                member
+                for member in running_instances.get_group(connection_name)
+                if member not in targets
+            ]
+    return survivors
+
+
+def restart_survivors(
+    config: Configuration,
+    site: Site,
+    running_instances: RunningInstances,
+    survivors: Dict[int, List[str]],
+):
+    for members in survivors.values():
+        if members:
+            restart_group(config, site, running_instances, members)
+
+
+def restart_group(
+    config: Configuration,
+    site: Site,
+    running_instances: RunningInstances,
+    connection_names: List[str],
+):
+    instances = [site.instances[name] for name in connection_names]
+    pid, _ = start_group(config, instances, False, 0)
+    add_running_group(config, running_instances, instances, pid)
+    print(
+        f"Restarted {', '.join(instance.nick_name for instance in instances)} in a new proxy with pid {pid}"
+    )
+
+
+def reap(
+    site: Site,
+    running_instances: RunningInstances,
+    idle_for: float,
+    project: Optional[str] = None,
+    dry_run: bool = False,
+    grace_period: float = 5.0,
+    quiet: bool = False,
+) -> Dict[str, float]:
+    running = {
+        name: record
+        for name, record in running_instances.get_all_running_instances().items()
+        if name in site.instances
+        and (not project or site.instances[name].project == project)
+    }
+    if not running:
+        if not quiet:
+            print("No running instances")
+        return {}
+
+    ports = {
+        name: record.port or site.instances[name].port
+        for name, record in running.items()
+    }
+    connections = established_connections(set(ports.values()))
+    now = time.time()
+    for name, record in running.items():
+        if connections.get(ports[name]) or record.last_used is None:
+            running_instances.mark_used(name, now)
+
+    # a grouped proxy is only idle when none of its instances are in use
+    groups: Dict[int, List[str]] = {}
+    for name, record in running.items():
+        groups.setdefault(record.pid, []).append(name)
+    idle = {
+        name: now - running[name].last_used
+        for members in groups.values()
+        if len(members) == len(running_instances.get_group(members[0]))
+        and all(now - running[name].last_used >= idle_for for name in members)
+        for name in members
+    }
+    if not idle:
+        if not quiet:
+            print("No idle proxies")
+        return idle
+
+    memory = {
+        pid: process_memory(pid) or 0
+        for pid in {running[name].pid for name in idle}
+    }
+    if dry_run:
+        for name in idle:
+            instance = site.instances[name]
+            print(
+                f"{instance.nick_name} on port {ports[name]} has been idle for {idle[name]:.0f}s"
+            )
+        print(
+            f"Would reclaim {sum(memory.values()) / 1024 / 1024:.1f}MiB from {len(memory)} proxies"
+        )
+        return idle
+
+    results = stop_cloud_sql_proxies(
+        {name: running[name].pid for name in idle}, grace_period
+    )
+    stopped = set()
+    for name in idle:
+        instance = site.instances[name]
+        if results[name]:
+            stopped.add(running[name].pid)
+            print(
+                f"Stopped {instance.nick_name} on port {ports[name]}, idle for {idle[name]:.0f}s"
+            )
+        running_instances.remove_running(name)
+    reclaimed = sum(memory[pid] for pid in stopped)
+    print(f"Reclaimed {reclaimed / 1024 / 1024:.1f}MiB from {len(stopped)} proxies")
+    return idle
+
+
+def read_projects_file(path: str) -> List[str]:
+    with open(path, "r") as f:
+        return [
+            line.strip()
+            for line in f
+            if line.strip() and not line.strip().startswith("#")
+        ]
 
-def import_instances(config: Configuration, site: Site, project: Optional[str], tidy: Optional[bool]):
 
-    (insert_count, delete_count) = obtain_instances(config, site, project, tidy)
-    print(f"Imported {insert_count} instances.")
+def stop_removed_instances(
+    config: Configuration,
+    site: Site,
+    running_instances: RunningInstances,
+    connection_names: List[str],
+):
+    targets = {
+        connection_name: running_instances.get_running(connection_name)
+        for connection_name in connection_names
+        if running_instances.get_running(connection_name)
+    }
+    if not targets:
+        return
+
+    survivors = group_survivors(running_instances, targets)
+    results = stop_cloud_sql_proxies(targets)
+    for connection_name in targets:
+        if results[connection_name]:
+            print(f"Stopped proxy for removed instance {connection_name}")
+        running_instances.remove_running(connection_name)
+    restart_survivors(config, site, running_instances, survivors)
+
+
+def import_instances(
+    config: Configuration,
+    site: Site,
+    running_instances: RunningInstances,
+    projects: Optional[List[str]],
+    tidy: Optional[bool],
+    refresh_discovery: bool = False,
+    projects_file: Optional[str] = None,
+    all_projects: bool = False,
+    parallel: int = 8,
+    instance_filter: Optional[str] = None,
+) -> bool:
+    from cloud_sql.gcp import obtain_instances_for_projects
+
+    if tidy and instance_filter:
+        print(
+            "--tidy cannot be combined with --filter, a filtered import only sees part of each project"
+        )
+        return False
+
+    projects = list(projects or [])
+    if projects_file:
+        projects.extend(read_projects_file(projects_file))
+
+    results = obtain_instances_for_projects(
+        config,
+        site,
+        projects,
+        tidy,
+        os.path.join(default_base_path(), "discovery"),
+        refresh_discovery,
+        all_projects,
+        parallel,
+        instance_filter,
+    )
+
+    failed = False
+    for result in results:
+        if result.error:
+            failed = True
+            print(
+                f"{result.project}: import failed after {result.elapsed:.2f}s: {result.error}"
+            )
+        elif result.unchanged:
+            print(f"{result.project}: unchanged in {result.elapsed:.2f}s")
+        else:
+            print(
+                f"{result.project}: {result.inserted} imported, {result.deleted} removed in {result.elapsed:.2f}s"
+            )
+            for change in result.changes:
+                print(f"  {change}")
+    print(f"Imported {sum(result.inserted for result in results)} instances.")
     if tidy:
-        print(f"Removed {delete_count} instances.")
-        
-            
+        print(f"Removed {sum(result.deleted for result in results)} instances.")
+        stop_removed_instances(
+            config,
+            site,
+            running_instances,
+            [connection_name for result in results for connection_name in result.removed],
+        )
+    return not failed
+
 
 def update(
     site: Site,
@@ -140,11 +602,14 @@ def update(
     new_iam: Optional[str],
     new_nick: Optional[str],
     new_default: Optional[str],
+    new_port: Optional[int] = None,
+    new_pinned: Optional[str] = None,
 ):
     instance = get_instance_from_nick(site, name, project)
     if instance:
         if new_iam:
             instance.set_iam(new_iam.lower() == "true")
+            site.mark_dirty(instance)
 
         if new_nick:
             try:
@@ -156,18 +621,34 @@ def update(
             if other_instance:
                 print("That nick would not be unique, pick another.")
             else:
-                instance.nick_name = new_nick
-                site.set_up_nicknames()
+                site.rename_instance(instance, new_nick)
 
         if new_default:
             instance.set_default(new_default.lower() == "true")
+            site.mark_dirty(instance)
+
+        if new_port:
+            try:
+                site.pin_port(instance, new_port)
+            except PortInUseError as err:
+                print(str(err))
+
+        if new_pinned:
+            instance.set_pinned(new_pinned.lower() == "true")
+            site.mark_dirty(instance)
 
         print("Instance updated:")
         print(instance.print(None))
 
 
 def update_config(
-    config: Configuration, new_path: Optional[str], new_enable_iam: Optional[str]
+    config: Configuration,
+    new_path: Optional[str],
+    new_enable_iam: Optional[str],
+    port_range: Optional[Tuple[int, int]] = None,
+    project_port_range: Optional[Tuple[str, Tuple[int, int]]] = None,
+    reserve_ports: Optional[List[int]] = None,
+    max_proxies: Optional[int] = None,
 ):
     if new_path:
         try:
@@ -182,7 +663,40 @@ def update_config(
         config.set_enable_iam_by_default(new_enable_iam.lower() == "true")
         print(f"Updated default IAM setting to: {config.enable_iam_by_default}")
 
-    if not new_enable_iam and not new_path:
+    if port_range:
+        try:
+            config.set_port_range(port_range)
+            print(f"Updated port range to {port_range[0]}-{port_range[1]}")
+        except PortRangeError as err:
+            print(str(err))
+
+    if project_port_range:
+        project, new_range = project_port_range
+        try:
+            config.set_port_range(new_range, project)
+            print(f"Updated port range for {project} to {new_range[0]}-{new_range[1]}")
+        except PortRangeError as err:
+            print(str(err))
+
+    for port in reserve_ports or []:
+        config.reserve_port(port)
+        print(f"Reserved port {port}")
+
+    if max_proxies is not None:
+        config.set_max_proxies(max_proxies)
+        if config.max_proxies:
+            print(f"Updated the limit on running proxies to {config.max_proxies}")
+        else:
+            print("Removed the limit on running proxies")
+
+    if not (
+        new_enable_iam
+        or new_path
+        or port_range
+        or project_port_range
+        or reserve_ports
+        or max_proxies is not None
+    ):
         print(config.print())
 
 
@@ -195,21 +709,98 @@ def add_instance(
         )
         print("Added new instance")
         print(new_instance.print(None))
-    except (InvalidConnectionName, DuplicateInstanceError) as err:
+    except (InvalidConnectionName, DuplicateInstanceError, PortsExhaustedError) as err:
         print(str(err))
 
 
 def remove_instance(
-    site: Site, running_instances: RunningInstances, name: str, project: Optional[str]
+    site: Site,
+    running_instances: RunningInstances,
+    name: str,
+    project: Optional[str],
+    config: Optional[Configuration] = None,
 ):
     instance = get_instance_from_nick(site, name, project)
     if instance:
         if instance.connection_name in running_instances.instances:
-            stop(site, instance.nick_name, instance.project)
+            stop(
+                site,
+                running_instances,
+                instance.nick_name,
+                instance.project,
+                config=config,
+            )
         site.remove_instance(instance.connection_name)
         print(f"Removed connection: {instance.connection_name}")
 
 
+def load_site_for_command(
+    persistence,
+    parameters: Dict[str, str],
+    config: Optional[Configuration] = None,
+    running_instances: Optional[RunningInstances] = None,
+) -> Site:
+    command = parameters["command"]
+    if command in ("start", "stop"):
+        scoped = parameters["name"] not in ("default", "all")
+    else:
+        # a new nickname or port has to be checked against every other instance
+        scoped = command == "remove" or (
+            command == "update" and not parameters["nick"] and not parameters["port"]
+        )
+    if not scoped:
+        return persistence.load_site()
+    # making room for a start needs to know which running proxies are pinned
+    if command == "start" and config is not None and config.max_proxies:
+        return persistence.load_site()
+    site = persistence.load_site_for_nick_name(parameters["name"], parameters["project"])
+    # stopping or removing one member of a grouped proxy restarts the others
+    if running_instances is not None and any(
+        len(running_instances.get_group(name)) > 1
+        for name in site.instances
+        if running_instances.get_running(name)
+    ):
+        return persistence.load_site()
+    return site
+
+
+def load_state(
+    persistence, parameters: Dict[str, str]
+) -> Tuple[Optional[Configuration], Optional[Site], Optional[RunningInstances]]:
+    needs = COMMAND_STATE.get(parameters["command"], ())
+    config = persistence.load_config() if "config" in needs else None
+    running = persistence.load_running() if "running" in needs else None
+    if running is not None:
+        refresh_running(running)
+    site = (
+        load_site_for_command(persistence, parameters, config, running)
+        if "site" in needs
+        else None
+    )
+    if config is not None and site is not None:
+        site.configure_ports(
+            config.port_range, config.project_port_ranges, config.reserved_ports
+        )
+    return config, site, running
+
+
+def save_state(
+    persistence,
+    config: Optional[Configuration],
+    site: Optional[Site],
+    running_instances: Optional[RunningInstances],
+):
+    if running_instances is not None and running_instances.dirty:
+        persistence.save_running(running_instances)
+        running_instances.dirty = False
+    if site is not None and site.dirty:
+        persistence.save_site(site)
+        site.mark_saved()
+    if config is not None and config.dirty:
+        persistence.save_config(config)
+        config.dirty = False
+
+
 def execute_command(
     parameters: Dict[str, str],
     config: Configuration,
@@ -217,20 +808,48 @@ def execute_command(
     running_instances: RunningInstances,
 ):
     command = parameters["command"]
+    exit_code = 0
 
     if command == "list":
-        print_list(site, parameters["project"], parameters["filter"])
+        print_list(
+            site, parameters["project"], parameters["filter"], parameters["format"]
+        )
 
     elif command == "list-running":
-        print_list_running(site, running_instances)
+        print_list_running(site, running_instances, parameters["format"])
 
     elif command == "start":
-        start(
-            config, site, running_instances, parameters["name"], parameters["project"]
-        )
+        if not start(
+            config,
+            site,
+            running_instances,
+            parameters["name"],
+            parameters["project"],
+            parameters["wait"],
+            parameters["timeout"],
+            parameters["parallel"],
+            parameters["group"],
+        ):
+            exit_code = 1
 
     elif command == "stop":
-        stop(site, running_instances, parameters["name"], parameters["project"])
+        stop(
+            site,
+            running_instances,
+            parameters["name"],
+            parameters["project"],
+            parameters["grace"],
+            config,
+        )
+
+    elif command == "reap":
+        reap(
+            site,
+            running_instances,
+            parameters["idle"],
+            parameters["project"],
+            parameters["dry_run"],
+        )
 
     elif command == "update":
         update(
@@ -240,35 +859,89 @@ def execute_command(
             parameters["iam"],
             parameters["nick"],
             parameters["default"],
+            parameters["port"],
+            parameters["pinned"],
         )
 
     elif command == "import":
-        import_instances(config, site, parameters["project"], parameters["tidy"])
+        if not import_instances(
+            config,
+            site,
+            running_instances,
+            parameters["project"],
+            parameters["tidy"],
+            parameters["refresh_discovery"],
+            parameters["projects_file"],
+            parameters["all_projects"],
+            parameters["parallel"],
+            parameters["filter"],
+        ):
+            exit_code = 1
 
     elif command == "config":
-        update_config(config, parameters["path"], parameters["iam_default"])
+        update_config(
+            config,
+            parameters["path"],
+            parameters["iam_default"],
+            parameters["port_range"],
+            parameters["project_port_range"],
+            parameters["reserve"],
+            parameters["max_proxies"],
+        )
 
     elif command == "add":
         add_instance(config, site, parameters["connection_name"], parameters["nick"])
 
     elif command == "remove":
         remove_instance(
-            site, running_instances, parameters["name"], parameters["project"]
+            site,
+            running_instances,
+            parameters["name"],
+            parameters["project"],
+            config,
         )
 
     else:
         print("Specify a command or ask for help with --help")
 
+    return exit_code
+
 
 def run():  # pragma: no cover
-    persistence = Persistence(default_base_path())
-    app_config = persistence.load_config()
     app_parameters = get_parameters(sys.argv[1:])
-    site_info = persistence.load_site()
-    running = persistence.load_running()
-    refresh_running(running)
-    execute_command(app_parameters, app_config, site_info, running)
-    persistence.save_running(running)
-    persistence.save_site(site_info)
-    persistence.save_config(app_config)
-    sys.exit()
+    if app_parameters["command"] == "daemon":
+        from cloud_sql.daemon import serve, stop_daemon
+        from cloud_sql.supervision import RestartPolicy
+
+        if app_parameters["stop"]:
+            sys.exit(stop_daemon(default_base_path()))
+        policy = None
+        if app_parameters["supervise"]:
+            policy = RestartPolicy(max_restarts=app_parameters["max_restarts"])
+        sys.exit(
+            serve(
+                default_base_path(),
+                policy=policy,
+                lazy=app_parameters["lazy"],
+                idle_timeout=app_parameters["idle_timeout"],
+                reap_idle=app_parameters["reap_idle"],
+            )
+        )
+
+    # only pay for importing the daemon client when a daemon may be listening
+    if (
+        app_parameters["command"]
+        and not os.getenv("CLOUD_SQL_NO_DAEMON")
+        and os.path.exists(daemon_socket_path(default_base_path()))
+    ):
+        from cloud_sql.daemon import forward_command
+
+        exit_code = forward_command(default_base_path(), sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    persistence = open_persistence(default_base_path())
+    app_config, site_info, running = load_state(persistence, app_parameters)
+    exit_code = execute_command(app_parameters, app_config, site_info, running)
+    save_state(persistence, app_config, site_info, running)
+    sys.exit(exit_code)
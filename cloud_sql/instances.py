@@ -1,7 +1,8 @@
 import json
-from typing import Dict, Optional, List
+import sys
+from typing import Any, Dict, Iterable, Iterator, Optional, List, Set, Tuple
 
-import jsonpickle
+from cloud_sql.ports import DEFAULT_PORT_RANGE, PortAllocator, PortInUseError
 
 
 class InstanceNotFoundError(Exception):
@@ -17,6 +18,22 @@ class InvalidConnectionName(Exception):
 
 
 class Instance(object):
+    # slotted, with the nickname and connection name derived from the other
+    # fields unless they have been set to something else, and the strings
+    # shared by many instances interned
+    __slots__ = (
+        "port",
+        "iam",
+        "default",
+        "name",
+        "region",
+        "project",
+        "fingerprint",
+        "pinned",
+        "_nick_name",
+        "_connection_name",
+    )
+
     def __init__(
         self,
         name: str,
@@ -29,13 +46,54 @@ class Instance(object):
         self.iam = enable_iam
         self.default = False
         self.name = name
-        self.nick_name = name[: name.find("-instance-")]
-        self.region = region
-        self.project = project
+        self._nick_name = None
+        self.region = sys.intern(region) if region else region
+        self.project = sys.intern(project) if project else project
+        self._connection_name = None
         self.connection_name = connection_name
+        self.fingerprint: Optional[str] = None
+        self.pinned = False
+
+    @property
+    def nick_name(self) -> str:
+        if self._nick_name is not None:
+            return self._nick_name
+        return self.name[: self.name.find("-instance-")]
+
+    @nick_name.setter
+    def nick_name(self, nick_name: str):
+        self._nick_name = None
+        if nick_name != self.nick_name:
+            self._nick_name = nick_name
+
+    @property
+    def connection_name(self) -> str:
+        if self._connection_name is not None:
+            return self._connection_name
+        return f"{self.project}:{self.region}:{self.name}"
+
+    @connection_name.setter
+    def connection_name(self, connection_name: str):
+        self._connection_name = None
+        if connection_name != self.connection_name:
+            self._connection_name = connection_name
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "nick_name": self.nick_name,
+            "region": self.region,
+            "project": self.project,
+            "connection_name": self.connection_name,
+            "port": self.port,
+            "iam": self.iam,
+            "default": self.default,
+            "fingerprint": self.fingerprint,
+            "pinned": self.pinned,
+        }
 
     def __repr__(self):  # pragma: no cover
-        return json.dumps(self.__dict__)
+        return json.dumps(self.to_dict())
 
     def assign_port(self, port: int):
         self.port = port
@@ -52,74 +110,159 @@ class Instance(object):
     def set_default(self, default: bool):
         self.default = default
 
-    def check(self):  # pragma: no cover
-        if not hasattr(self, "default"):
-            self.default = False
-        if hasattr(self, "shortname") and not hasattr(self, "nick_name"):
-            self.nick_name = self.shortname
-            delattr(self, "shortname")
+    def set_pinned(self, pinned: bool):
+        self.pinned = pinned
 
 
 class Site(object):
     def __init__(self, instances: Dict[str, Instance]):
-        self.nicknames = {}
+        self.nicknames: Dict[str, List[Instance]] = {}
+        self.project_nicknames: Dict[Tuple[str, str], List[Instance]] = {}
         self.instances = instances
-        self.nextPort = 0
-        ports = [
-            instance.port
-            for instance in instances.values()
-            if instance.port is not None
-        ]
-        ports.insert(0, 5433)
-        self.nextPort = max(ports) + 1
+        self.project_markers: Dict[str, str] = {}
+        self.dirty = False
+        # connection names written or deleted since the site was last saved,
+        # so a store that keeps one row per instance only touches those rows;
+        # None until a store starts tracking, meaning every instance is new
+        self.changed: Optional[Set[str]] = None
+        self.removed: Set[str] = set()
+        self.search_index = None
+        self.ports = PortAllocator()
+        self.claim_ports()
+        self.set_up_nicknames()
 
     def __repr__(self):  # pragma: no cover
-        return jsonpickle.encode(self)
+        return repr(list(self.instances.values()))
+
+    def mark_dirty(self, instance: Optional[Instance] = None):
+        # instances may have changed, so the cached search index is stale
+        self.dirty = True
+        self.search_index = None
+        if instance is not None and self.changed is not None:
+            self.changed.add(instance.connection_name)
+
+    def mark_saved(self):
+        self.dirty = False
+        self.changed = set()
+        self.removed = set()
 
     def connection_names(self) -> List[str]:
         return [instance.connection_name for instance in self.instances.values()]
 
+    def claim_ports(self):
+        for instance in self.instances.values():
+            if instance.port is not None:
+                self.ports.claim(instance.port)
+
+    def configure_ports(
+        self,
+        port_range: Tuple[int, int] = DEFAULT_PORT_RANGE,
+        project_ranges: Optional[Dict[str, Tuple[int, int]]] = None,
+        reserved: Iterable[int] = (),
+    ):
+        self.ports = PortAllocator(port_range, project_ranges, reserved)
+        self.claim_ports()
+
+    def pin_port(self, instance: Instance, port: int):
+        if port == instance.port:
+            return
+        if self.ports.is_used(port):
+            raise PortInUseError(f"Port {port} is already assigned to another instance")
+        self.ports.release(instance.port)
+        self.ports.claim(port)
+        instance.port = port
+        self.mark_dirty(instance)
+
     def set_up_nicknames(self):
         self.nicknames = {}
+        self.project_nicknames = {}
         for instance in self.instances.values():
-            if instance.nick_name in self.nicknames.keys():
-                if instance not in self.nicknames[instance.nick_name]:
-                    self.nicknames[instance.nick_name].append(instance)
-            else:
-                self.nicknames[instance.nick_name] = [instance]
+            self.index_instance(instance)
+
+    def index_instance(self, instance: Instance):
+        self.search_index = None
+        self.nicknames.setdefault(instance.nick_name, []).append(instance)
+        self.project_nicknames.setdefault(
+            (instance.project, instance.nick_name), []
+        ).append(instance)
+
+    def unindex_instance(self, instance: Instance):
+        self.search_index = None
+        for index, key in (
+            (self.nicknames, instance.nick_name),
+            (self.project_nicknames, (instance.project, instance.nick_name)),
+        ):
+            entries = index[key]
+            entries.remove(instance)
+            if not entries:
+                del index[key]
+
+    def rename_instance(self, instance: Instance, nick_name: str):
+        self.unindex_instance(instance)
+        instance.nick_name = nick_name
+        self.index_instance(instance)
+        self.mark_dirty(instance)
 
     def update(self, instance: Instance) -> bool:
         if instance.connection_name not in self.instances.keys():
             if instance.port is None:
-                instance.port = self.nextPort
-                self.nextPort += 1
+                instance.port = self.ports.allocate(instance.project)
+            else:
+                self.ports.claim(instance.port)
             self.instances[instance.connection_name] = instance
+            self.index_instance(instance)
+            self.mark_dirty(instance)
             return True
         else:
             return False
 
-    def print_list(self, project: Optional[str], filter_string: Optional[str]) -> List[str]:
-        return [
-            instance.print(None)
-            for instance in sorted(
-                self.instances.values(),
-                key=lambda instance: f"{instance.project}{instance.nick_name}",
-            )
-            if ((not project) or (instance.project == project))
-            and ((not filter_string) or (filter_string in instance.print(None)))
-        ]
+    def refresh(self, instance: Instance) -> bool:
+        # the fields a fingerprint covers are all part of the connection name,
+        # so only a fingerprint written by an older version can differ
+        existing = self.instances[instance.connection_name]
+        if existing.fingerprint == instance.fingerprint:
+            return False
+        existing.fingerprint = instance.fingerprint
+        self.mark_dirty(existing)
+        return True
+
+    def set_project_marker(self, project: str, marker: str) -> bool:
+        if self.project_markers.get(project) == marker:
+            return False
+        self.project_markers[project] = marker
+        self.dirty = True
+        return True
+
+    def find(self, project: Optional[str], query: Optional[str]) -> List[Instance]:
+        instances: Iterable[Instance] = self.instances.values()
+        if query:
+            from cloud_sql.search import SearchIndex
+
+            # kept until the instances change, so the daemon searches an index
+            if self.search_index is None:
+                self.search_index = SearchIndex(instances)
+            instances = self.search_index.search(query)
+        return sorted(
+            (
+                instance
+                for instance in instances
+                if (not project) or (instance.project == project)
+            ),
+            key=lambda instance: (instance.project, instance.nick_name),
+        )
+
+    def print_list(self, project: Optional[str], filter_string: Optional[str]) -> Iterator[str]:
+        return (instance.print(None) for instance in self.find(project, filter_string))
 
     def get_instance_by_nick_name(self, name, project) -> Optional[Instance]:
 
         if name not in self.nicknames:
             raise InstanceNotFoundError("No instance found with that nickname")
 
-        possibles = self.nicknames[name]
-
         if project:
-            possibles = [
-                possible for possible in possibles if possible.project == project
-            ]
+            possibles = self.project_nicknames.get((project, name), [])
+        else:
+            possibles = self.nicknames[name]
 
         if not possibles:
             raise InstanceNotFoundError(
@@ -140,10 +283,6 @@ class Site(object):
             if (not project or instance.project == project) and instance.default
         ]
 
-    def check(self):
-        for instance in self.instances.values():
-            instance.check()
-
     def add_instance(
         self, connection_name: str, nick_name: Optional[str], enable_iam: bool
     ) -> Instance:
@@ -174,15 +313,23 @@ class Site(object):
                     "An instance already exists for that nick_name and project"
                 )
 
-        if connection_name in self.connection_names():
+        if connection_name in self.instances:
             raise DuplicateInstanceError(
                 "An instance already exists for that name and project"
             )
 
         self.update(instance)
-        self.set_up_nicknames()
         return instance
 
     def remove_instance(self, connection_name: str):
-        self.instances.pop(connection_name)
-        self.set_up_nicknames()
+        self.remove_instances([connection_name])
+
+    def remove_instances(self, connection_names: Iterable[str]):
+        for connection_name in connection_names:
+            instance = self.instances.pop(connection_name)
+            self.unindex_instance(instance)
+            self.ports.release(instance.port)
+            self.mark_dirty()
+            if self.changed is not None:
+                self.changed.discard(connection_name)
+            self.removed.add(connection_name)
@@ -0,0 +1,239 @@
+import os
+import selectors
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, Optional, Set
+
+from cloud_sql.cloud_sql_proxy import (
+    CloudProxyNotFoundError,
+    process_start_time,
+    proxy_command,
+)
+from cloud_sql.config import Configuration
+from cloud_sql.instances import Instance, Site
+from cloud_sql.running_instances import RunningInstances
+
+
+class LazyProxy(object):
+    def __init__(self, instance: Instance, listener: socket.socket):
+        self.connection_name = instance.connection_name
+        self.nick_name = instance.nick_name
+        self.port = instance.port
+        self.iam = instance.iam
+        self.listener = listener
+        self.process: Optional[subprocess.Popen] = None
+        self.socket_path: Optional[str] = None
+        self.generation = 0
+        self.connections = 0
+        self.last_active = time.monotonic()
+        self.lock = threading.Lock()
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+
+def connect_unix(path: str, timeout: float, interval: float = 0.05):
+    deadline = time.monotonic() + timeout
+    while True:
+        upstream = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            upstream.connect(path)
+            return upstream
+        except OSError:
+            upstream.close()
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+
+
+def pump(source: socket.socket, destination: socket.socket):
+    try:
+        while True:
+            data = source.recv(65536)
+            if not data:
+                break
+            destination.sendall(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            destination.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+# the daemon listens on the port of every instance that is not running, and
+# only starts its proxy, on a private unix socket, when a client connects;
+# connections are relayed to it and it is stopped again once nothing has
+# been connected for the idle timeout
+class LazyProxies(object):
+    def __init__(
+        self,
+        socket_dir: str,
+        selector: selectors.BaseSelector,
+        idle_timeout: float = 600.0,
+        ready_timeout: float = 30.0,
+    ):
+        self.socket_dir = socket_dir
+        self.selector = selector
+        self.idle_timeout = idle_timeout
+        self.ready_timeout = ready_timeout
+        self.proxies: Dict[str, LazyProxy] = {}
+        self.unavailable: Set[str] = set()
+        os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+
+    def sync(self, site: Site, running_instances: RunningInstances):
+        for name, proxy in list(self.proxies.items()):
+            instance = site.instances.get(name)
+            pid = running_instances.get_running(name)
+            started_elsewhere = pid is not None and (
+                proxy.process is None or proxy.process.pid != pid
+            )
+            if instance is None or instance.port != proxy.port or started_elsewhere:
+                self.close_proxy(proxy, running_instances)
+        for name, instance in site.instances.items():
+            if (
+                name not in self.proxies
+                and instance.port is not None
+                and running_instances.get_running(name) is None
+            ):
+                self.listen(instance)
+
+    def listen(self, instance: Instance):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind(("127.0.0.1", instance.port))
+            listener.listen()
+        except OSError as err:
+            listener.close()
+            if instance.connection_name not in self.unavailable:
+                self.unavailable.add(instance.connection_name)
+                print(
+                    f"Could not listen on port {instance.port} for {instance.nick_name}: {err}"
+                )
+            return
+        self.unavailable.discard(instance.connection_name)
+        listener.setblocking(False)
+        proxy = LazyProxy(instance, listener)
+        self.proxies[instance.connection_name] = proxy
+        self.selector.register(listener, selectors.EVENT_READ, proxy)
+
+    def accept(
+        self,
+        proxy: LazyProxy,
+        config: Configuration,
+        running_instances: RunningInstances,
+    ):
+        try:
+            client, _ = proxy.listener.accept()
+        except BlockingIOError:
+            return
+        client.setblocking(True)
+        if not proxy.is_running() and not self.spawn(proxy, config, running_instances):
+            # the listener stays up so that a later connection tries again
+            client.close()
+            return
+        with proxy.lock:
+            proxy.connections += 1
+        threading.Thread(
+            target=self.relay, args=(proxy, proxy.socket_path, client), daemon=True
+        ).start()
+
+    def spawn(
+        self,
+        proxy: LazyProxy,
+        config: Configuration,
+        running_instances: RunningInstances,
+    ) -> bool:
+        # a fresh socket per start, so a proxy that is still shutting down
+        # cannot remove the socket of the one replacing it
+        proxy.generation += 1
+        proxy.socket_path = os.path.join(
+            self.socket_dir, f"{proxy.port}-{proxy.generation}.sock"
+        )
+        try:
+            command = proxy_command(
+                config.cloud_sql_path,
+                [(proxy.connection_name, f"unix:{proxy.socket_path}")],
+                proxy.iam,
+            )
+            proxy.process = subprocess.Popen(command, start_new_session=True)
+        except (CloudProxyNotFoundError, OSError) as err:
+            print(f"Could not start {proxy.nick_name} on port {proxy.port}: {err}")
+            return False
+        proxy.last_active = time.monotonic()
+        running_instances.add_running(
+            proxy.process.pid,
+            proxy.connection_name,
+            process_start_time(proxy.process.pid),
+            proxy.port,
+            config.cloud_sql_path,
+        )
+        print(f"Started {proxy.nick_name} on port {proxy.port} for a new connection")
+        return True
+
+    def relay(self, proxy: LazyProxy, socket_path: str, client: socket.socket):
+        try:
+            upstream = connect_unix(socket_path, self.ready_timeout)
+            if upstream is None:
+                return
+            with upstream:
+                replies = threading.Thread(target=pump, args=(upstream, client))
+                replies.start()
+                pump(client, upstream)
+                replies.join()
+        finally:
+            client.close()
+            with proxy.lock:
+                proxy.connections -= 1
+                proxy.last_active = time.monotonic()
+
+    def reap_idle(self, running_instances: RunningInstances):
+        now = time.monotonic()
+        for proxy in self.proxies.values():
+            if proxy.process is None:
+                continue
+            if proxy.process.poll() is not None:
+                self.stop_proxy(proxy, running_instances)
+                continue
+            with proxy.lock:
+                idle = (
+                    proxy.connections == 0
+                    and now - proxy.last_active >= self.idle_timeout
+                )
+            if idle:
+                self.stop_proxy(proxy, running_instances)
+                print(
+                    f"Stopped {proxy.nick_name} after {self.idle_timeout:.0f}s without connections"
+                )
+
+    def stop_proxy(self, proxy: LazyProxy, running_instances: RunningInstances):
+        process, proxy.process = proxy.process, None
+        if process.poll() is None:
+            process.terminate()
+        if running_instances.get_running(proxy.connection_name) == process.pid:
+            running_instances.remove_running(proxy.connection_name)
+        try:
+            os.unlink(proxy.socket_path)
+        except OSError:
+            pass
+
+    def close_proxy(self, proxy: LazyProxy, running_instances: RunningInstances):
+        if proxy.process is not None:
+            self.stop_proxy(proxy, running_instances)
+        self.selector.unregister(proxy.listener)
+        proxy.listener.close()
+        del self.proxies[proxy.connection_name]
+
+    def release_listeners(self, running_instances: RunningInstances):
+        # let a start command bind the ports that have no proxy behind them yet
+        for proxy in list(self.proxies.values()):
+            if proxy.process is None:
+                self.close_proxy(proxy, running_instances)
+
+    def close(self, running_instances: RunningInstances):
+        for proxy in list(self.proxies.values()):
+            self.close_proxy(proxy, running_instances)
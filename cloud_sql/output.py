@@ -0,0 +1,55 @@
+import csv
+import json
+import sys
+from typing import Any, Dict, Iterable, Optional, TextIO, Tuple
+
+from cloud_sql.instances import Instance
+
+FORMATS = ("table", "json", "ndjson", "csv")
+INSTANCE_FIELDS = (
+    "project",
+    "nick_name",
+    "port",
+    "name",
+    "region",
+    "iam",
+    "default",
+    "connection_name",
+)
+
+
+def instance_row(instance: Instance, pid: Optional[int]) -> Dict[str, Any]:
+    row: Dict[str, Any] = {"pid": pid} if pid else {}
+    row.update((field, getattr(instance, field)) for field in INSTANCE_FIELDS)
+    return row
+
+
+def write_instances(
+    instances: Iterable[Tuple[Instance, Optional[int]]],
+    output_format: str,
+    running: bool = False,
+    out: Optional[TextIO] = None,
+) -> int:
+    # rows are written one at a time as the iterable yields them, so nothing
+    # is held in memory beyond the current instance
+    out = out or sys.stdout
+    count = 0
+    if output_format == "csv":
+        fields = (("pid",) if running else ()) + INSTANCE_FIELDS
+        writer = csv.DictWriter(out, fieldnames=fields, lineterminator="\n")
+        writer.writeheader()
+    elif output_format == "json":
+        out.write("[")
+    for instance, pid in instances:
+        if output_format == "table":
+            out.write(instance.print(pid) + "\n")
+        elif output_format == "csv":
+            writer.writerow(instance_row(instance, pid))
+        elif output_format == "json":
+            out.write(("," if count else "") + "\n  " + json.dumps(instance_row(instance, pid)))
+        else:
+            out.write(json.dumps(instance_row(instance, pid)) + "\n")
+        count += 1
+    if output_format == "json":
+        out.write("\n]\n" if count else "]\n")
+    return count
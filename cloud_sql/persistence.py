@@ -1,17 +1,43 @@
 import os
 import os.path
-
-import jsonpickle
+from typing import Optional
 
 from cloud_sql.config import Configuration, default_configuration
 from cloud_sql.instances import Site
 from cloud_sql.running_instances import RunningInstances
+from cloud_sql.schema import (
+    config_from_dict,
+    config_to_dict,
+    dumps,
+    read_document,
+    running_from_dict,
+    running_to_dict,
+    site_from_dict,
+    site_to_dict,
+)
+
+
+DAEMON_SOCKET = "daemon.sock"
 
 
 def default_base_path() -> str:
     return os.path.join(os.getenv("HOME"), ".cloudsql")
 
 
+def daemon_socket_path(base_path: str) -> str:
+    return os.path.join(base_path, DAEMON_SOCKET)
+
+
+def open_persistence(base_path: str):
+    if os.getenv("CLOUD_SQL_STATE_BACKEND") == "sqlite" or os.path.exists(
+        os.path.join(base_path, "state.db")
+    ):
+        from cloud_sql.sqlite_store import SqlitePersistence
+
+        return SqlitePersistence(base_path)
+    return Persistence(base_path)
+
+
 class Persistence(object):
     def __init__(self, base_path: str):
         self.instance_filename = os.path.join(base_path, "instances.json")
@@ -23,46 +49,42 @@ class Persistence(object):
             os.makedirs(os.path.dirname(self.instance_filename))
 
         with open(self.instance_filename, "w") as f:
-            f.write(jsonpickle.encode(site))
+            f.write(dumps(site_to_dict(site)))
 
     def load_site(self) -> Site:
         if not os.path.exists(self.instance_filename):
             return Site({})
         else:
             with open(self.instance_filename, "r") as f:
-                json_str = f.read()
-                site = jsonpickle.decode(json_str)
-                site.check()
-                return site
+                return site_from_dict(read_document(f.read()))
+
+    def load_site_for_nick_name(self, nick_name: str, project: Optional[str]) -> Site:
+        return self.load_site()
 
     def save_config(self, config: Configuration):
         if not os.path.exists(os.path.dirname(self.config_filename)):
             os.makedirs(os.path.dirname(self.config_filename))
 
         with open(self.config_filename, "w") as f:
-            f.write(jsonpickle.encode(config))
+            f.write(dumps(config_to_dict(config)))
 
     def load_config(self) -> Configuration:
         if not os.path.exists(self.config_filename):
             return default_configuration()
         else:
             with open(self.config_filename, "r") as f:
-                json_str = f.read()
-                config = jsonpickle.decode(json_str)
-                config.check()
-                return config
+                return config_from_dict(read_document(f.read()))
 
     def save_running(self, running_instances: RunningInstances):
         if not os.path.exists(os.path.dirname(self.running_instances_filename)):
             os.makedirs(os.path.dirname(self.running_instances_filename))
 
         with open(self.running_instances_filename, "w") as f:
-            f.write(jsonpickle.encode(running_instances))
+            f.write(dumps(running_to_dict(running_instances)))
 
     def load_running(self) -> RunningInstances:
         if not os.path.exists(self.running_instances_filename):
             return RunningInstances({})
         else:
             with open(self.running_instances_filename, "r") as f:
-                json_str = f.read()
-                return jsonpickle.decode(json_str)
+                return running_from_dict(read_document(f.read()))
@@ -0,0 +1,108 @@
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+DEFAULT_PORT_RANGE = (5434, 9999)
+
+
+class PortInUseError(Exception):
+    pass
+
+
+class PortsExhaustedError(Exception):
+    pass
+
+
+class PortRangeError(Exception):
+    pass
+
+
+# one bit per port in the range; project sub-ranges and reserved ports are
+# fenced off from general allocation, and ports outside the range are kept in a
+# set so that existing instances can still claim them
+class PortAllocator(object):
+    def __init__(
+        self,
+        port_range: Tuple[int, int] = DEFAULT_PORT_RANGE,
+        project_ranges: Optional[Dict[str, Tuple[int, int]]] = None,
+        reserved: Iterable[int] = (),
+    ):
+        self.start, self.end = port_range
+        if self.start > self.end:
+            raise PortRangeError(f"Port range {self.start}-{self.end} is empty")
+        self.project_ranges = dict(project_ranges or {})
+        size = (self.end - self.start) // 8 + 1
+        self.used = bytearray(size)
+        self.reserved = bytearray(size)
+        self.fenced = bytearray(size)
+        self.outside: Set[int] = set()
+        for project, (start, end) in self.project_ranges.items():
+            if start > end or start < self.start or end > self.end:
+                raise PortRangeError(
+                    f"Port range {start}-{end} for {project} is not inside {self.start}-{self.end}"
+                )
+            for port in range(start, end + 1):
+                self._set(self.fenced, port)
+        for port in reserved:
+            if self.start <= port <= self.end:
+                self._set(self.reserved, port)
+                self._set(self.fenced, port)
+
+    def _set(self, bitmap: bytearray, port: int):
+        offset = port - self.start
+        bitmap[offset >> 3] |= 1 << (offset & 7)
+
+    def _clear(self, bitmap: bytearray, port: int):
+        offset = port - self.start
+        bitmap[offset >> 3] &= ~(1 << (offset & 7))
+
+    def _test(self, bitmap: bytearray, port: int) -> bool:
+        offset = port - self.start
+        return bool(bitmap[offset >> 3] & (1 << (offset & 7)))
+
+    def is_used(self, port: int) -> bool:
+        if self.start <= port <= self.end:
+            return self._test(self.used, port)
+        return port in self.outside
+
+    def claim(self, port: int) -> bool:
+        if self.is_used(port):
+            return False
+        if self.start <= port <= self.end:
+            self._set(self.used, port)
+        else:
+            self.outside.add(port)
+        return True
+
+    def release(self, port: Optional[int]):
+        if port is None:
+            return
+        if self.start <= port <= self.end:
+            self._clear(self.used, port)
+        else:
+            self.outside.discard(port)
+
+    def _first_free(self, start: int, end: int, blocked: bytearray) -> Optional[int]:
+        first = (start - self.start) >> 3
+        last = (end - self.start) >> 3
+        for index in range(first, last + 1):
+            # skip whole bytes of taken ports before looking at single bits
+            taken = self.used[index] | blocked[index]
+            if taken == 0xFF:
+                continue
+            for bit in range(8):
+                port = self.start + (index << 3) + bit
+                if start <= port <= end and not taken & (1 << bit):
+                    return port
+        return None
+
+    def allocate(self, project: Optional[str] = None) -> int:
+        if project in self.project_ranges:
+            start, end = self.project_ranges[project]
+            port = self._first_free(start, end, self.reserved)
+        else:
+            port = self._first_free(self.start, self.end, self.fenced)
+        if port is None:
+            raise PortsExhaustedError(
+                f"No free ports left for {project or 'new instances'}"
+            )
+        self._set(self.used, port)
+        return port
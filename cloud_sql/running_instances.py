@@ -1,23 +1,77 @@
-from typing import Dict, Optional
+import time
+from typing import Any, Dict, List, Optional
+
+
+class RunningInstance(object):
+    def __init__(
+        self,
+        pid: int,
+        start_time: Optional[float],
+        port: Optional[int],
+        path: Optional[str],
+        restarts: Optional[List[Dict[str, Any]]] = None,
+        last_used: Optional[float] = None,
+    ):
+        self.pid = pid
+        self.start_time = start_time
+        self.port = port
+        self.path = path
+        self.restarts = restarts or []
+        # wall clock time the proxy was started or last seen with a connection
+        self.last_used = last_used
 
 
 class RunningInstances(object):
-    def __init__(self, instances: Dict[str, int]):
+    def __init__(self, instances: Dict[str, RunningInstance]):
         self.instances = instances
+        self.dirty = False
+
+    def add_running(
+        self,
+        pid: int,
+        connection_name: str,
+        start_time: Optional[float] = None,
+        port: Optional[int] = None,
+        path: Optional[str] = None,
+        restarts: Optional[List[Dict[str, Any]]] = None,
+    ):
+        self.instances[connection_name] = RunningInstance(
+            pid, start_time, port, path, restarts, time.time()
+        )
+        self.dirty = True
 
-    def add_running(self, pid: int, connection_name: str):
-        self.instances[connection_name] = pid
+    def mark_used(self, connection_name: str, when: Optional[float] = None):
+        self.instances[connection_name].last_used = when or time.time()
+        self.dirty = True
 
     def get_running(self, connection_name: str) -> Optional[int]:
         if connection_name in self.instances.keys():
-            return self.instances[connection_name]
+            return self.instances[connection_name].pid
         else:
             return None
 
+    def get_running_instance(self, connection_name: str) -> Optional[RunningInstance]:
+        return self.instances.get(connection_name)
+
+    def get_group(self, connection_name: str) -> List[str]:
+        # instances started together in one proxy share its pid
+        pid = self.get_running(connection_name)
+        return [
+            name for name, running in self.instances.items() if running.pid == pid
+        ]
+
     def get_all_running(
         self,
     ) -> Dict[str, int]:
+        return {
+            connection_name: running.pid
+            for connection_name, running in self.instances.items()
+        }
+
+    def get_all_running_instances(self) -> Dict[str, RunningInstance]:
         return self.instances
 
     def remove_running(self, connection_name: str):
         self.instances.pop(connection_name)
+        self.dirty = True
+
@@ -0,0 +1,196 @@
+import json
+from typing import Any, Dict
+
+from cloud_sql.config import Configuration
+from cloud_sql.instances import Instance, Site
+from cloud_sql.running_instances import RunningInstance, RunningInstances
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+SCHEMA_VERSION = 1
+LEGACY_TAG = "py/object"
+
+
+class SchemaVersionError(Exception):
+    pass
+
+
+def dumps(data: Dict[str, Any]) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"))  # pragma: no cover
+
+
+def loads(text: str) -> Dict[str, Any]:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)  # pragma: no cover
+
+
+def instance_to_dict(instance: Instance) -> Dict[str, Any]:
+    return instance.to_dict()
+
+
+def instance_from_dict(data: Dict[str, Any]) -> Instance:
+    instance = Instance(
+        data["name"],
+        data["region"],
+        data["project"],
+        data["connection_name"],
+        data["iam"],
+    )
+    instance.nick_name = data["nick_name"]
+    instance.port = data["port"]
+    instance.default = data["default"]
+    instance.fingerprint = data.get("fingerprint")
+    instance.pinned = data.get("pinned", False)
+    return instance
+
+
+def site_to_dict(site: Site) -> Dict[str, Any]:
+    return {
+        "version": SCHEMA_VERSION,
+        "instances": [instance_to_dict(instance) for instance in site.instances.values()],
+        "project_markers": site.project_markers,
+    }
+
+
+def site_from_dict(data: Dict[str, Any]) -> Site:
+    instances = [instance_from_dict(item) for item in data["instances"]]
+    site = Site({instance.connection_name: instance for instance in instances})
+    site.project_markers = data.get("project_markers", {})
+    site.dirty = data.get("migrated", False)
+    return site
+
+
+def config_to_dict(config: Configuration) -> Dict[str, Any]:
+    return {
+        "version": SCHEMA_VERSION,
+        "cloud_sql_path": config.cloud_sql_path,
+        "enable_iam_by_default": config.enable_iam_by_default,
+        "port_range": list(config.port_range),
+        "project_port_ranges": {
+            project: list(port_range)
+            for project, port_range in config.project_port_ranges.items()
+        },
+        "reserved_ports": config.reserved_ports,
+        "max_proxies": config.max_proxies,
+    }
+
+
+def config_from_dict(data: Dict[str, Any]) -> Configuration:
+    config = Configuration(data["cloud_sql_path"], data["enable_iam_by_default"])
+    if "port_range" in data:
+        config.port_range = tuple(data["port_range"])
+    config.project_port_ranges = {
+        project: tuple(port_range)
+        for project, port_range in data.get("project_port_ranges", {}).items()
+    }
+    config.reserved_ports = data.get("reserved_ports", [])
+    config.max_proxies = data.get("max_proxies")
+    config.dirty = data.get("migrated", False)
+    return config
+
+
+def running_to_dict(running_instances: RunningInstances) -> Dict[str, Any]:
+    return {
+        "version": SCHEMA_VERSION,
+        "running": {
+            connection_name: {
+                "pid": running.pid,
+                "start_time": running.start_time,
+                "port": running.port,
+                "path": running.path,
+                "restarts": running.restarts,
+                "last_used": running.last_used,
+            }
+            for connection_name, running in running_instances.instances.items()
+        },
+    }
+
+
+def running_from_dict(data: Dict[str, Any]) -> RunningInstances:
+    running_instances = RunningInstances(
+        {
+            connection_name: RunningInstance(
+                item["pid"],
+                item["start_time"],
+                item["port"],
+                item["path"],
+                item.get("restarts"),
+                item.get("last_used"),
+            )
+            for connection_name, item in data["running"].items()
+        }
+    )
+    running_instances.dirty = data.get("migrated", False)
+    return running_instances
+
+
+def upgrade_legacy(data: Dict[str, Any]) -> Dict[str, Any]:
+    import jsonpickle
+
+    def strip_tags(value):
+        if isinstance(value, dict):
+            return {k: strip_tags(v) for k, v in value.items() if k != LEGACY_TAG}
+        if isinstance(value, list):
+            return [strip_tags(v) for v in value]
+        return value
+
+    # decoding without the class tags resolves py/id references into plain dicts
+    kind = data[LEGACY_TAG]
+    plain = jsonpickle.decode(json.dumps(strip_tags(data)))
+    upgraded = {"version": SCHEMA_VERSION, "migrated": True}
+
+    if kind.endswith(".Site"):
+        instances = []
+        for item in plain.get("instances", {}).values():
+            instances.append(
+                {
+                    "name": item["name"],
+                    "nick_name": item.get("nick_name", item.get("shortname")),
+                    "region": item["region"],
+                    "project": item["project"],
+                    "connection_name": item["connection_name"],
+                    "port": item.get("port"),
+                    "iam": item.get("iam", True),
+                    "default": item.get("default", False),
+                }
+            )
+        return {**upgraded, "instances": instances}
+
+    if kind.endswith(".Configuration"):
+        return {
+            **upgraded,
+            "cloud_sql_path": plain.get("cloud_sql_path"),
+            "enable_iam_by_default": plain.get("enable_iam_by_default", True),
+        }
+
+    if kind.endswith(".RunningInstances"):
+        running = {}
+        for connection_name, item in plain.get("instances", {}).items():
+            if isinstance(item, int):
+                item = {"pid": item}
+            running[connection_name] = {
+                "pid": item["pid"],
+                "start_time": item.get("start_time"),
+                "port": item.get("port"),
+                "path": item.get("path"),
+            }
+        return {**upgraded, "running": running}
+
+    raise SchemaVersionError(f"Unrecognised legacy state file for {kind}")
+
+
+def read_document(text: str) -> Dict[str, Any]:
+    data = loads(text)
+    if LEGACY_TAG in data:
+        return upgrade_legacy(data)
+    if data.get("version", 0) > SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"State file version {data.get('version')} is newer than this version of the manager supports"
+        )
+    return data
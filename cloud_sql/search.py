@@ -0,0 +1,132 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+from cloud_sql.instances import Instance
+
+SEARCH_FIELDS = (
+    "project",
+    "nick",
+    "port",
+    "name",
+    "region",
+    "iam",
+    "default",
+    "connection",
+)
+FIELD_POSITIONS = {field: position for position, field in enumerate(SEARCH_FIELDS)}
+SEPARATOR = "\0"
+
+
+def row_text(instance: Instance) -> str:
+    # the lowercased field values, in SEARCH_FIELDS order, as one string so that
+    # a plain word is a single substring test; query words never contain the
+    # separator, so they cannot match across two fields
+    return (
+        f"{instance.project}\0{instance.nick_name}\0{instance.port or 'N/A'}\0"
+        f"{instance.name}\0{instance.region}\0{instance.iam}\0{instance.default}\0"
+        f"{instance.connection_name}"
+    ).lower()
+
+
+class SearchQueryError(Exception):
+    pass
+
+
+def trigrams(value: str) -> Set[str]:
+    return {value[i : i + 3] for i in range(len(value) - 2)}
+
+
+class Term(object):
+    def __init__(self, field: Optional[str], value: str, pattern: Optional["re.Pattern"]):
+        self.field = field
+        self.value = value
+        self.pattern = pattern
+
+    def matches(self, row: str) -> bool:
+        if self.field is None and self.pattern is None:
+            return self.value in row
+        values = row.split(SEPARATOR)
+        candidates = [values[FIELD_POSITIONS[self.field]]] if self.field else values
+        if self.pattern is not None:
+            return any(self.pattern.search(value) for value in candidates)
+        return candidates[0] == self.value
+
+    def select(self, rows: List[str], positions: Iterable[int]) -> List[int]:
+        if self.field is None and self.pattern is None:
+            return [position for position in positions if self.value in rows[position]]
+        return [position for position in positions if self.matches(rows[position])]
+
+
+def parse_query(query: str) -> List[Term]:
+    terms = []
+    for word in query.split():
+        field, _, value = word.partition(":")
+        if field not in SEARCH_FIELDS or not value:
+            field, value = None, word
+        pattern = None
+        if len(value) > 2 and value.startswith("/") and value.endswith("/"):
+            try:
+                pattern = re.compile(value[1:-1], re.IGNORECASE)
+            except re.error as err:
+                raise SearchQueryError(f"Invalid regular expression {value}: {err}")
+        terms.append(Term(field, value.lower(), pattern))
+    return terms
+
+
+# field values are lowercased once up front and the first search is a plain
+# scan over them; an index searched again, like the one the daemon keeps on its
+# site, builds a value index for exact field matches and a trigram index to
+# narrow substring terms, so only the surviving candidates are checked
+class SearchIndex(object):
+    def __init__(self, instances: Iterable[Instance]):
+        self.instances: List[Instance] = list(instances)
+        self.rows: List[str] = [row_text(instance) for instance in self.instances]
+        self.fields: Optional[Dict[str, Dict[str, Set[int]]]] = None
+        self.trigrams: Optional[Dict[str, Set[int]]] = None
+        self.searches = 0
+
+    def build(self):
+        self.fields = {field: {} for field in SEARCH_FIELDS}
+        self.trigrams = {}
+        for position, row in enumerate(self.rows):
+            for field, value in zip(SEARCH_FIELDS, row.split(SEPARATOR)):
+                self.fields[field].setdefault(value, set()).add(position)
+                for trigram in trigrams(value):
+                    self.trigrams.setdefault(trigram, set()).add(position)
+
+    def candidates(self, term: Term) -> Optional[Set[int]]:
+        if term.pattern is not None:
+            return None
+        if term.field:
+            return self.fields[term.field].get(term.value, set())
+        keys = trigrams(term.value)
+        if not keys:
+            return None
+        return set.intersection(*(self.trigrams.get(key, set()) for key in keys))
+
+    def search(self, query: str) -> List[Instance]:
+        terms = parse_query(query)
+        self.searches += 1
+        if self.trigrams is None and self.searches > 1:
+            self.build()
+        narrowed: Optional[Set[int]] = None
+        if self.trigrams is not None:
+            for term in terms:
+                candidates = self.candidates(term)
+                if candidates is not None:
+                    narrowed = candidates if narrowed is None else narrowed & candidates
+        positions: Iterable[int] = (
+            range(len(self.rows)) if narrowed is None else sorted(narrowed)
+        )
+        for term in terms:
+            positions = term.select(self.rows, positions)
+        found = [self.instances[position] for position in positions]
+        if not found and all(
+            term.field is None and term.pattern is None for term in terms
+        ):
+            # list used to match the filter against each printed line, so a
+            # phrase like "Default: True" still finds what it always did
+            found = [
+                instance for instance in self.instances if query in instance.print(None)
+            ]
+        return found
@@ -0,0 +1,174 @@
+import os
+import os.path
+import sqlite3
+from typing import Optional
+
+from cloud_sql.config import Configuration, default_configuration
+from cloud_sql.instances import Site
+from cloud_sql.running_instances import RunningInstances
+from cloud_sql.schema import (
+    SCHEMA_VERSION,
+    SchemaVersionError,
+    config_from_dict,
+    config_to_dict,
+    dumps,
+    instance_from_dict,
+    instance_to_dict,
+    loads,
+    running_from_dict,
+    running_to_dict,
+)
+
+TABLES = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS config (id INTEGER PRIMARY KEY CHECK (id = 1), data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS instances (
+    connection_name TEXT PRIMARY KEY,
+    nick_name TEXT NOT NULL,
+    project TEXT NOT NULL,
+    port INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS instances_nick_name ON instances (nick_name, project);
+CREATE INDEX IF NOT EXISTS instances_project ON instances (project);
+CREATE INDEX IF NOT EXISTS instances_port ON instances (port);
+CREATE TABLE IF NOT EXISTS project_markers (project TEXT PRIMARY KEY, marker TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS running (
+    connection_name TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+
+class SqlitePersistence(object):
+    def __init__(self, base_path: str):
+        self.filename = os.path.join(base_path, "state.db")
+        is_new = not os.path.exists(self.filename)
+        if not os.path.exists(base_path):
+            os.makedirs(base_path)
+        self.connection = sqlite3.connect(self.filename)
+        with self.connection:
+            self.connection.executescript(TABLES)
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'schema_version'"
+            ).fetchone()
+            if row is None:
+                self.connection.execute(
+                    "INSERT INTO meta (key, value) VALUES ('schema_version', ?)",
+                    (str(SCHEMA_VERSION),),
+                )
+            elif int(row[0]) > SCHEMA_VERSION:
+                raise SchemaVersionError(
+                    f"State database version {row[0]} is newer than this version of the manager supports"
+                )
+        if is_new:
+            self.import_json_state(base_path)
+
+    def import_json_state(self, base_path: str):
+        from cloud_sql.persistence import Persistence
+
+        json_persistence = Persistence(base_path)
+        if os.path.exists(json_persistence.instance_filename):
+            self.save_site(json_persistence.load_site())
+        if os.path.exists(json_persistence.config_filename):
+            self.save_config(json_persistence.load_config())
+        if os.path.exists(json_persistence.running_instances_filename):
+            self.save_running(json_persistence.load_running())
+
+    def close(self):
+        self.connection.close()
+
+    def _site_from_rows(self, rows) -> Site:
+        instances = [instance_from_dict(loads(row[0])) for row in rows]
+        site = Site({instance.connection_name: instance for instance in instances})
+        site.changed = set()
+        site.project_markers = dict(
+            self.connection.execute("SELECT project, marker FROM project_markers")
+        )
+        return site
+
+    def load_site(self) -> Site:
+        return self._site_from_rows(
+            self.connection.execute("SELECT data FROM instances")
+        )
+
+    def load_site_for_nick_name(self, nick_name: str, project: Optional[str]) -> Site:
+        if project:
+            rows = self.connection.execute(
+                "SELECT data FROM instances WHERE nick_name = ? AND project = ?",
+                (nick_name, project),
+            )
+        else:
+            rows = self.connection.execute(
+                "SELECT data FROM instances WHERE nick_name = ?", (nick_name,)
+            )
+        return self._site_from_rows(rows)
+
+    def save_site(self, site: Site):
+        removed = site.removed - site.instances.keys()
+        if site.changed is None:
+            changed = list(site.instances.values())
+        else:
+            changed = [
+                site.instances[connection_name]
+                for connection_name in site.changed
+                if connection_name in site.instances
+            ]
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM instances WHERE connection_name = ?",
+                [(connection_name,) for connection_name in removed],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO instances (connection_name, nick_name, project, port, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        instance.connection_name,
+                        instance.nick_name,
+                        instance.project,
+                        instance.port,
+                        dumps(instance_to_dict(instance)),
+                    )
+                    for instance in changed
+                ],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO project_markers (project, marker) VALUES (?, ?)",
+                site.project_markers.items(),
+            )
+
+    def load_config(self) -> Configuration:
+        row = self.connection.execute("SELECT data FROM config WHERE id = 1").fetchone()
+        if row is None:
+            return default_configuration()
+        return config_from_dict(loads(row[0]))
+
+    def save_config(self, config: Configuration):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO config (id, data) VALUES (1, ?)",
+                (dumps(config_to_dict(config)),),
+            )
+
+    def load_running(self) -> RunningInstances:
+        running = {
+            connection_name: loads(data)
+            for connection_name, data in self.connection.execute(
+                "SELECT connection_name, data FROM running"
+            )
+        }
+        return running_from_dict({"version": SCHEMA_VERSION, "running": running})
+
+    def save_running(self, running_instances: RunningInstances):
+        running = running_to_dict(running_instances)["running"]
+        with self.connection:
+            self.connection.execute("DELETE FROM running")
+            self.connection.executemany(
+                "INSERT INTO running (connection_name, pid, data) VALUES (?, ?, ?)",
+                [
+                    (connection_name, item["pid"], dumps(item))
+                    for connection_name, item in running.items()
+                ],
+            )
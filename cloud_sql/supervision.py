@@ -0,0 +1,95 @@
+import os
+import random
+import selectors
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from cloud_sql.cloud_sql_proxy import process_start_time
+
+
+class RestartPolicy(object):
+    def __init__(
+        self,
+        initial_delay: float = 1.0,
+        max_delay: float = 60.0,
+        max_restarts: int = 5,
+        window: float = 600.0,
+        history: int = 20,
+    ):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_restarts = max_restarts
+        self.window = window
+        self.history = history
+
+    def delay(self, attempt: int, rng: Callable[[], float] = random.random) -> float:
+        # exponential, with up to half of it taken off at random so that
+        # proxies which crashed together do not all come back together
+        delay = min(self.max_delay, self.initial_delay * 2**attempt)
+        return delay * (1 - rng() / 2)
+
+    def recent_restarts(self, restarts: List[dict], now: float) -> int:
+        return sum(1 for restart in restarts if restart["time"] > now - self.window)
+
+
+def is_alive(pid: int, start_time: Optional[float]) -> bool:
+    current = process_start_time(pid)
+    if start_time is None:
+        return current is not None
+    return current == start_time
+
+
+# each proxy gets a pidfd, which becomes readable when the process exits and
+# is waited on by the same selector as the daemon's socket; where pidfds are
+# not available the processes are checked on every tick instead
+class ProcessWatcher(object):
+    def __init__(self, selector: selectors.BaseSelector):
+        self.selector = selector
+        self.watched: Dict[str, Tuple[int, Optional[float]]] = {}
+        self.pidfds: Dict[str, int] = {}
+        self.exited: Set[str] = set()
+
+    def watch(self, name: str, pid: int, start_time: Optional[float]):
+        if self.watched.get(name) == (pid, start_time):
+            return
+        self.unwatch(name)
+        self.watched[name] = (pid, start_time)
+        if not hasattr(os, "pidfd_open"):
+            return
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            self.exited.add(name)
+            return
+        except OSError:
+            return
+        self.pidfds[name] = pidfd
+        self.selector.register(pidfd, selectors.EVENT_READ, name)
+        # the pid may already belong to some other process
+        if not is_alive(pid, start_time):
+            self.exited.add(name)
+
+    def unwatch(self, name: str):
+        self.watched.pop(name, None)
+        self.exited.discard(name)
+        pidfd = self.pidfds.pop(name, None)
+        if pidfd is not None:
+            self.selector.unregister(pidfd)
+            os.close(pidfd)
+
+    def notify(self, name: str, pidfd: int):
+        # ignore events for a pidfd that was replaced during the same select
+        if self.pidfds.get(name) == pidfd:
+            self.exited.add(name)
+
+    def collect(self) -> List[Tuple[str, int]]:
+        for name, (pid, start_time) in self.watched.items():
+            if name not in self.pidfds and not is_alive(pid, start_time):
+                self.exited.add(name)
+        exited = [(name, self.watched[name][0]) for name in sorted(self.exited)]
+        for name, _ in exited:
+            self.unwatch(name)
+        return exited
+
+    def close(self):
+        for name in list(self.watched):
+            self.unwatch(name)
@@ -1,10 +1,19 @@
+import os
+import socket
+
 from _pytest.python_api import raises
 from psutil import NoSuchProcess
 
 from cloud_sql.cloud_sql_proxy import (
+    established_connections,
+    listening_ports,
+    process_memory,
     run_cloud_sql_proxy,
-    check_if_proxy_is_running,
-    stop_cloud_sql_proxy,
+    run_cloud_sql_proxy_group,
+    stop_cloud_sql_proxies,
+    scan_proxy_processes,
+    process_start_time,
+    wait_for_port,
     CloudProxyNotFoundError,
 )
 from tests import test_fixtures
@@ -55,29 +64,210 @@ class TestCloudSqlProxy:
             start_new_session=True,
         )
 
-    @mock.patch("cloud_sql.cloud_sql_proxy.psutil.Process")
-    def test_is_running(self, mock_process):
-        test_cmd_line = f"cloud_sql_proxy {test_fixtures.connection_name1}=tcp:1234"
-        process_object = MagicMock()
-        process_object.cmdline.return_value = [test_cmd_line]
-        mock_process.return_value = process_object
-        assert (
-            check_if_proxy_is_running(123, test_fixtures.connection_name1) is not None
+    @mock.patch("cloud_sql.cloud_sql_proxy.subprocess.Popen")
+    def test_run_proxy_group(self, popen_mock):
+        popen_mock.return_value.pid = 123
+        returned_pid = run_cloud_sql_proxy_group(
+            self.proxy_path,
+            [
+                (test_fixtures.connection_name1, test_fixtures.port1),
+                (test_fixtures.connection_name3, test_fixtures.port3),
+            ],
+            True,
         )
+        assert returned_pid == 123
+        popen_mock.assert_called_once_with(
+            [
+                "/a/path",
+                "-enable_iam_login",
+                f"-instances={test_fixtures.connection_name1}=tcp:{test_fixtures.port1},"
+                f"{test_fixtures.connection_name3}=tcp:{test_fixtures.port3}",
+            ],
+            start_new_session=True,
+        )
+
+    def test_wait_for_port(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        assert wait_for_port(port, 1.0) is True
+        listener.close()
+        assert wait_for_port(port, 0.2, 0.05) is False
+
+    @mock.patch("psutil.wait_procs")
+    @mock.patch("psutil.Process")
+    @mock.patch("cloud_sql.cloud_sql_proxy.scan_proxy_processes")
+    def test_stop_proxies(self, mock_scan, mock_process, mock_wait_procs):
+        graceful = MagicMock()
+        graceful.pid = 1
+        stubborn = MagicMock()
+        stubborn.pid = 2
+        reused = MagicMock()
+        mock_process.side_effect = lambda pid: {1: graceful, 2: stubborn, 4: reused}[pid]
+        mock_scan.return_value = {
+            1: f"cloud_sql_proxy -instances={test_fixtures.connection_name1}=tcp:1",
+            2: f"cloud_sql_proxy -instances={test_fixtures.connection_name2}=tcp:2",
+            4: "something-else",
+        }
+
+        def wait_procs(processes, timeout, callback):
+            if graceful in processes:
+                callback(graceful)
+                return [graceful], [stubborn]
+            callback(stubborn)
+            return [stubborn], []
+
+        mock_wait_procs.side_effect = wait_procs
+        results = stop_cloud_sql_proxies(
+            {
+                test_fixtures.connection_name1: 1,
+                test_fixtures.connection_name2: 2,
+                "missing": 3,
+                "reused": 4,
+            },
+            2.0,
+        )
+        mock_scan.assert_called_once()
+        assert set(mock_scan.call_args[0][0]) == {1, 2, 3, 4}
+        reused.terminate.assert_not_called()
+        graceful.terminate.assert_called_once()
+        stubborn.terminate.assert_called_once()
+        graceful.kill.assert_not_called()
+        stubborn.kill.assert_called_once()
+        assert mock_wait_procs.call_args_list[0][1]["timeout"] == 2.0
+        assert results[test_fixtures.connection_name1][1] is False
+        assert results[test_fixtures.connection_name2][1] is True
+        assert results["missing"] is None
+        assert results["reused"] is None
+
+    @mock.patch("psutil.wait_procs")
+    @mock.patch("psutil.Process")
+    @mock.patch("cloud_sql.cloud_sql_proxy.scan_proxy_processes")
+    def test_stop_grouped_proxy(self, mock_scan, mock_process, mock_wait_procs):
+        process = MagicMock()
+        process.pid = 1
+        mock_process.return_value = process
+        mock_scan.return_value = {
+            1: f"cloud_sql_proxy -instances={test_fixtures.connection_name1}=tcp:1,{test_fixtures.connection_name3}=tcp:3"
+        }
+
+        def wait_procs(processes, timeout, callback):
+            for waited in processes:
+                callback(waited)
+            return processes, []
+
+        mock_wait_procs.side_effect = wait_procs
+        results = stop_cloud_sql_proxies(
+            {test_fixtures.connection_name1: 1, test_fixtures.connection_name3: 1}
+        )
+        mock_process.assert_called_once_with(1)
+        process.terminate.assert_called_once()
+        assert mock_wait_procs.call_args_list[0][1]["timeout"] == 5.0
+        assert results[test_fixtures.connection_name1][1] is False
+        assert results[test_fixtures.connection_name3][1] is False
+
+    @mock.patch("cloud_sql.cloud_sql_proxy.os.path.isdir")
+    @mock.patch("psutil.process_iter")
+    def test_scan_proxy_processes(self, mock_process_iter, mock_isdir):
+        assert scan_proxy_processes([]) == {}
+
+        mock_isdir.return_value = False
+        wanted = MagicMock()
+        wanted.pid = 123
+        wanted.info = {"cmdline": ["cloud_sql_proxy", "-instances=a"]}
+        other = MagicMock()
+        other.pid = 456
+        other.info = {"cmdline": ["bash"]}
+        mock_process_iter.return_value = [wanted, other]
+        assert scan_proxy_processes([123, 789]) == {123: "cloud_sql_proxy -instances=a"}
+        mock_process_iter.assert_called_once_with(["cmdline"])
+
+    def test_scan_proxy_processes_proc(self):
+        if not os.path.isdir("/proc/self"):
+            return
+        processes = scan_proxy_processes([os.getpid()])
+        assert "pytest" in processes[os.getpid()]
+
+    @mock.patch("cloud_sql.cloud_sql_proxy.os.path.isdir")
+    @mock.patch("psutil.Process")
+    def test_process_start_time(self, mock_process, mock_isdir):
+        stat = b"123 (cloud sql (proxy)) S 1 123 123 0 -1 4194560 1 0 0 0 0 0 0 0 20 0 1 0 98765 0 0"
+        with mock.patch("builtins.open", mock.mock_open(read_data=stat)):
+            assert process_start_time(123) == 98765.0
+
+        mock_isdir.return_value = True
+        with mock.patch("builtins.open", side_effect=FileNotFoundError):
+            assert process_start_time(123) is None
+        mock_process.assert_not_called()
+
+        mock_isdir.return_value = False
+        mock_process.return_value.create_time.return_value = 1650000000.5
+        with mock.patch("builtins.open", side_effect=FileNotFoundError):
+            assert process_start_time(123) == 1650000000.5
+            mock_process.side_effect = NoSuchProcess(123)
+            assert process_start_time(123) is None
+
+    def test_listening_ports(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        try:
+            assert port in listening_ports()
+        finally:
+            listener.close()
+
+    def test_established_connections(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        try:
+            assert established_connections([port, 1]) == {port: 0, 1: 0}
+            with socket.create_connection(("127.0.0.1", port)):
+                accepted, _ = listener.accept()
+                with accepted:
+                    assert established_connections([port]) == {port: 1}
+        finally:
+            listener.close()
+
+    @mock.patch("cloud_sql.cloud_sql_proxy.os.path.isdir")
+    @mock.patch("psutil.net_connections")
+    def test_established_connections_psutil(self, mock_connections, mock_isdir):
+        import psutil
+
+        mock_isdir.return_value = False
+        listening = MagicMock()
+        listening.laddr.port = 5511
+        listening.status = psutil.CONN_LISTEN
+        established = MagicMock()
+        established.laddr.port = 5511
+        established.status = psutil.CONN_ESTABLISHED
+        mock_connections.return_value = [listening, established, established]
+        assert established_connections([5511, 5512]) == {5511: 2, 5512: 0}
+
+        mock_connections.side_effect = psutil.AccessDenied()
+        assert established_connections([5511]) == {5511: 0}
+
+    def test_process_memory(self):
+        assert process_memory(os.getpid()) > 0
+
+    @mock.patch("cloud_sql.cloud_sql_proxy.os.path.isdir")
+    @mock.patch("psutil.net_connections")
+    def test_listening_ports_psutil(self, mock_connections, mock_isdir):
+        import psutil
+
+        mock_isdir.return_value = False
+        listening = MagicMock()
+        listening.laddr.port = 5511
+        listening.status = psutil.CONN_LISTEN
+        established = MagicMock()
+        established.laddr.port = 5512
+        established.status = psutil.CONN_ESTABLISHED
+        mock_connections.return_value = [listening, established]
+        assert listening_ports() == {5511}
+        mock_connections.assert_called_once_with(kind="tcp")
 
-        assert check_if_proxy_is_running(123, test_fixtures.connection_name2) is None
-
-        mock_process.side_effect = NoSuchProcess(124)
-        assert check_if_proxy_is_running(124, test_fixtures.connection_name1) is None
-
-    @mock.patch("cloud_sql.cloud_sql_proxy.psutil.Process")
-    def test_stop_proxy(self, mock_process):
-        process_object = MagicMock()
-        test_cmd_line = f"cloud_sql_proxy {test_fixtures.connection_name1}=tcp:1234"
-        mock_process.return_value = process_object
-        process_object.cmdline.return_value = [test_cmd_line]
-        assert stop_cloud_sql_proxy(123, test_fixtures.connection_name1) is True
-        process_object.kill.assert_called_once()
-        assert stop_cloud_sql_proxy(123, test_fixtures.connection_name2) is False
-        mock_process.side_effect = NoSuchProcess(124)
-        assert stop_cloud_sql_proxy(124, test_fixtures.connection_name1) is False
+        mock_connections.side_effect = psutil.AccessDenied()
+        assert listening_ports() == set()
@@ -9,3 +9,13 @@ class TestCommandLine:
 
         with raises(SystemExit):
             get_parameters(["--help"])
+
+    def test_port_ranges(self):
+        args = get_parameters(
+            ["config", "--port-range", "6000-6999", "--project-port-range", "p=6000-6099"]
+        )
+        assert args["port_range"] == (6000, 6999)
+        assert args["project_port_range"] == ("p", (6000, 6099))
+
+        with raises(SystemExit):
+            get_parameters(["config", "--port-range", "6000"])
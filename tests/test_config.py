@@ -3,6 +3,7 @@ from unittest import mock
 from _pytest.python_api import raises
 
 from cloud_sql.config import default_configuration, Configuration, PathNotFoundError
+from cloud_sql.ports import PortRangeError
 
 
 class TestConfig:
@@ -18,9 +19,11 @@ class TestConfig:
     @mock.patch("cloud_sql.config.os.path.exists")
     def test_new_path(self, exists_mock):
         config = Configuration("/original/path", True)
+        assert config.dirty is False
         exists_mock.return_value = True
         config.new_path(self.proxy_path)
         assert config.cloud_sql_path == self.proxy_path
+        assert config.dirty is True
 
         exists_mock.return_value = False
         with raises(PathNotFoundError):
@@ -30,10 +33,40 @@ class TestConfig:
         config = Configuration("/original/path", False)
         config.set_enable_iam_by_default(True)
         assert config.enable_iam_by_default == True
+        assert config.dirty is True
+
+    def test_set_port_range(self):
+        config = Configuration("/original/path", False)
+        config.set_port_range((6000, 6999))
+        config.set_port_range((6000, 6099), "project-1")
+        assert config.port_range == (6000, 6999)
+        assert config.project_port_ranges == {"project-1": (6000, 6099)}
+        assert config.dirty is True
+
+        with raises(PortRangeError):
+            config.set_port_range((5000, 5999))
+        assert config.port_range == (6000, 6999)
+
+    def test_reserve_port(self):
+        config = Configuration("/original/path", False)
+        config.reserve_port(6000)
+        config.reserve_port(6000)
+        assert config.reserved_ports == [6000]
+        assert config.dirty is True
 
     def test_print(self):
         config = Configuration("/original/path", True)
         assert (
             config.print()
-            == "Cloud SQL Proxy path: /original/path Enable IAM by Default: True"
+            == "Cloud SQL Proxy path: /original/path Enable IAM by Default: True Ports: 5434-9999"
         )
+        config.set_max_proxies(10)
+        assert config.print().endswith("Ports: 5434-9999 Max proxies: 10")
+
+    def test_set_max_proxies(self):
+        config = Configuration("/original/path", False)
+        config.set_max_proxies(10)
+        assert config.max_proxies == 10
+        assert config.dirty is True
+        config.set_max_proxies(0)
+        assert config.max_proxies is None
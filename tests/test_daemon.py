@@ -0,0 +1,231 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from unittest import mock
+
+from cloud_sql.daemon import (
+    Supervisor,
+    forward_command,
+    serve,
+    socket_path,
+    stop_daemon,
+)
+from cloud_sql.cloud_sql_proxy import process_start_time
+from cloud_sql.persistence import Persistence
+from cloud_sql.running_instances import RunningInstances
+from cloud_sql.supervision import RestartPolicy
+from tests import test_fixtures
+
+
+def wait_for_socket(base_path: str):
+    deadline = time.monotonic() + 5
+    while not os.path.exists(socket_path(base_path)):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class TestDaemon:
+    def test_serve(self, tmp_path, capsys):
+        base_path = str(tmp_path)
+        assert forward_command(base_path, ["list"]) is None
+        Persistence(base_path).save_site(test_fixtures.site1)
+
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(serve(base_path, 0.05)), daemon=True
+        )
+        thread.start()
+        wait_for_socket(base_path)
+        capsys.readouterr()
+
+        assert (
+            forward_command(
+                base_path,
+                ["update", "database-postgres", "-p", test_fixtures.project1, "-n", "pg"],
+            )
+            == 0
+        )
+        assert "Instance updated:" in capsys.readouterr().out
+        assert "pg" in Persistence(base_path).load_site().nicknames
+
+        assert forward_command(base_path, ["list", "pg", "--format", "ndjson"]) == 0
+        row = json.loads(capsys.readouterr().out)
+        assert row["connection_name"] == test_fixtures.connection_name1
+
+        assert forward_command(base_path, ["list", "--format", "yaml"]) == 2
+        assert "invalid choice" in capsys.readouterr().out
+
+        assert serve(base_path) == 1
+        assert "already listening" in capsys.readouterr().out
+
+        assert stop_daemon(base_path) == 0
+        thread.join(5)
+        assert results == [0]
+        assert not os.path.exists(socket_path(base_path))
+        assert forward_command(base_path, ["list"]) is None
+        assert stop_daemon(base_path) == 1
+
+    def test_stale_socket(self, tmp_path, capsys):
+        base_path = str(tmp_path)
+        with open(socket_path(base_path), "w"):
+            pass
+        assert forward_command(base_path, ["list"]) is None
+
+    def test_supervisor_saves_changes(self, tmp_path, capsys):
+        base_path = str(tmp_path)
+        persistence = Persistence(base_path)
+        persistence.save_site(test_fixtures.site1)
+        supervisor = Supervisor(persistence)
+
+        with mock.patch.object(persistence, "save_site") as save_site:
+            assert supervisor.execute(["list"], io.StringIO()) == 0
+            save_site.assert_not_called()
+            assert (
+                supervisor.execute(
+                    ["update", "database-postgres", "-p", test_fixtures.project1, "-n", "pg"],
+                    io.StringIO(),
+                )
+                == 0
+            )
+            save_site.assert_called_once_with(supervisor.site)
+            assert not supervisor.site.dirty
+
+    def test_supervisor_runs_in_client_directory(self, tmp_path, monkeypatch):
+        persistence = Persistence(str(tmp_path / "state"))
+        supervisor = Supervisor(persistence)
+        client = tmp_path / "client"
+        client.mkdir()
+        (client / "cloud_sql_proxy").write_text("")
+        monkeypatch.setenv("CLOUD_SQL_ADMIN_ENDPOINT", "http://daemon/")
+        monkeypatch.delenv("GOOGLE_CLOUD_PROJECT", raising=False)
+
+        assert (
+            supervisor.execute(
+                ["config", "--path", "./cloud_sql_proxy"], io.StringIO(), str(client)
+            )
+            == 0
+        )
+        assert supervisor.config.cloud_sql_path == str(client / "cloud_sql_proxy")
+
+        seen = []
+
+        def record(parameters, config, site, running):
+            seen.append(
+                (
+                    parameters["projects_file"],
+                    os.environ.get("CLOUD_SQL_ADMIN_ENDPOINT"),
+                    os.environ.get("GOOGLE_CLOUD_PROJECT"),
+                )
+            )
+            return 0
+
+        with mock.patch("cloud_sql.daemon.execute_command", side_effect=record):
+            supervisor.execute(
+                ["import", "-f", "projects.txt"],
+                io.StringIO(),
+                str(client),
+                {"CLOUD_SQL_ADMIN_ENDPOINT": None, "GOOGLE_CLOUD_PROJECT": "caller"},
+            )
+        assert seen == [(str(client / "projects.txt"), None, "caller")]
+        assert os.environ["CLOUD_SQL_ADMIN_ENDPOINT"] == "http://daemon/"
+        assert "GOOGLE_CLOUD_PROJECT" not in os.environ
+
+    @mock.patch("cloud_sql.daemon.send_request", return_value=0)
+    def test_forward_command_sends_client_context(
+        self, mock_send, tmp_path, monkeypatch
+    ):
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "key.json")
+        monkeypatch.delenv("CLOUD_SQL_ADMIN_ENDPOINT", raising=False)
+        assert forward_command("/base", ["import"]) == 0
+        request = mock_send.call_args[0][1]
+        assert request["args"] == ["import"]
+        assert request["cwd"] == str(tmp_path)
+        assert request["environment"]["GOOGLE_APPLICATION_CREDENTIALS"] == str(
+            tmp_path / "key.json"
+        )
+        assert request["environment"]["CLOUD_SQL_ADMIN_ENDPOINT"] is None
+
+    @mock.patch("cloud_sql.daemon.process_start_time", return_value=1.0)
+    @mock.patch("cloud_sql.daemon.start_group", return_value=(4242, [None]))
+    def test_supervisor_restarts_crashed_proxy(
+        self, mock_start_group, mock_start_time, tmp_path, capsys
+    ):
+        persistence = Persistence(str(tmp_path))
+        persistence.save_site(test_fixtures.site1)
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        start_time = process_start_time(process.pid)
+        process.wait()
+        running = RunningInstances({})
+        running.add_running(
+            process.pid, test_fixtures.connection_name1, start_time, test_fixtures.port1
+        )
+        persistence.save_running(running)
+
+        policy = RestartPolicy(initial_delay=0.0, max_restarts=1)
+        supervisor = Supervisor(persistence, policy)
+        supervisor.supervise()
+        out = capsys.readouterr().out
+        assert "restarting in 0.0s" in out
+        assert "Restarted" in out
+        instance = supervisor.site.instances[test_fixtures.connection_name1]
+        mock_start_group.assert_called_once_with(
+            supervisor.config, [instance], False, 0
+        )
+        record = persistence.load_running().get_running_instance(
+            test_fixtures.connection_name1
+        )
+        assert record.pid == 4242
+        assert [restart["pid"] for restart in record.restarts] == [process.pid]
+
+        # the new pid does not have the recorded start time, so it looks like
+        # another crash, and the restart limit has been reached
+        supervisor.supervise()
+        assert "not restarting it" in capsys.readouterr().out
+        assert supervisor.pending == {}
+        assert persistence.load_running().get_running(
+            test_fixtures.connection_name1
+        ) is None
+
+    @mock.patch(
+        "cloud_sql.daemon.start_group",
+        side_effect=FileNotFoundError("No such file: cloud_sql_proxy"),
+    )
+    def test_supervisor_backs_off_failed_restart(
+        self, mock_start_group, tmp_path, capsys
+    ):
+        persistence = Persistence(str(tmp_path))
+        persistence.save_site(test_fixtures.site1)
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        start_time = process_start_time(process.pid)
+        process.wait()
+        running = RunningInstances({})
+        running.add_running(
+            process.pid, test_fixtures.connection_name1, start_time, test_fixtures.port1
+        )
+        persistence.save_running(running)
+
+        policy = RestartPolicy(initial_delay=0.0, max_restarts=2)
+        supervisor = Supervisor(persistence, policy)
+        supervisor.supervise()
+        out = capsys.readouterr().out
+        assert "could not be restarted (No such file: cloud_sql_proxy)" in out
+        assert test_fixtures.connection_name1 in supervisor.pending
+        record = persistence.load_running().get_running_instance(
+            test_fixtures.connection_name1
+        )
+        assert record.pid == process.pid
+        assert [restart["pid"] for restart in record.restarts] == [process.pid]
+
+        # the second failure reaches the restart limit
+        supervisor.supervise()
+        assert "not restarting it" in capsys.readouterr().out
+        assert mock_start_group.call_count == 2
+        assert supervisor.pending == {}
+        assert persistence.load_running().get_running(
+            test_fixtures.connection_name1
+        ) is None
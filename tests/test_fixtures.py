@@ -1,6 +1,8 @@
+import json
+
 from cloud_sql.config import Configuration
 from cloud_sql.instances import Instance, Site
-from cloud_sql.running_instances import RunningInstances
+from cloud_sql.running_instances import RunningInstance, RunningInstances
 
 name1 = "database-postgres-instance-1234"
 project1 = "project-1"
@@ -30,4 +32,36 @@ config1 = Configuration("path/to/cloud_sql", False)
 
 pid1 = 1111
 pid2 = 1112
-running_instances1 = RunningInstances({name1: pid1, name2: pid2})
+start_time1 = 4500.0
+running_instances1 = RunningInstances(
+    {
+        name1: RunningInstance(pid1, start_time1, port1, "path/to/cloud_sql"),
+        name2: RunningInstance(pid2, None, None, None),
+    }
+)
+
+
+def legacy_instance(instance: Instance) -> dict:
+    # the shape jsonpickle gave the original dict based Instance
+    return {
+        "py/object": "cloud_sql.instances.Instance",
+        "port": instance.port,
+        "iam": instance.iam,
+        "default": instance.default,
+        "name": instance.name,
+        "nick_name": instance.nick_name,
+        "region": instance.region,
+        "project": instance.project,
+        "connection_name": instance.connection_name,
+    }
+
+
+def legacy_site_document(instances: list) -> str:
+    return json.dumps(
+        {
+            "py/object": "cloud_sql.instances.Site",
+            "nicknames": {},
+            "instances": {item["connection_name"]: item for item in instances},
+            "nextPort": 5434,
+        }
+    )
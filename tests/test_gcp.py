@@ -1,6 +1,24 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from google.auth.credentials import AnonymousCredentials
+
 from cloud_sql.config import Configuration
-from cloud_sql.gcp import obtain_instances
+from cloud_sql.gcp import (
+    discovery_cache_path,
+    INSTANCE_LIST_FIELDS,
+    instance_fingerprint,
+    list_accessible_projects,
+    load_discovery_document,
+    obtain_instances_for_projects,
+    SQLADMIN_API,
+    SQLADMIN_METHODS,
+    SQLADMIN_VERSION,
+)
 from cloud_sql.instances import Site
+from cloud_sql.ports import PortsExhaustedError
 from tests import test_fixtures
 
 from unittest import mock
@@ -28,7 +46,7 @@ class TestGcp:
         ]
     }
 
-    @mock.patch("cloud_sql.gcp.discovery.build")
+    @mock.patch("cloud_sql.gcp.discovery.build_from_document")
     @mock.patch("cloud_sql.gcp.google.auth.default")
     def test_obtain_instances(self, mock_auth, mock_discovery):
         service = MagicMock()
@@ -40,18 +58,21 @@ class TestGcp:
         mock_discovery.return_value = service
         service.instances.return_value = instances
         instances.list.return_value = request
+        instances.list_next.return_value = None
         request.execute.return_value = self.test_response
         site = Site({})
-        obtain_instances(config, site, None, None)
+        obtain_instances_for_projects(config, site, None, None)
         assert len(site.instances) == 1
         assert site.instances[test_fixtures.connection_name1].iam is True
         assert "database-postgres" in site.nicknames
 
         instances.list.reset_mock()
-        obtain_instances(config, site, "override", None)
-        instances.list.assert_called_once_with(project="override")
+        obtain_instances_for_projects(config, site, ["override"], None)
+        instances.list.assert_called_once_with(
+            project="override", fields=INSTANCE_LIST_FIELDS
+        )
 
-    @mock.patch("cloud_sql.gcp.discovery.build")
+    @mock.patch("cloud_sql.gcp.discovery.build_from_document")
     @mock.patch("cloud_sql.gcp.google.auth.default")
     def test_obtain_instances_2(self, mock_auth, mock_discovery):
         service = MagicMock()
@@ -63,11 +84,307 @@ class TestGcp:
         mock_discovery.return_value = service
         service.instances.return_value = instances
         instances.list.return_value = request
+        instances.list_next.return_value = None
         request.execute.return_value = self.test_response
         site = Site({test_fixtures.connection_name3: test_fixtures.instance3})
-        obtain_instances(config, site, None, True)
+        obtain_instances_for_projects(config, site, None, True)
         assert len(site.instances) == 1
         assert site.instances[test_fixtures.connection_name1].iam is True
         assert "database-postgres" in site.nicknames
 
-        instances.list.reset_mock()
\ No newline at end of file
+        instances.list.reset_mock()
+
+    def test_load_discovery_document(self, tmp_path):
+        cache_dir = str(tmp_path / "discovery")
+        document = load_discovery_document(
+            cache_dir, SQLADMIN_API, SQLADMIN_VERSION, SQLADMIN_METHODS
+        )
+        trimmed = json.loads(document)
+        assert list(trimmed["resources"].keys()) == ["instances"]
+        assert list(trimmed["resources"]["instances"]["methods"].keys()) == ["list"]
+        path = discovery_cache_path(cache_dir, SQLADMIN_API, SQLADMIN_VERSION)
+        assert os.path.exists(path)
+
+        with open(path, "w") as f:
+            f.write("cached")
+        with mock.patch("cloud_sql.gcp.fetch_discovery_document") as mock_fetch:
+            assert (
+                load_discovery_document(
+                    cache_dir, SQLADMIN_API, SQLADMIN_VERSION, SQLADMIN_METHODS
+                )
+                == "cached"
+            )
+            mock_fetch.assert_not_called()
+
+        assert (
+            load_discovery_document(
+                cache_dir, SQLADMIN_API, SQLADMIN_VERSION, SQLADMIN_METHODS, True
+            )
+            == document
+        )
+
+    @mock.patch("cloud_sql.gcp.google.auth.default")
+    def test_obtain_instances_fake_endpoint(self, mock_auth, tmp_path, monkeypatch):
+        response = json.dumps(self.test_response).encode()
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(self.path)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            monkeypatch.setenv(
+                "CLOUD_SQL_ADMIN_ENDPOINT", f"http://127.0.0.1:{server.server_port}/"
+            )
+            mock_auth.return_value = AnonymousCredentials(), test_fixtures.project1
+            config = MagicMock(spec=Configuration)
+            config.enable_iam_by_default = False
+            site = Site({})
+            obtain_instances_for_projects(config, site, None, None, str(tmp_path))
+        finally:
+            server.shutdown()
+        assert requests[0].startswith(
+            f"/sql/v1beta4/projects/{test_fixtures.project1}/instances"
+        )
+        assert "fields=nextPageToken" in requests[0]
+        assert list(site.instances.keys()) == [test_fixtures.connection_name1]
+        assert os.path.exists(
+            discovery_cache_path(str(tmp_path), SQLADMIN_API, SQLADMIN_VERSION)
+        )
+
+    @mock.patch("cloud_sql.gcp.list_accessible_projects")
+    @mock.patch("cloud_sql.gcp.discovery.build_from_document")
+    @mock.patch("cloud_sql.gcp.google.auth.default")
+    def test_obtain_instances_for_projects(self, mock_auth, mock_discovery, mock_list_projects):
+        service = MagicMock()
+        config = MagicMock(spec=Configuration)
+        config.enable_iam_by_default = False
+        mock_auth.return_value = AnonymousCredentials(), test_fixtures.project1
+        mock_discovery.return_value = service
+
+        def list_instances(project, **kwargs):
+            request = MagicMock()
+            if project == "forbidden":
+                request.execute.side_effect = Exception("403")
+            elif project == test_fixtures.project2:
+                request.execute.return_value = {
+                    "items": [
+                        {
+                            "name": test_fixtures.name2,
+                            "region": test_fixtures.region2,
+                            "project": test_fixtures.project2,
+                            "connectionName": test_fixtures.connection_name2,
+                            "instanceType": "CLOUD_SQL_INSTANCE",
+                        }
+                    ]
+                }
+            else:
+                request.execute.return_value = self.test_response
+            return request
+
+        service.instances.return_value.list.side_effect = list_instances
+        service.instances.return_value.list_next.return_value = None
+        site = Site({})
+        results = obtain_instances_for_projects(
+            config,
+            site,
+            [test_fixtures.project1, "forbidden", test_fixtures.project2],
+            None,
+            parallel=3,
+        )
+        assert [result.project for result in results] == [
+            test_fixtures.project1,
+            "forbidden",
+            test_fixtures.project2,
+        ]
+        assert [result.inserted for result in results] == [1, 0, 1]
+        assert str(results[1].error) == "403"
+        assert results[0].error is None
+        assert sorted(site.instances.keys()) == sorted(
+            [test_fixtures.connection_name1, test_fixtures.connection_name2]
+        )
+        assert len(site.nicknames["database-postgres"]) == 2
+
+        mock_list_projects.return_value = [test_fixtures.project2]
+        site = Site({})
+        results = obtain_instances_for_projects(
+            config, site, None, None, all_projects=True, instance_filter="region:region-2"
+        )
+        service.instances.return_value.list.assert_called_with(
+            project=test_fixtures.project2,
+            fields=INSTANCE_LIST_FIELDS,
+            filter="region:region-2",
+        )
+        assert [result.project for result in results] == [test_fixtures.project2]
+        assert list(site.instances.keys()) == [test_fixtures.connection_name2]
+
+    @mock.patch("cloud_sql.gcp.discovery.build_from_document")
+    @mock.patch("cloud_sql.gcp.google.auth.default")
+    def test_obtain_instances_follows_pages(self, mock_auth, mock_discovery):
+        service = MagicMock()
+        config = MagicMock(spec=Configuration)
+        config.enable_iam_by_default = False
+        mock_auth.return_value = "creds1", test_fixtures.project1
+        mock_discovery.return_value = service
+        first = MagicMock()
+        first.execute.return_value = {
+            "items": [
+                {
+                    "name": test_fixtures.name2,
+                    "region": test_fixtures.region2,
+                    "project": test_fixtures.project1,
+                    "connectionName": test_fixtures.connection_name2,
+                    "instanceType": "CLOUD_SQL_INSTANCE",
+                }
+            ],
+            "nextPageToken": "page2",
+        }
+        second = MagicMock()
+        second.execute.return_value = self.test_response
+        third = MagicMock()
+        third.execute.return_value = {}
+        service.instances.return_value.list.return_value = first
+        service.instances.return_value.list_next.side_effect = [second, third, None]
+        site = Site({test_fixtures.connection_name3: test_fixtures.instance3})
+        [result] = obtain_instances_for_projects(config, site, None, True)
+        assert (result.inserted, result.deleted) == (2, 1)
+        service.instances.return_value.list.assert_called_once_with(
+            project=test_fixtures.project1, fields=INSTANCE_LIST_FIELDS
+        )
+        assert sorted(site.instances.keys()) == sorted(
+            [test_fixtures.connection_name1, test_fixtures.connection_name2]
+        )
+
+    @mock.patch("cloud_sql.gcp.merge_page")
+    @mock.patch("cloud_sql.gcp.discovery.build_from_document")
+    @mock.patch("cloud_sql.gcp.google.auth.default")
+    def test_obtain_instances_merge_error(self, mock_auth, mock_discovery, mock_merge):
+        service = MagicMock()
+        config = MagicMock(spec=Configuration)
+        config.enable_iam_by_default = False
+        mock_auth.return_value = "creds1", test_fixtures.project1
+        mock_discovery.return_value = service
+        page = MagicMock()
+        page.execute.return_value = self.test_response
+        service.instances.return_value.list.return_value = page
+        # more pages than the queue holds, so the worker is blocked when merging fails
+        service.instances.return_value.list_next.side_effect = [page] * 4 + [None]
+        mock_merge.side_effect = [None, ValueError("bad page")]
+        outcome = []
+
+        def run():
+            try:
+                obtain_instances_for_projects(config, Site({}), None, None, parallel=1)
+            except ValueError as err:
+                outcome.append(err)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive()
+        assert [str(err) for err in outcome] == ["bad page"]
+
+    @mock.patch("cloud_sql.gcp.discovery.build_from_document")
+    @mock.patch("cloud_sql.gcp.google.auth.default")
+    def test_obtain_instances_ports_exhausted(self, mock_auth, mock_discovery):
+        service = MagicMock()
+        config = MagicMock(spec=Configuration)
+        config.enable_iam_by_default = False
+        mock_auth.return_value = "creds1", test_fixtures.project1
+        mock_discovery.return_value = service
+        pages = []
+        for i in range(5):
+            page = MagicMock()
+            page.execute.return_value = {
+                "items": [
+                    {
+                        "name": f"db{i}-instance-1",
+                        "region": test_fixtures.region1,
+                        "project": test_fixtures.project1,
+                        "connectionName": f"{test_fixtures.project1}:{test_fixtures.region1}:db{i}-instance-1",
+                        "instanceType": "CLOUD_SQL_INSTANCE",
+                    }
+                ]
+            }
+            pages.append(page)
+        service.instances.return_value.list.return_value = pages[0]
+        service.instances.return_value.list_next.side_effect = pages[1:] + [None]
+        site = Site({})
+        site.configure_ports((6000, 6999), {test_fixtures.project1: (6000, 6000)})
+
+        [result] = obtain_instances_for_projects(config, site, None, True, parallel=1)
+        assert isinstance(result.error, PortsExhaustedError)
+        assert result.inserted == 1
+        assert result.removed == []
+        assert list(site.instances) == [
+            f"{test_fixtures.project1}:{test_fixtures.region1}:db0-instance-1"
+        ]
+        assert test_fixtures.project1 not in site.project_markers
+
+    @mock.patch("cloud_sql.gcp.discovery.build_from_document")
+    @mock.patch("cloud_sql.gcp.google.auth.default")
+    def test_obtain_instances_incremental(self, mock_auth, mock_discovery):
+        service = MagicMock()
+        config = MagicMock(spec=Configuration)
+        config.enable_iam_by_default = False
+        mock_auth.return_value = "creds1", test_fixtures.project1
+        mock_discovery.return_value = service
+        item = {**self.test_response["items"][0], "etag": "etag-1"}
+        fingerprint = instance_fingerprint(item)
+        request = MagicMock()
+        request.execute.return_value = {"items": [item]}
+        service.instances.return_value.list.return_value = request
+        service.instances.return_value.list_next.return_value = None
+
+        site = Site({})
+        [result] = obtain_instances_for_projects(config, site, None, None)
+        assert result.changes == [f"+ {test_fixtures.connection_name1}"]
+        assert result.unchanged is False
+        assert site.instances[test_fixtures.connection_name1].fingerprint == fingerprint
+
+        site.dirty = False
+        [result] = obtain_instances_for_projects(config, site, None, None)
+        assert result.unchanged is True
+        assert result.changes == []
+        assert site.dirty is False
+
+        # removed locally, so the import adds it back even though the
+        # project marker is the same as before
+        site.remove_instance(test_fixtures.connection_name1)
+        [result] = obtain_instances_for_projects(config, site, None, None)
+        assert result.inserted == 1
+        assert result.unchanged is False
+        assert result.changes == [f"+ {test_fixtures.connection_name1}"]
+
+        # the etag changes when settings the manager does not keep are edited
+        site.dirty = False
+        item["etag"] = "etag-2"
+        [result] = obtain_instances_for_projects(config, site, None, None)
+        assert result.unchanged is True
+        assert result.changes == []
+        assert site.dirty is False
+
+    @mock.patch("cloud_sql.gcp.discovery.build_from_document")
+    def test_list_accessible_projects(self, mock_discovery):
+        service = MagicMock()
+        mock_discovery.return_value = service
+        first = MagicMock()
+        first.execute.return_value = {"projects": [{"projectId": "a"}, {"projectId": "b"}]}
+        second = MagicMock()
+        second.execute.return_value = {}
+        service.projects.return_value.list.return_value = first
+        service.projects.return_value.list_next.side_effect = [second, None]
+        assert list_accessible_projects("creds") == ["a", "b"]
+        service.projects.return_value.list.assert_called_once_with(
+            filter="lifecycleState:ACTIVE"
+        )
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+from typing import Dict
+
+# cumulative import time budgets in microseconds, measured with -X importtime
+COMMAND_BUDGET = 150_000
+IMPORT_COMMAND_BUDGET = 1_000_000
+HEAVY_MODULES = ["googleapiclient.discovery", "google.auth", "psutil", "jsonpickle"]
+
+
+def import_profile(code: str, home: str) -> Dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env={**os.environ, "HOME": home},
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+
+def run_command(*args: str) -> str:
+    return f"import sys; sys.argv = ['cloud_sql', {', '.join(repr(a) for a in args)}]; from cloud_sql import run; run()"
+
+
+class TestImportTime:
+    def test_list(self, tmp_path):
+        profile = import_profile(run_command("list"), str(tmp_path))
+        for module in HEAVY_MODULES:
+            assert module not in profile
+        assert profile["cloud_sql"] < COMMAND_BUDGET
+        # nothing is listening, so the daemon client is never imported
+        assert "cloud_sql.daemon" not in profile
+
+    def test_start(self, tmp_path):
+        profile = import_profile(run_command("start", "nick"), str(tmp_path))
+        for module in HEAVY_MODULES:
+            assert module not in profile
+        assert profile["cloud_sql"] < COMMAND_BUDGET
+
+    def test_import(self, tmp_path):
+        profile = import_profile(
+            "import cloud_sql.instance_manager; import cloud_sql.gcp", str(tmp_path)
+        )
+        assert "googleapiclient.discovery" in profile
+        assert profile["cloud_sql"] + profile["cloud_sql.gcp"] < IMPORT_COMMAND_BUDGET
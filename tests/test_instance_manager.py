@@ -1,3 +1,5 @@
+import json
+from copy import deepcopy
 from unittest import mock
 from unittest.mock import MagicMock, call, patch
 
@@ -9,13 +11,20 @@ from cloud_sql.instance_manager import (
     print_list_running,
     start,
     stop,
+    reap,
     import_instances,
+    stop_removed_instances,
     update,
     update_config,
     execute_command,
+    load_site_for_command,
+    load_state,
+    save_state,
     add_instance,
     remove_instance,
 )
+from cloud_sql.gcp import ProjectImport
+from cloud_sql.ports import PortInUseError
 from cloud_sql.instances import (
     Site,
     Instance,
@@ -23,7 +32,8 @@ from cloud_sql.instances import (
     InvalidConnectionName,
     DuplicateInstanceError,
 )
-from cloud_sql.running_instances import RunningInstances
+from cloud_sql.running_instances import RunningInstance, RunningInstances
+from cloud_sql.sqlite_store import SqlitePersistence
 from tests import test_fixtures
 
 
@@ -40,21 +50,35 @@ def add_instance_side_effect(*args):
 
 
 class TestInstanceManager:
-    @patch("cloud_sql.instance_manager.check_if_proxy_is_running")
-    def test_refresh_running(self, mock_check_proxy):
+    @patch("cloud_sql.instance_manager.process_start_time")
+    @patch("cloud_sql.instance_manager.scan_proxy_processes")
+    def test_refresh_running(self, mock_scan, mock_start_time):
         running_instances = MagicMock(spec=RunningInstances)
-        running_instances.get_all_running.return_value = {
-            test_fixtures.connection_name1: test_fixtures.pid1,
-            test_fixtures.connection_name2: test_fixtures.pid2,
+        running_instances.get_all_running_instances.return_value = {
+            test_fixtures.connection_name1: RunningInstance(test_fixtures.pid1, None, None, None),
+            test_fixtures.connection_name2: RunningInstance(test_fixtures.pid2, None, None, None),
+            test_fixtures.connection_name3: RunningInstance(1113, 100.0, None, None),
+            "verified": RunningInstance(1114, 200.0, None, None),
         }
 
-        mock_check_proxy.side_effect = (
-            lambda p, cn: MagicMock() if cn == test_fixtures.connection_name1 else None
-        )
+        mock_start_time.side_effect = lambda pid: 200.0 if pid == 1114 else 150.0
+        mock_scan.return_value = {
+            test_fixtures.pid1: f"cloud_sql_proxy -instances={test_fixtures.connection_name1}=tcp:1234",
+            test_fixtures.pid2: "some other process",
+        }
         refresh_running(running_instances)
-        running_instances.remove_running.assert_called_once_with(
-            test_fixtures.connection_name2
+        assert set(mock_scan.call_args[0][0]) == {test_fixtures.pid1, test_fixtures.pid2}
+        running_instances.remove_running.assert_has_calls(
+            [call(test_fixtures.connection_name3), call(test_fixtures.connection_name2)]
         )
+        assert running_instances.remove_running.call_count == 2
+
+        mock_scan.reset_mock()
+        running_instances.get_all_running_instances.return_value = {
+            "verified": RunningInstance(1114, 200.0, None, None),
+        }
+        refresh_running(running_instances)
+        mock_scan.assert_not_called()
 
     @mock.patch("cloud_sql.instance_manager.print")
     def test_get_instance_from_nick(self, mock_print):
@@ -74,17 +98,27 @@ class TestInstanceManager:
             "More than one instance with that name or nick found, try specifying a project with --project."
         )
 
-    @mock.patch("cloud_sql.instance_manager.print")
-    def test_print_list(self, mock_print):
-        test_print = ["one", "two"]
+    def test_print_list(self, capsys):
         site = MagicMock(spec=Site)
-        site.print_list.return_value = test_print
+        site.find.return_value = [test_fixtures.instance1, test_fixtures.instance2]
         print_list(site, "proj", "filly")
-        site.print_list.assert_called_once_with("proj", "filly")
-        assert mock_print.call_count == 2
+        site.find.assert_called_once_with("proj", "filly")
+        assert capsys.readouterr().out == (
+            f"{test_fixtures.instance1.print(None)}\n{test_fixtures.instance2.print(None)}\n"
+        )
 
-    @mock.patch("cloud_sql.instance_manager.print")
-    def test_print_running(self, mock_print):
+        print_list(site, "proj", "filly", "ndjson")
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)["connection_name"] for line in lines] == [
+            test_fixtures.connection_name1,
+            test_fixtures.connection_name2,
+        ]
+
+        site = Site({test_fixtures.connection_name1: test_fixtures.instance1})
+        print_list(site, None, "/[/")
+        assert capsys.readouterr().out.startswith("Invalid regular expression /[/")
+
+    def test_print_running(self, capsys):
         running_instances = MagicMock(spec=RunningInstances)
         running_instances.get_all_running.return_value = {
             test_fixtures.connection_name1: test_fixtures.pid1
@@ -96,12 +130,19 @@ class TestInstanceManager:
 
         print_list_running(site, running_instances)
         instance.print.assert_called_once_with(test_fixtures.pid1)
-        mock_print.assert_called_once_with("TestInstance")
+        assert capsys.readouterr().out == "TestInstance\n"
+
+        site.instances = {test_fixtures.connection_name1: test_fixtures.instance1}
+        print_list_running(site, running_instances, "json")
+        rows = json.loads(capsys.readouterr().out)
+        assert rows[0]["pid"] == test_fixtures.pid1
+        assert rows[0]["port"] == test_fixtures.port1
 
-        mock_print.reset_mock()
         running_instances.get_all_running.return_value = {}
         print_list_running(site, running_instances)
-        mock_print.assert_called_once_with("No running instances")
+        assert capsys.readouterr().out == "No running instances\n"
+        print_list_running(site, running_instances, "json")
+        assert capsys.readouterr().out == "[]\n"
 
     @mock.patch("cloud_sql.instance_manager.get_instance_from_nick")
     @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
@@ -109,6 +150,7 @@ class TestInstanceManager:
     def test_start(self, mock_print, mock_run, mock_get_from_nick):
         config = MagicMock(spec=Configuration)
         config.cloud_sql_path = "/cloud/sql"
+        config.max_proxies = None
 
         instance = MagicMock(spec=Instance)
         instance.port = test_fixtures.port1
@@ -180,8 +222,439 @@ class TestInstanceManager:
         mock_get_from_nick.assert_called_once_with(site, "nick", test_fixtures.project1)
         mock_run.assert_not_called()
 
+    @mock.patch("cloud_sql.instance_manager.listening_ports")
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_start_port_in_use(self, mock_print, mock_run, mock_listening):
+        config = MagicMock(spec=Configuration)
+        config.cloud_sql_path = "/cloud/sql"
+        config.max_proxies = None
+        instance1 = deepcopy(test_fixtures.instance1)
+        instance2 = deepcopy(test_fixtures.instance2)
+        site = MagicMock(spec=Site)
+        site.get_default_instances.return_value = [instance1, instance2]
+        running_instances = RunningInstances({})
+        mock_listening.return_value = {test_fixtures.port1, 22}
+        mock_run.return_value = test_fixtures.pid2
+
+        assert start(config, site, running_instances, "default", None) is False
+        mock_listening.assert_called_once_with()
+        mock_run.assert_called_once_with(
+            "/cloud/sql", test_fixtures.connection_name2, test_fixtures.port2, False
+        )
+        mock_print.assert_has_calls(
+            [
+                call(
+                    f"Port {test_fixtures.port1} for database-postgres is already in use by another process, not starting it."
+                ),
+                call(f"Started {test_fixtures.name2} on port {test_fixtures.port2}"),
+            ]
+        )
+        assert list(running_instances.instances.keys()) == [
+            test_fixtures.connection_name2
+        ]
+
+    @mock.patch("cloud_sql.instance_manager.process_start_time")
+    @mock.patch("cloud_sql.instance_manager.wait_for_port")
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_start_wait(self, mock_print, mock_run, mock_wait, mock_start_time):
+        config = MagicMock(spec=Configuration)
+        config.cloud_sql_path = "/cloud/sql"
+        config.max_proxies = None
+
+        instance1 = MagicMock(spec=Instance)
+        instance1.port = test_fixtures.port1
+        instance1.iam = False
+        instance1.connection_name = test_fixtures.connection_name1
+        instance1.name = test_fixtures.name1
+        instance2 = MagicMock(spec=Instance)
+        instance2.port = test_fixtures.port2
+        instance2.iam = True
+        instance2.connection_name = test_fixtures.connection_name2
+        instance2.name = test_fixtures.name2
+
+        site = MagicMock(spec=Site)
+        site.get_default_instances.return_value = [instance1, instance2]
+
+        running_instances = MagicMock(spec=RunningInstances)
+        running_instances.get_running.return_value = None
+
+        mock_run.side_effect = lambda path, cn, port, iam: test_fixtures.pid1 if port == test_fixtures.port1 else test_fixtures.pid2
+        mock_wait.side_effect = lambda port, timeout: port == test_fixtures.port1
+        mock_start_time.return_value = test_fixtures.start_time1
+
+        assert start(config, site, running_instances, "default", None, True, 2.0, 2) is False
+        assert mock_run.call_count == 2
+        mock_wait.assert_has_calls(
+            [call(test_fixtures.port1, 2.0), call(test_fixtures.port2, 2.0)], any_order=True
+        )
+        running_instances.add_running.assert_has_calls(
+            [
+                call(
+                    test_fixtures.pid1,
+                    test_fixtures.connection_name1,
+                    test_fixtures.start_time1,
+                    test_fixtures.port1,
+                    "/cloud/sql",
+                ),
+                call(
+                    test_fixtures.pid2,
+                    test_fixtures.connection_name2,
+                    test_fixtures.start_time1,
+                    test_fixtures.port2,
+                    "/cloud/sql",
+                ),
+            ]
+        )
+        assert mock_print.call_args_list[0][0][0].startswith(
+            f"Started {test_fixtures.name1} on port {test_fixtures.port1}, ready in "
+        )
+        mock_print.assert_called_with(
+            f"Started {test_fixtures.name2} on port {test_fixtures.port2} but it was not ready within 2.0s"
+        )
+
+        mock_wait.side_effect = None
+        mock_wait.return_value = True
+        assert start(config, site, running_instances, "default", None, True, 2.0, 1) is True
+
+    @mock.patch("cloud_sql.instance_manager.listening_ports", return_value=set())
+    @mock.patch("cloud_sql.instance_manager.process_start_time")
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy_group")
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_start_grouped(
+        self, mock_print, mock_run, mock_run_group, mock_start_time, mock_listening
+    ):
+        config = MagicMock(spec=Configuration)
+        config.cloud_sql_path = "/cloud/sql"
+        config.max_proxies = None
+        instance1 = deepcopy(test_fixtures.instance1)
+        instance2 = deepcopy(test_fixtures.instance2)
+        instance3 = deepcopy(test_fixtures.instance3)
+        site = MagicMock(spec=Site)
+        site.get_default_instances.return_value = [instance1, instance2, instance3]
+        running_instances = RunningInstances({})
+        mock_run_group.return_value = test_fixtures.pid1
+        mock_run.return_value = test_fixtures.pid2
+        mock_start_time.return_value = test_fixtures.start_time1
+
+        assert start(
+            config, site, running_instances, "default", None, group="project"
+        )
+        mock_run_group.assert_called_once_with(
+            "/cloud/sql",
+            [
+                (test_fixtures.connection_name1, test_fixtures.port1),
+                (test_fixtures.connection_name3, test_fixtures.port3),
+            ],
+            False,
+        )
+        mock_run.assert_called_once_with(
+            "/cloud/sql", test_fixtures.connection_name2, test_fixtures.port2, False
+        )
+        assert running_instances.get_all_running() == {
+            test_fixtures.connection_name1: test_fixtures.pid1,
+            test_fixtures.connection_name3: test_fixtures.pid1,
+            test_fixtures.connection_name2: test_fixtures.pid2,
+        }
+        mock_print.assert_any_call(
+            f"Started 2 instances in one proxy with pid {test_fixtures.pid1}"
+        )
+
+    @mock.patch("cloud_sql.instance_manager.time.time", return_value=10000.0)
+    @mock.patch("cloud_sql.instance_manager.established_connections")
+    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxies")
+    @mock.patch("cloud_sql.instance_manager.listening_ports", return_value=set())
+    @mock.patch("cloud_sql.instance_manager.process_start_time")
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_start_over_max_proxies(
+        self,
+        mock_print,
+        mock_run,
+        mock_start_time,
+        mock_listening,
+        mock_stop,
+        mock_connections,
+        mock_time,
+    ):
+        config = Configuration("/cloud/sql", False)
+        config.set_max_proxies(2)
+        instance1 = deepcopy(test_fixtures.instance1)
+        instance2 = deepcopy(test_fixtures.instance2)
+        instance3 = deepcopy(test_fixtures.instance3)
+        site = Site(
+            {
+                instance.connection_name: instance
+                for instance in (instance1, instance2, instance3)
+            }
+        )
+        site.rename_instance(instance3, "other")
+        running_instances = RunningInstances(
+            {
+                test_fixtures.connection_name1: RunningInstance(
+                    test_fixtures.pid1, None, test_fixtures.port1, None, None, 1000.0
+                ),
+                test_fixtures.connection_name2: RunningInstance(
+                    test_fixtures.pid2, None, test_fixtures.port2, None, None, 2000.0
+                ),
+            }
+        )
+        # instance 1 was started first but is the one in use now
+        mock_connections.return_value = {test_fixtures.port1: 1, test_fixtures.port2: 0}
+        mock_run.return_value = 3333
+
+        assert start(config, site, running_instances, "other", test_fixtures.project1)
+        mock_stop.assert_called_once_with(
+            {test_fixtures.connection_name2: test_fixtures.pid2}, 5.0
+        )
+        mock_print.assert_any_call(
+            f"Stopped database-postgres on port {test_fixtures.port2} to stay within the limit of 2 proxies"
+        )
+        assert running_instances.get_all_running() == {
+            test_fixtures.connection_name1: test_fixtures.pid1,
+            test_fixtures.connection_name3: 3333,
+        }
+
+        # pinned proxies are never stopped, so there is no room
+        instance1.set_pinned(True)
+        running_instances.remove_running(test_fixtures.connection_name3)
+        running_instances.add_running(test_fixtures.pid2, test_fixtures.connection_name2)
+        site.instances[test_fixtures.connection_name2].set_pinned(True)
+        mock_stop.reset_mock()
+        mock_run.reset_mock()
+        assert (
+            start(config, site, running_instances, "other", test_fixtures.project1)
+            is False
+        )
+        mock_stop.assert_not_called()
+        mock_run.assert_not_called()
+        mock_print.assert_called_with(
+            "Not starting other, it would go over the limit of 2 proxies"
+        )
+
+    @mock.patch("cloud_sql.instance_manager.refresh_running")
+    @mock.patch("cloud_sql.instance_manager.established_connections", return_value={})
+    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxies")
+    @mock.patch("cloud_sql.instance_manager.listening_ports", return_value=set())
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_start_keeps_pinned_sqlite(
+        self,
+        mock_print,
+        mock_run,
+        mock_listening,
+        mock_stop,
+        mock_connections,
+        mock_refresh,
+        tmp_path,
+    ):
+        pinned = deepcopy(test_fixtures.instance2)
+        pinned.set_pinned(True)
+        site = Site(
+            {
+                test_fixtures.connection_name1: deepcopy(test_fixtures.instance1),
+                test_fixtures.connection_name2: pinned,
+            }
+        )
+        site.rename_instance(pinned, "pinned")
+        config = Configuration("/cloud/sql", False)
+        config.set_max_proxies(1)
+        persistence = SqlitePersistence(str(tmp_path))
+        persistence.save_site(site)
+        persistence.save_config(config)
+        persistence.save_running(
+            RunningInstances(
+                {
+                    test_fixtures.connection_name2: RunningInstance(
+                        test_fixtures.pid2, None, test_fixtures.port2, None
+                    )
+                }
+            )
+        )
+
+        parameters = {
+            "command": "start",
+            "name": "database-postgres",
+            "project": test_fixtures.project1,
+            "wait": False,
+            "timeout": 30.0,
+            "parallel": 8,
+            "group": None,
+        }
+        config, site, running_instances = load_state(persistence, parameters)
+        assert execute_command(parameters, config, site, running_instances) == 1
+        mock_stop.assert_not_called()
+        mock_run.assert_not_called()
+        mock_print.assert_called_with(
+            "Not starting database-postgres, it would go over the limit of 1 proxies"
+        )
+
+    @mock.patch("cloud_sql.instance_manager.process_start_time")
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxies")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_stop_grouped_member(
+        self, mock_print, mock_stop, mock_run, mock_start_time
+    ):
+        config = MagicMock(spec=Configuration)
+        config.cloud_sql_path = "/cloud/sql"
+        config.max_proxies = None
+        instance3 = deepcopy(test_fixtures.instance3)
+        site = Site(
+            {
+                test_fixtures.connection_name1: deepcopy(test_fixtures.instance1),
+                test_fixtures.connection_name3: instance3,
+            }
+        )
+        site.rename_instance(instance3, "other")
+        running_instances = RunningInstances({})
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name1)
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name3)
+        mock_stop.return_value = {test_fixtures.connection_name1: (0.1, False)}
+        mock_run.return_value = test_fixtures.pid2
+
+        stop(
+            site,
+            running_instances,
+            "database-postgres",
+            test_fixtures.project1,
+            config=config,
+        )
+        mock_stop.assert_called_once_with(
+            {test_fixtures.connection_name1: test_fixtures.pid1}, 5.0
+        )
+        mock_run.assert_called_once_with(
+            "/cloud/sql", test_fixtures.connection_name3, test_fixtures.port3, False
+        )
+        assert running_instances.get_all_running() == {
+            test_fixtures.connection_name3: test_fixtures.pid2
+        }
+        mock_print.assert_called_with(
+            f"Restarted other in a new proxy with pid {test_fixtures.pid2}"
+        )
+
+    @mock.patch("cloud_sql.instance_manager.refresh_running")
+    @mock.patch("cloud_sql.instance_manager.process_start_time")
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxies")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_stop_grouped_member_sqlite(
+        self, mock_print, mock_stop, mock_run, mock_start_time, mock_refresh, tmp_path
+    ):
+        instance3 = deepcopy(test_fixtures.instance3)
+        site = Site(
+            {
+                test_fixtures.connection_name1: deepcopy(test_fixtures.instance1),
+                test_fixtures.connection_name3: instance3,
+            }
+        )
+        site.rename_instance(instance3, "other")
+        running_instances = RunningInstances({})
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name1)
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name3)
+        persistence = SqlitePersistence(str(tmp_path))
+        persistence.save_site(site)
+        persistence.save_running(running_instances)
+        persistence.save_config(Configuration("/cloud/sql", False))
+        mock_stop.return_value = {test_fixtures.connection_name1: (0.1, False)}
+        mock_run.return_value = test_fixtures.pid2
+        mock_start_time.return_value = None
+
+        parameters = {
+            "command": "stop",
+            "name": "database-postgres",
+            "project": test_fixtures.project1,
+            "grace": 5.0,
+        }
+        config, site, running_instances = load_state(persistence, parameters)
+        assert execute_command(parameters, config, site, running_instances) == 0
+        save_state(persistence, config, site, running_instances)
+
+        mock_run.assert_called_once_with(
+            "/cloud/sql", test_fixtures.connection_name3, test_fixtures.port3, False
+        )
+        assert persistence.load_running().get_all_running() == {
+            test_fixtures.connection_name3: test_fixtures.pid2
+        }
+
+    @mock.patch("cloud_sql.instance_manager.time.time", return_value=10000.0)
+    @mock.patch("cloud_sql.instance_manager.process_memory")
+    @mock.patch("cloud_sql.instance_manager.established_connections")
+    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxies")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_reap(
+        self, mock_print, mock_stop, mock_connections, mock_memory, mock_time
+    ):
+        site = Site(
+            {
+                test_fixtures.connection_name1: deepcopy(test_fixtures.instance1),
+                test_fixtures.connection_name2: deepcopy(test_fixtures.instance2),
+                test_fixtures.connection_name3: deepcopy(test_fixtures.instance3),
+            }
+        )
+        running_instances = RunningInstances(
+            {
+                test_fixtures.connection_name1: RunningInstance(
+                    test_fixtures.pid1, None, test_fixtures.port1, None, None, 1000.0
+                ),
+                # grouped with instance 1, but still in use
+                test_fixtures.connection_name3: RunningInstance(
+                    test_fixtures.pid1, None, test_fixtures.port3, None, None, 1000.0
+                ),
+                test_fixtures.connection_name2: RunningInstance(
+                    test_fixtures.pid2, None, test_fixtures.port2, None, None, 1000.0
+                ),
+            }
+        )
+        mock_connections.return_value = {
+            test_fixtures.port1: 0,
+            test_fixtures.port2: 0,
+            test_fixtures.port3: 1,
+        }
+        mock_memory.return_value = 30 * 1024 * 1024
+        mock_stop.return_value = {test_fixtures.connection_name2: (0.1, False)}
+
+        assert reap(site, running_instances, 600.0, dry_run=True) == {
+            test_fixtures.connection_name2: 9000.0
+        }
+        mock_stop.assert_not_called()
+        mock_print.assert_called_with("Would reclaim 30.0MiB from 1 proxies")
+        assert (
+            running_instances.get_running_instance(
+                test_fixtures.connection_name3
+            ).last_used
+            == 10000.0
+        )
+
+        assert reap(site, running_instances, 600.0) == {
+            test_fixtures.connection_name2: 9000.0
+        }
+        mock_connections.assert_called_with(
+            {test_fixtures.port1, test_fixtures.port2, test_fixtures.port3}
+        )
+        mock_stop.assert_called_once_with(
+            {test_fixtures.connection_name2: test_fixtures.pid2}, 5.0
+        )
+        mock_print.assert_has_calls(
+            [
+                call(
+                    f"Stopped {test_fixtures.instance2.nick_name} on port {test_fixtures.port2}, idle for 9000s"
+                ),
+                call("Reclaimed 30.0MiB from 1 proxies"),
+            ]
+        )
+        assert running_instances.get_running(test_fixtures.connection_name2) is None
+
+        mock_print.reset_mock()
+        assert reap(site, running_instances, 600.0, test_fixtures.project2) == {}
+        mock_print.assert_called_once_with("No running instances")
+        assert reap(site, running_instances, 600.0) == {}
+        mock_print.assert_called_with("No idle proxies")
+
     @mock.patch("cloud_sql.instance_manager.get_instance_from_nick")
-    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxies")
     @mock.patch("cloud_sql.instance_manager.print")
     def test_stop(self, mock_print, mock_stop, mock_get_from_nick):
         running_instances = MagicMock(spec=RunningInstances)
@@ -208,13 +681,13 @@ class TestInstanceManager:
             test_fixtures.connection_name1: test_fixtures.pid1
         }
         running_instances.get_running.return_value = test_fixtures.pid1
-        mock_stop.return_value = True
-        stop(site, running_instances, "all", test_fixtures.project1)
+        mock_stop.return_value = {test_fixtures.connection_name1: (0.25, False)}
+        stop(site, running_instances, "all", test_fixtures.project1, 3.0)
         mock_print.assert_called_once_with(
-            f"Stopped {test_fixtures.name1} on port {test_fixtures.port1}"
+            f"Stopped {test_fixtures.name1} on port {test_fixtures.port1} in 0.25s"
         )
         mock_stop.assert_called_once_with(
-            test_fixtures.pid1, test_fixtures.connection_name1
+            {test_fixtures.connection_name1: test_fixtures.pid1}, 3.0
         )
         running_instances.remove_running.assert_called_once_with(
             test_fixtures.connection_name1
@@ -228,26 +701,19 @@ class TestInstanceManager:
         running_instances.remove_running.reset_mock()
         running_instances.get_running.reset_mock()
 
-        running_instances.get_all_running.return_value = {
-            test_fixtures.connection_name1: test_fixtures.pid1
-        }
-        running_instances.get_running.return_value = test_fixtures.pid1
         mock_get_from_nick.return_value = instance
-        mock_stop.return_value = True
+        mock_stop.return_value = {test_fixtures.connection_name1: (5.5, True)}
         stop(site, running_instances, "nick", test_fixtures.project1)
         mock_get_from_nick.assert_called_once_with(site, "nick", test_fixtures.project1)
         mock_print.assert_called_once_with(
-            f"Stopped {test_fixtures.name1} on port {test_fixtures.port1}"
+            f"Killed {test_fixtures.name1} on port {test_fixtures.port1} after 5.50s, it did not exit within 5.0s"
         )
         mock_stop.assert_called_once_with(
-            test_fixtures.pid1, test_fixtures.connection_name1
+            {test_fixtures.connection_name1: test_fixtures.pid1}, 5.0
         )
         running_instances.remove_running.assert_called_once_with(
             test_fixtures.connection_name1
         )
-        running_instances.get_running.assert_called_once_with(
-            test_fixtures.connection_name1
-        )
 
         mock_print.reset_mock()
         mock_stop.reset_mock()
@@ -255,26 +721,16 @@ class TestInstanceManager:
         running_instances.get_running.reset_mock()
         mock_get_from_nick.reset_mock()
 
-        running_instances.get_all_running.return_value = {
-            test_fixtures.connection_name1: test_fixtures.pid1
-        }
-        running_instances.get_running.return_value = test_fixtures.pid1
         mock_get_from_nick.return_value = instance
-        mock_stop.return_value = False
+        mock_stop.return_value = {test_fixtures.connection_name1: None}
         stop(site, running_instances, "nick", test_fixtures.project1)
         mock_get_from_nick.assert_called_once_with(site, "nick", test_fixtures.project1)
         mock_print.assert_called_once_with(
             "Could not locate process to stop for nick, it has been removed from the running list"
         )
-        mock_stop.assert_called_once_with(
-            test_fixtures.pid1, test_fixtures.connection_name1
-        )
         running_instances.remove_running.assert_called_once_with(
             test_fixtures.connection_name1
         )
-        running_instances.get_running.assert_called_once_with(
-            test_fixtures.connection_name1
-        )
 
         mock_print.reset_mock()
         mock_stop.reset_mock()
@@ -284,7 +740,6 @@ class TestInstanceManager:
 
         running_instances.get_running.return_value = None
         mock_get_from_nick.return_value = instance
-        mock_stop.return_value = False
         stop(site, running_instances, "nick", test_fixtures.project1)
         mock_get_from_nick.assert_called_once_with(site, "nick", test_fixtures.project1)
         mock_print.assert_called_once_with("nick is not running")
@@ -304,19 +759,160 @@ class TestInstanceManager:
         mock_get_from_nick.assert_called_once_with(site, "nick", test_fixtures.project1)
         mock_stop.assert_not_called()
 
-    @mock.patch("cloud_sql.instance_manager.obtain_instances")
+    @mock.patch("cloud_sql.instance_manager.default_base_path")
+    @mock.patch("cloud_sql.gcp.obtain_instances_for_projects")
     @mock.patch("cloud_sql.instance_manager.print")
-    def test_import_instances(self, mock_print, mock_obtain_instances):
+    def test_import_instances(self, mock_print, mock_obtain_instances, mock_base_path, tmp_path):
         site = MagicMock(spec=Site)
         site.instances = {}
+        mock_base_path.return_value = "/home/test/.cloudsql"
 
         config = MagicMock(spec=Configuration)
-        mock_obtain_instances.side_effect = add_instance_side_effect
-        import_instances(config, site, test_fixtures.project1, True)
+        result = ProjectImport(test_fixtures.project1)
+        result.inserted = 1
+        result.changes = [f"+ {test_fixtures.connection_name1}"]
+        result.elapsed = 0.5
+        mock_obtain_instances.return_value = [result]
+        running_instances = RunningInstances({})
+        assert (
+            import_instances(
+                config, site, running_instances, [test_fixtures.project1], True, True
+            )
+            is True
+        )
         mock_obtain_instances.assert_called_once_with(
-            config, site, test_fixtures.project1, True
+            config,
+            site,
+            [test_fixtures.project1],
+            True,
+            "/home/test/.cloudsql/discovery",
+            True,
+            False,
+            8,
+            None,
+        )
+        mock_print.assert_has_calls(
+            [
+                call(
+                    f"{test_fixtures.project1}: 1 imported, 0 removed in 0.50s"
+                ),
+                call(f"  + {test_fixtures.connection_name1}"),
+                call("Imported 1 instances."),
+                call("Removed 0 instances."),
+            ]
+        )
+
+        projects_file = tmp_path / "projects.txt"
+        projects_file.write_text("# fleet\nproject-a\n\n  project-b  \n")
+        failed = ProjectImport("project-b")
+        failed.error = Exception("forbidden")
+        failed.elapsed = 0.25
+        unchanged = ProjectImport("project-c")
+        unchanged.unchanged = True
+        unchanged.elapsed = 0.1
+        mock_obtain_instances.reset_mock()
+        mock_print.reset_mock()
+        mock_obtain_instances.return_value = [result, failed, unchanged]
+        assert (
+            import_instances(
+                config,
+                site,
+                running_instances,
+                [test_fixtures.project1],
+                False,
+                False,
+                str(projects_file),
+                False,
+                2,
+                "region:europe-west2",
+            )
+            is False
+        )
+        assert mock_obtain_instances.call_args[0][2] == [
+            test_fixtures.project1,
+            "project-a",
+            "project-b",
+        ]
+        assert mock_obtain_instances.call_args[0][8] == "region:europe-west2"
+        mock_print.assert_has_calls(
+            [
+                call("project-b: import failed after 0.25s: forbidden"),
+                call("project-c: unchanged in 0.10s"),
+                call("Imported 1 instances."),
+            ]
+        )
+        assert mock_print.call_count == 5
+
+    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxies")
+    @mock.patch("cloud_sql.instance_manager.default_base_path")
+    @mock.patch("cloud_sql.gcp.obtain_instances_for_projects")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_import_instances_tidy(
+        self, mock_print, mock_obtain_instances, mock_base_path, mock_stop_proxies
+    ):
+        site = MagicMock(spec=Site)
+        config = MagicMock(spec=Configuration)
+        mock_base_path.return_value = "/home/test/.cloudsql"
+        result = ProjectImport(test_fixtures.project1)
+        result.deleted = 2
+        result.removed = [test_fixtures.connection_name1, test_fixtures.connection_name3]
+        mock_obtain_instances.return_value = [result]
+        mock_stop_proxies.return_value = {test_fixtures.connection_name1: (0.1, False)}
+        running_instances = RunningInstances({})
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name1)
+        running_instances.add_running(test_fixtures.pid2, test_fixtures.connection_name2)
+
+        assert import_instances(config, site, running_instances, None, True) is True
+        mock_stop_proxies.assert_called_once_with(
+            {test_fixtures.connection_name1: test_fixtures.pid1}
+        )
+        assert list(running_instances.instances.keys()) == [
+            test_fixtures.connection_name2
+        ]
+        mock_print.assert_has_calls(
+            [
+                call("Removed 2 instances."),
+                call(f"Stopped proxy for removed instance {test_fixtures.connection_name1}"),
+            ]
+        )
+
+        mock_obtain_instances.reset_mock()
+        assert (
+            import_instances(
+                config, site, running_instances, None, True, False, None, False, 8, "region:x"
+            )
+            is False
+        )
+        mock_obtain_instances.assert_not_called()
+
+    @mock.patch("cloud_sql.instance_manager.process_start_time")
+    @mock.patch("cloud_sql.instance_manager.run_cloud_sql_proxy")
+    @mock.patch("cloud_sql.instance_manager.stop_cloud_sql_proxies")
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_stop_removed_grouped_member(
+        self, mock_print, mock_stop, mock_run, mock_start_time
+    ):
+        config = MagicMock(spec=Configuration)
+        config.cloud_sql_path = "/cloud/sql"
+        site = Site({test_fixtures.connection_name3: deepcopy(test_fixtures.instance3)})
+        running_instances = RunningInstances({})
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name1)
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name3)
+        mock_stop.return_value = {test_fixtures.connection_name1: (0.1, False)}
+        mock_run.return_value = test_fixtures.pid2
+
+        stop_removed_instances(
+            config, site, running_instances, [test_fixtures.connection_name1]
+        )
+        mock_stop.assert_called_once_with(
+            {test_fixtures.connection_name1: test_fixtures.pid1}
+        )
+        mock_run.assert_called_once_with(
+            "/cloud/sql", test_fixtures.connection_name3, test_fixtures.port3, False
         )
-        mock_print.assert_has_calls([call("Imported 1 instances."),call("Removed 0 instances.")])
+        assert running_instances.get_all_running() == {
+            test_fixtures.connection_name3: test_fixtures.pid2
+        }
 
     @mock.patch("cloud_sql.instance_manager.get_instance_from_nick")
     @mock.patch("cloud_sql.instance_manager.print")
@@ -338,14 +934,15 @@ class TestInstanceManager:
         update(site, "nick", test_fixtures.project1, "True", "newnick", "True")
         instance.set_iam.assert_called_once_with(True)
         instance.set_default.assert_called_once_with(True)
-        assert instance.nick_name == "newnick"
-        site.set_up_nicknames.assert_called_once()
+        site.rename_instance.assert_called_once_with(instance, "newnick")
+        site.mark_dirty.assert_called()
         mock_print.assert_any_call("Instance updated:")
         mock_print.assert_any_call("instance")
 
         site.get_instance_by_nick_name.reset_mock()
         site.get_instance_by_nick_name.side_effect = None
-        site.set_up_nicknames.reset_mock()
+        site.rename_instance.reset_mock()
+        site.mark_dirty.reset_mock()
         site.get_instance_by_nick_name.return_value = MagicMock(spec=Instance)
         instance.nick_name = "oldnick"
         mock_print.reset_mock()
@@ -355,11 +952,24 @@ class TestInstanceManager:
 
         update(site, "nick", test_fixtures.project1, None, "newnick", None)
         assert instance.nick_name == "oldnick"
-        site.set_up_nicknames.assert_not_called()
+        site.rename_instance.assert_not_called()
+        site.mark_dirty.assert_not_called()
         mock_print.assert_any_call("That nick would not be unique, pick another.")
         mock_print.assert_any_call("Instance updated:")
         mock_print.assert_any_call("instance")
 
+        mock_print.reset_mock()
+        update(site, "nick", test_fixtures.project1, None, None, None, 6001)
+        site.pin_port.assert_called_once_with(instance, 6001)
+        site.pin_port.side_effect = PortInUseError("Port 6001 is already assigned to another instance")
+        update(site, "nick", test_fixtures.project1, None, None, None, 6001)
+        mock_print.assert_any_call("Port 6001 is already assigned to another instance")
+
+        site.mark_dirty.reset_mock()
+        update(site, "nick", test_fixtures.project1, None, None, None, None, "true")
+        instance.set_pinned.assert_called_once_with(True)
+        site.mark_dirty.assert_called_once_with(instance)
+
     @mock.patch("cloud_sql.instance_manager.print")
     def test_update_config(self, mock_print):
         config = MagicMock(spec=Configuration)
@@ -389,6 +999,36 @@ class TestInstanceManager:
         config.set_enable_iam_by_default.assert_called_once_with(True)
         mock_print.assert_called_once_with("Updated default IAM setting to: True")
 
+    @mock.patch("cloud_sql.instance_manager.print")
+    def test_update_config_ports(self, mock_print):
+        config = Configuration("/a/path", True)
+        update_config(config, None, None, (6000, 6999), (test_fixtures.project1, (6000, 6099)), [6500])
+        assert config.port_range == (6000, 6999)
+        assert config.project_port_ranges == {test_fixtures.project1: (6000, 6099)}
+        assert config.reserved_ports == [6500]
+        mock_print.assert_has_calls(
+            [
+                call("Updated port range to 6000-6999"),
+                call(f"Updated port range for {test_fixtures.project1} to 6000-6099"),
+                call("Reserved port 6500"),
+            ]
+        )
+
+        mock_print.reset_mock()
+        update_config(config, None, None, None, (test_fixtures.project2, (7000, 7099)))
+        assert test_fixtures.project2 not in config.project_port_ranges
+        mock_print.assert_called_once_with(
+            f"Port range 7000-7099 for {test_fixtures.project2} is not inside 6000-6999"
+        )
+
+        mock_print.reset_mock()
+        update_config(config, None, None, max_proxies=10)
+        assert config.max_proxies == 10
+        mock_print.assert_called_once_with("Updated the limit on running proxies to 10")
+        update_config(config, None, None, max_proxies=0)
+        assert config.max_proxies is None
+        mock_print.assert_called_with("Removed the limit on running proxies")
+
     @mock.patch("cloud_sql.instance_manager.print")
     def test_add(self, mock_print):
         config = MagicMock(spec=Configuration)
@@ -458,8 +1098,105 @@ class TestInstanceManager:
         mock_print.assert_any_call(
             f"Removed connection: {test_fixtures.connection_name1}"
         )
-        mock_stop.assert_called_once_with(site, "nick", test_fixtures.project1)
+        mock_stop.assert_called_once_with(
+            site, running_instances, "nick", test_fixtures.project1, config=None
+        )
+
+    def test_load_site_for_command(self):
+        persistence = MagicMock()
+        load_site_for_command(
+            persistence, {"command": "start", "name": "nick", "project": "proj"}
+        )
+        persistence.load_site_for_nick_name.assert_called_once_with("nick", "proj")
+        persistence.load_site.assert_not_called()
 
+        persistence.reset_mock()
+        load_site_for_command(
+            persistence, {"command": "stop", "name": "all", "project": None}
+        )
+        persistence.load_site.assert_called_once_with()
+        persistence.load_site_for_nick_name.assert_not_called()
+
+        persistence.reset_mock()
+        load_site_for_command(persistence, {"command": "list", "project": None})
+        persistence.load_site.assert_called_once_with()
+
+        update = {"command": "update", "name": "nick", "project": None, "nick": None}
+        for parameters, scoped in (
+            ({**update, "port": None}, True),
+            ({**update, "port": 6000}, False),
+            ({**update, "nick": "other", "port": None}, False),
+            ({"command": "remove", "name": "nick", "project": None}, True),
+        ):
+            persistence.reset_mock()
+            load_site_for_command(persistence, parameters)
+            assert persistence.load_site_for_nick_name.called is scoped
+            assert persistence.load_site.called is not scoped
+
+    @patch("cloud_sql.instance_manager.refresh_running")
+    def test_load_state(self, mock_refresh):
+        persistence = MagicMock()
+        config, site, running = load_state(
+            persistence, {"command": "list", "project": None, "filter": None}
+        )
+        assert config is None and running is None
+        assert site == persistence.load_site.return_value
+        persistence.load_config.assert_not_called()
+        persistence.load_running.assert_not_called()
+        mock_refresh.assert_not_called()
+
+        persistence.reset_mock()
+        config, site, running = load_state(
+            persistence, {"command": "config", "path": None, "iam_default": None}
+        )
+        assert config == persistence.load_config.return_value
+        assert site is None and running is None
+        mock_refresh.assert_not_called()
+
+        persistence.reset_mock()
+        persistence.load_config.return_value.max_proxies = None
+        config, site, running = load_state(
+            persistence, {"command": "start", "name": "nick", "project": None}
+        )
+        assert config == persistence.load_config.return_value
+        assert site == persistence.load_site_for_nick_name.return_value
+        assert running == persistence.load_running.return_value
+        mock_refresh.assert_called_once_with(running)
+        site.configure_ports.assert_called_once_with(
+            config.port_range, config.project_port_ranges, config.reserved_ports
+        )
+
+        persistence.reset_mock()
+        persistence.load_config.return_value.max_proxies = 10
+        config, site, running = load_state(
+            persistence, {"command": "start", "name": "nick", "project": None}
+        )
+        assert site == persistence.load_site.return_value
+        persistence.load_site_for_nick_name.assert_not_called()
+
+        persistence.reset_mock()
+        assert load_state(persistence, {"command": None}) == (None, None, None)
+
+    def test_save_state(self):
+        persistence = MagicMock()
+        config = Configuration("/a/path", True)
+        site = Site({})
+        running_instances = RunningInstances({})
+        save_state(persistence, config, site, running_instances)
+        save_state(persistence, None, None, None)
+        persistence.save_config.assert_not_called()
+        persistence.save_site.assert_not_called()
+        persistence.save_running.assert_not_called()
+
+        config.set_enable_iam_by_default(False)
+        site.mark_dirty()
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name1)
+        save_state(persistence, config, site, running_instances)
+        persistence.save_config.assert_called_once_with(config)
+        persistence.save_site.assert_called_once_with(site)
+        persistence.save_running.assert_called_once_with(running_instances)
+
+    @mock.patch("cloud_sql.instance_manager.reap")
     @mock.patch("cloud_sql.instance_manager.remove_instance")
     @mock.patch("cloud_sql.instance_manager.add_instance")
     @mock.patch("cloud_sql.instance_manager.print_list")
@@ -482,44 +1219,84 @@ class TestInstanceManager:
         mock_print_list,
         mock_add_instance,
         mock_remove_instance,
+        mock_reap,
     ):
         config = MagicMock(spec=Configuration)
         site = MagicMock(spec=Site)
         running_instances = MagicMock(spec=RunningInstances)
 
-        parameters = {"command": "list", "project": test_fixtures.project1, "filter": None}
+        parameters = {
+            "command": "list",
+            "project": test_fixtures.project1,
+            "filter": None,
+            "format": "table",
+        }
         execute_command(parameters, config, site, running_instances)
-        mock_print_list.assert_called_once_with(site, test_fixtures.project1, None)
+        mock_print_list.assert_called_once_with(
+            site, test_fixtures.project1, None, "table"
+        )
 
         mock_print_list.reset_mock()
-        parameters = {"command": "list", "project": test_fixtures.project1, "filter": "filly"}
+        parameters = {
+            "command": "list",
+            "project": test_fixtures.project1,
+            "filter": "filly",
+            "format": "csv",
+        }
         execute_command(parameters, config, site, running_instances)
-        mock_print_list.assert_called_once_with(site, test_fixtures.project1, "filly")
+        mock_print_list.assert_called_once_with(
+            site, test_fixtures.project1, "filly", "csv"
+        )
 
-        parameters = {"command": "list-running"}
+        parameters = {"command": "list-running", "format": "ndjson"}
         execute_command(parameters, config, site, running_instances)
-        mock_list_running.assert_called_once_with(site, running_instances)
+        mock_list_running.assert_called_once_with(site, running_instances, "ndjson")
 
         parameters = {
             "command": "start",
             "name": "nick",
             "project": test_fixtures.project1,
+            "wait": True,
+            "timeout": 5.0,
+            "parallel": 4,
+            "group": "project",
         }
-        execute_command(parameters, config, site, running_instances)
+        mock_start.return_value = True
+        assert execute_command(parameters, config, site, running_instances) == 0
         mock_start.assert_called_once_with(
-            config, site, running_instances, "nick", test_fixtures.project1
+            config,
+            site,
+            running_instances,
+            "nick",
+            test_fixtures.project1,
+            True,
+            5.0,
+            4,
+            "project",
         )
+        mock_start.return_value = False
+        assert execute_command(parameters, config, site, running_instances) == 1
 
         parameters = {
             "command": "stop",
             "name": "nick",
             "project": test_fixtures.project1,
+            "grace": 2.0,
         }
         execute_command(parameters, config, site, running_instances)
         mock_stop.assert_called_once_with(
-            site, running_instances, "nick", test_fixtures.project1
+            site, running_instances, "nick", test_fixtures.project1, 2.0, config
         )
 
+        parameters = {
+            "command": "reap",
+            "idle": 300.0,
+            "project": None,
+            "dry_run": True,
+        }
+        execute_command(parameters, config, site, running_instances)
+        mock_reap.assert_called_once_with(site, running_instances, 300.0, None, True)
+
         parameters = {
             "command": "update",
             "name": "nick",
@@ -527,21 +1304,61 @@ class TestInstanceManager:
             "iam": "true",
             "nick": "newnick",
             "default": "false",
+            "port": 6001,
+            "pinned": "true",
         }
         execute_command(parameters, config, site, running_instances)
         mock_update.assert_called_once_with(
-            site, "nick", test_fixtures.project1, "true", "newnick", "false"
+            site,
+            "nick",
+            test_fixtures.project1,
+            "true",
+            "newnick",
+            "false",
+            6001,
+            "true",
         )
 
-        parameters = {"command": "import", "project": test_fixtures.project1, "tidy": True}
-        execute_command(parameters, config, site, running_instances)
+        parameters = {
+            "command": "import",
+            "project": [test_fixtures.project1],
+            "tidy": True,
+            "refresh_discovery": False,
+            "projects_file": None,
+            "all_projects": False,
+            "parallel": 4,
+            "filter": "region:europe-west2",
+        }
+        mock_import_instances.return_value = True
+        assert execute_command(parameters, config, site, running_instances) == 0
         mock_import_instances.assert_called_once_with(
-            config, site, test_fixtures.project1, True
+            config,
+            site,
+            running_instances,
+            [test_fixtures.project1],
+            True,
+            False,
+            None,
+            False,
+            4,
+            "region:europe-west2",
         )
+        mock_import_instances.return_value = False
+        assert execute_command(parameters, config, site, running_instances) == 1
 
-        parameters = {"command": "config", "path": "/test/path", "iam_default": "true"}
+        parameters = {
+            "command": "config",
+            "path": "/test/path",
+            "iam_default": "true",
+            "port_range": (6000, 6999),
+            "project_port_range": None,
+            "reserve": [6100],
+            "max_proxies": 10,
+        }
         execute_command(parameters, config, site, running_instances)
-        mock_update_config.assert_called_once_with(config, "/test/path", "true")
+        mock_update_config.assert_called_once_with(
+            config, "/test/path", "true", (6000, 6999), None, [6100], 10
+        )
 
         parameters = {
             "command": "add",
@@ -556,7 +1373,7 @@ class TestInstanceManager:
         parameters = {"command": "remove", "name": "nick", "project": "project"}
         execute_command(parameters, config, site, running_instances)
         mock_remove_instance.assert_called_once_with(
-            site, running_instances, "nick", "project"
+            site, running_instances, "nick", "project", config
         )
 
         parameters = {"command": "fish"}
@@ -8,6 +8,7 @@ from cloud_sql.instances import (
     DuplicateInstanceError,
     InvalidConnectionName,
 )
+from cloud_sql.ports import PortInUseError
 from tests import test_fixtures
 
 
@@ -28,6 +29,29 @@ class TestInstance:
         )
         assert instance.nick_name == "database-postgres"
 
+    def test_derived_fields(self):
+        instance = Instance(
+            test_fixtures.name1,
+            test_fixtures.region1,
+            test_fixtures.project1,
+            test_fixtures.connection_name1,
+            False,
+        )
+        assert not hasattr(instance, "__dict__")
+        assert instance._connection_name is None
+        assert instance._nick_name is None
+        assert instance.connection_name == test_fixtures.connection_name1
+
+        instance.nick_name = "nick"
+        assert instance.nick_name == "nick"
+        instance.nick_name = "database-postgres"
+        assert instance._nick_name is None
+
+        other = Instance("name", "region", "domain.com:project", "other:connection", False)
+        assert other.connection_name == "other:connection"
+        same = Instance("n2", test_fixtures.region1, "".join(["project", "-1"]), "c", False)
+        assert same.project is instance.project
+
     def test_assign_port(self):
         instance = Instance(
             test_fixtures.name1,
@@ -109,8 +133,35 @@ class TestSite:
             f"{test_fixtures.project1}:{test_fixtures.region1}:{name3}",
             False,
         )
+        assert site.dirty is False
         site.update(instance)
-        assert instance.port == 5513
+        assert instance.port == 5434
+        assert site.dirty is True
+
+    def test_refresh(self):
+        existing = deepcopy(test_fixtures.instance1)
+        existing.fingerprint = "fingerprint-1"
+        site = Site({test_fixtures.connection_name1: existing})
+        remote = deepcopy(test_fixtures.instance1)
+        remote.fingerprint = "fingerprint-1"
+        assert site.refresh(remote) is False
+        assert site.dirty is False
+
+        # an etag stored by an older version
+        existing.fingerprint = "etag-1"
+        remote.port = None
+        assert site.refresh(remote) is True
+        assert existing.fingerprint == "fingerprint-1"
+        assert existing.port == test_fixtures.port1
+        assert site.dirty is True
+
+    def test_set_project_marker(self):
+        site = Site({})
+        assert site.set_project_marker(test_fixtures.project1, "abc") is True
+        assert site.dirty is True
+        site.dirty = False
+        assert site.set_project_marker(test_fixtures.project1, "abc") is False
+        assert site.dirty is False
 
     def test_print_list(self):
         test_instance = deepcopy(test_fixtures.instance2)
@@ -123,7 +174,7 @@ class TestSite:
         )
         site.set_up_nicknames()
 
-        values = site.print_list(test_fixtures.project1, None)
+        values = list(site.print_list(test_fixtures.project1, None))
         assert len(values) == 1
         assert (
             values[0]
@@ -131,13 +182,36 @@ class TestSite:
         )
 
 
-        values = site.print_list(None, 'tn')
+        values = list(site.print_list(None, 'tn'))
         assert len(values) == 1
         assert (
             values[0]
             == "Project: project-2, Nick: testnick, Port 5512, Name: database-postgres-instance-1235, Region: region-2, IAM Enabled: False, Default: True"
         )
 
+    def test_find_keeps_search_index(self):
+        instance1 = deepcopy(test_fixtures.instance1)
+        instance2 = deepcopy(test_fixtures.instance2)
+        site = Site(
+            {
+                test_fixtures.connection_name1: instance1,
+                test_fixtures.connection_name2: instance2,
+            }
+        )
+        assert site.find(None, "project-2") == [instance2]
+        index = site.search_index
+        assert site.find(None, "postgres") == [instance1, instance2]
+        assert site.search_index is index
+        assert site.find(test_fixtures.project1, "postgres") == [instance1]
+
+        site.rename_instance(instance2, "renamed")
+        assert site.search_index is None
+        assert site.find(None, "renamed") == [instance2]
+
+        instance1.set_iam(True)
+        site.mark_dirty()
+        assert site.find(None, "iam:true") == [instance1]
+
     def test_get_instance_by_nickname(self):
         site = Site(
             {
@@ -190,8 +264,8 @@ class TestSite:
     def test_add_instance(self):
         site = Site(
             {
-                test_fixtures.name1: test_fixtures.instance1,
-                test_fixtures.name2: test_fixtures.instance2,
+                test_fixtures.connection_name1: test_fixtures.instance1,
+                test_fixtures.connection_name2: test_fixtures.instance2,
             }
         )
         site.set_up_nicknames()
@@ -231,8 +305,83 @@ class TestSite:
         site.remove_instance(
             test_fixtures.instance1.connection_name,
         )
+        assert site.dirty is True
         with raises(InstanceNotFoundError):
             site.get_instance_by_nick_name(
                 test_fixtures.instance1.nick_name, test_fixtures.instance1.project
             )
         assert test_fixtures.instance1.connection_name not in site.instances
+
+    def test_remove_instances_in_batch(self):
+        site = Site(
+            {
+                test_fixtures.connection_name1: test_fixtures.instance1,
+                test_fixtures.connection_name2: test_fixtures.instance2,
+                test_fixtures.connection_name3: test_fixtures.instance3,
+            }
+        )
+        site.set_up_nicknames()
+        site.remove_instances([])
+        assert site.dirty is False
+        site.remove_instances(
+            [test_fixtures.connection_name1, test_fixtures.connection_name3]
+        )
+        assert site.dirty is True
+        assert list(site.instances.keys()) == [test_fixtures.connection_name2]
+        assert site.nicknames["database-postgres"] == [test_fixtures.instance2]
+
+    def test_rename_instance(self):
+        instance1 = deepcopy(test_fixtures.instance1)
+        instance2 = deepcopy(test_fixtures.instance2)
+        site = Site(
+            {
+                test_fixtures.connection_name1: instance1,
+                test_fixtures.connection_name2: instance2,
+            }
+        )
+        assert site.project_nicknames[
+            (test_fixtures.project1, "database-postgres")
+        ] == [instance1]
+        site.rename_instance(instance1, "renamed")
+        assert site.dirty is True
+        assert instance1.nick_name == "renamed"
+        assert site.nicknames["database-postgres"] == [instance2]
+        assert (test_fixtures.project1, "database-postgres") not in site.project_nicknames
+        assert site.get_instance_by_nick_name("renamed", test_fixtures.project1) == instance1
+        assert site.get_instance_by_nick_name("database-postgres", None) == instance2
+        with raises(InstanceNotFoundError):
+            site.get_instance_by_nick_name("renamed", test_fixtures.project2)
+
+        site.remove_instance(test_fixtures.connection_name1)
+        assert "renamed" not in site.nicknames
+        assert (test_fixtures.project1, "renamed") not in site.project_nicknames
+
+    def test_pin_port(self):
+        instance1 = deepcopy(test_fixtures.instance1)
+        instance2 = deepcopy(test_fixtures.instance2)
+        site = Site(
+            {
+                test_fixtures.connection_name1: instance1,
+                test_fixtures.connection_name2: instance2,
+            }
+        )
+        with raises(PortInUseError):
+            site.pin_port(instance1, test_fixtures.port2)
+        site.pin_port(instance1, test_fixtures.port1)
+        assert site.dirty is False
+        site.pin_port(instance1, 6000)
+        assert instance1.port == 6000
+        assert site.dirty is True
+        assert site.ports.is_used(test_fixtures.port1) is False
+
+        site.remove_instance(test_fixtures.connection_name2)
+        assert site.ports.is_used(test_fixtures.port2) is False
+
+    def test_configure_ports(self):
+        site = Site({test_fixtures.connection_name1: deepcopy(test_fixtures.instance1)})
+        site.configure_ports((6000, 6099), {test_fixtures.project2: (6050, 6059)}, [6000])
+        assert site.ports.is_used(test_fixtures.port1) is True
+        instance = deepcopy(test_fixtures.instance2)
+        instance.port = None
+        site.update(instance)
+        assert instance.port == 6050
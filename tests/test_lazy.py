@@ -0,0 +1,167 @@
+import os
+import selectors
+import socket
+import sys
+import time
+from copy import deepcopy
+
+from cloud_sql.config import Configuration
+from cloud_sql.instances import Site
+from cloud_sql.lazy import LazyProxies, LazyProxy
+from cloud_sql.running_instances import RunningInstances
+from tests import test_fixtures
+
+# stands in for cloud_sql_proxy, echoing whatever it is sent on the unix
+# socket it is told to listen on
+FAKE_PROXY = """
+import socket, sys
+path = sys.argv[-1].split("=unix:")[1]
+server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+server.bind(path)
+server.listen()
+while True:
+    connection, _ = server.accept()
+    with connection:
+        while True:
+            data = connection.recv(1024)
+            if not data:
+                break
+            connection.sendall(data)
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def fake_proxy(tmp_path) -> Configuration:
+    path = tmp_path / "cloud_sql_proxy"
+    path.write_text(f"#!{sys.executable}\n{FAKE_PROXY}")
+    path.chmod(0o755)
+    return Configuration(str(path), False)
+
+
+def poll(selector, lazy, config, running_instances, timeout=0.5):
+    for key, _ in selector.select(timeout):
+        assert isinstance(key.data, LazyProxy)
+        lazy.accept(key.data, config, running_instances)
+
+
+class TestLazyProxies:
+    def test_start_on_connection_and_stop_when_idle(self, tmp_path, capsys):
+        config = fake_proxy(tmp_path)
+        instance = deepcopy(test_fixtures.instance1)
+        instance.port = free_port()
+        site = Site({instance.connection_name: instance})
+        running_instances = RunningInstances({})
+        selector = selectors.DefaultSelector()
+        lazy = LazyProxies(str(tmp_path / "lazy"), selector, idle_timeout=0.0)
+
+        lazy.sync(site, running_instances)
+        proxy = lazy.proxies[instance.connection_name]
+        assert proxy.process is None
+        assert running_instances.get_running(instance.connection_name) is None
+
+        try:
+            with socket.create_connection(("127.0.0.1", instance.port)) as client:
+                poll(selector, lazy, config, running_instances)
+                assert proxy.is_running()
+                assert (
+                    running_instances.get_running(instance.connection_name)
+                    == proxy.process.pid
+                )
+                client.sendall(b"ping")
+                assert client.recv(1024) == b"ping"
+
+                lazy.reap_idle(running_instances)
+                assert proxy.is_running()
+
+            deadline = time.monotonic() + 5
+            while proxy.connections and time.monotonic() < deadline:
+                time.sleep(0.01)
+            process = proxy.process
+            lazy.reap_idle(running_instances)
+            assert proxy.process is None
+            assert process.wait(5) is not None
+            assert running_instances.get_running(instance.connection_name) is None
+            assert not os.path.exists(proxy.socket_path)
+            out = capsys.readouterr().out
+            assert "for a new connection" in out
+            assert "without connections" in out
+        finally:
+            lazy.close(running_instances)
+        assert lazy.proxies == {}
+
+    def test_failed_start_keeps_listening(self, tmp_path, capsys):
+        config = Configuration(str(tmp_path / "missing"), False)
+        instance = deepcopy(test_fixtures.instance1)
+        instance.port = free_port()
+        site = Site({instance.connection_name: instance})
+        running_instances = RunningInstances({})
+        selector = selectors.DefaultSelector()
+        lazy = LazyProxies(str(tmp_path / "lazy"), selector)
+
+        lazy.sync(site, running_instances)
+        proxy = lazy.proxies[instance.connection_name]
+        try:
+            with socket.create_connection(("127.0.0.1", instance.port)) as client:
+                poll(selector, lazy, config, running_instances)
+                assert client.recv(1024) == b""
+            assert proxy.process is None
+            assert proxy.connections == 0
+            assert running_instances.get_running(instance.connection_name) is None
+            assert f"Could not start {instance.nick_name}" in capsys.readouterr().out
+
+            # the port is still served, and the next connection tries again
+            config = fake_proxy(tmp_path)
+            with socket.create_connection(("127.0.0.1", instance.port)) as client:
+                poll(selector, lazy, config, running_instances)
+                client.sendall(b"ping")
+                assert client.recv(1024) == b"ping"
+        finally:
+            lazy.close(running_instances)
+
+    def test_sync(self, tmp_path, capsys):
+        instance1 = deepcopy(test_fixtures.instance1)
+        instance1.port = free_port()
+        instance2 = deepcopy(test_fixtures.instance2)
+        instance2.port = free_port()
+        site = Site(
+            {
+                instance1.connection_name: instance1,
+                instance2.connection_name: instance2,
+            }
+        )
+        running_instances = RunningInstances({})
+        running_instances.add_running(test_fixtures.pid1, instance2.connection_name)
+        lazy = LazyProxies(str(tmp_path), selectors.DefaultSelector())
+        try:
+            lazy.sync(site, running_instances)
+            assert list(lazy.proxies) == [instance1.connection_name]
+
+            # started outside the lazy proxies, so the port is given up
+            running_instances.add_running(test_fixtures.pid2, instance1.connection_name)
+            running_instances.remove_running(instance2.connection_name)
+            lazy.sync(site, running_instances)
+            assert list(lazy.proxies) == [instance2.connection_name]
+
+            with socket.socket() as taken:
+                taken.bind(("127.0.0.1", 0))
+                taken.listen()
+                site.pin_port(instance2, taken.getsockname()[1])
+                lazy.sync(site, running_instances)
+                assert lazy.proxies == {}
+                assert "Could not listen on port" in capsys.readouterr().out
+
+            running_instances.remove_running(instance1.connection_name)
+            lazy.sync(site, running_instances)
+            assert set(lazy.proxies) == {
+                instance1.connection_name,
+                instance2.connection_name,
+            }
+            lazy.release_listeners(running_instances)
+            assert lazy.proxies == {}
+        finally:
+            lazy.close(running_instances)
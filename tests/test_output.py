@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+from cloud_sql.output import INSTANCE_FIELDS, write_instances
+from tests import test_fixtures
+
+
+class TestOutput:
+    pairs = [(test_fixtures.instance1, None), (test_fixtures.instance2, None)]
+
+    def test_table(self):
+        out = io.StringIO()
+        assert write_instances(iter(self.pairs), "table", out=out) == 2
+        assert out.getvalue().splitlines() == [
+            test_fixtures.instance1.print(None),
+            test_fixtures.instance2.print(None),
+        ]
+
+    def test_json(self):
+        out = io.StringIO()
+        write_instances(iter(self.pairs), "json", out=out)
+        rows = json.loads(out.getvalue())
+        assert [row["connection_name"] for row in rows] == [
+            test_fixtures.connection_name1,
+            test_fixtures.connection_name2,
+        ]
+        assert rows[1]["default"] is True
+        assert "pid" not in rows[0]
+
+        out = io.StringIO()
+        assert write_instances(iter([]), "json", out=out) == 0
+        assert json.loads(out.getvalue()) == []
+
+    def test_ndjson(self):
+        out = io.StringIO()
+        write_instances(
+            iter([(test_fixtures.instance1, test_fixtures.pid1)]), "ndjson", True, out
+        )
+        row = json.loads(out.getvalue())
+        assert row["pid"] == test_fixtures.pid1
+        assert row["nick_name"] == "database-postgres"
+
+    def test_csv(self):
+        out = io.StringIO()
+        write_instances(
+            iter([(test_fixtures.instance1, test_fixtures.pid1)]), "csv", True, out
+        )
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        assert list(rows[0].keys()) == ["pid"] + list(INSTANCE_FIELDS)
+        assert rows[0]["port"] == str(test_fixtures.port1)
+
+    def test_streams(self):
+        out = io.StringIO()
+
+        def pairs():
+            yield test_fixtures.instance1, None
+            # the first row has already been written when the second is requested
+            assert out.getvalue().count("\n") == 1
+            yield test_fixtures.instance2, None
+
+        write_instances(pairs(), "ndjson", out=out)
+        assert out.getvalue().count("\n") == 2
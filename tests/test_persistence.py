@@ -5,8 +5,19 @@ import jsonpickle
 
 from cloud_sql.config import Configuration
 from cloud_sql.instances import Site
-from cloud_sql.persistence import Persistence, default_base_path
+from cloud_sql.persistence import Persistence, default_base_path, open_persistence
 from cloud_sql.running_instances import RunningInstances
+from cloud_sql.schema import (
+    config_from_dict,
+    config_to_dict,
+    dumps,
+    loads,
+    running_from_dict,
+    running_to_dict,
+    site_from_dict,
+    site_to_dict,
+)
+from cloud_sql.sqlite_store import SqlitePersistence
 from tests import test_fixtures
 
 
@@ -24,7 +35,7 @@ class TestPersistence:
             f = open_mock().__enter__()
             f.write.assert_called_once()
             callargs = f.write.call_args[0][0]
-            actual_site: Site = jsonpickle.decode(callargs)
+            actual_site: Site = site_from_dict(loads(callargs))
             assert len(actual_site.instances) == len(test_fixtures.site1.instances)
 
         mock_path.return_value = False
@@ -37,20 +48,33 @@ class TestPersistence:
             f = open_mock().__enter__()
             f.write.assert_called_once()
             callargs = f.write.call_args[0][0]
-            actual_site: Site = jsonpickle.decode(callargs)
+            actual_site: Site = site_from_dict(loads(callargs))
             assert len(actual_site.instances) == len(test_fixtures.site1.instances)
 
     @mock.patch("cloud_sql.persistence.os.path.exists")
     def test_load_site(self, mock_path):
         mock_path.return_value = True
 
-        json_str = jsonpickle.encode(test_fixtures.site1)
+        json_str = dumps(site_to_dict(test_fixtures.site1))
         with patch("builtins.open", new_callable=mock_open()) as open_mock:
             persistence = Persistence("test1")
             open_mock().__enter__().read.return_value = json_str
             actual_site = persistence.load_site()
             open_mock.assert_called_with("test1/instances.json", "r")
             assert len(actual_site.instances) == len(test_fixtures.site1.instances)
+            assert "database-postgres" in actual_site.nicknames
+
+        legacy_json_str = test_fixtures.legacy_site_document(
+            [
+                test_fixtures.legacy_instance(instance)
+                for instance in test_fixtures.site1.instances.values()
+            ]
+        )
+        with patch("builtins.open", new_callable=mock_open()) as open_mock:
+            persistence = Persistence("test1")
+            open_mock().__enter__().read.return_value = legacy_json_str
+            actual_site = persistence.load_site()
+            assert len(actual_site.instances) == len(test_fixtures.site1.instances)
 
         mock_path.return_value = False
         assert len(persistence.load_site().instances) == 0
@@ -68,7 +92,7 @@ class TestPersistence:
             f = open_mock().__enter__()
             f.write.assert_called_once()
             callargs = f.write.call_args[0][0]
-            actual_config: Configuration = jsonpickle.decode(callargs)
+            actual_config: Configuration = config_from_dict(loads(callargs))
             assert actual_config.cloud_sql_path == test_fixtures.config1.cloud_sql_path
 
         mock_path.return_value = False
@@ -81,7 +105,7 @@ class TestPersistence:
             f = open_mock().__enter__()
             f.write.assert_called_once()
             callargs = f.write.call_args[0][0]
-            actual_config: Configuration = jsonpickle.decode(callargs)
+            actual_config: Configuration = config_from_dict(loads(callargs))
             assert actual_config.cloud_sql_path == test_fixtures.config1.cloud_sql_path
 
     @mock.patch("cloud_sql.config.shutil.which")
@@ -89,7 +113,7 @@ class TestPersistence:
     def test_load_config(self, mock_path, mock_which):
         mock_path.return_value = True
 
-        json_str = jsonpickle.encode(test_fixtures.config1)
+        json_str = dumps(config_to_dict(test_fixtures.config1))
         with patch("builtins.open", new_callable=mock_open()) as open_mock:
             persistence = Persistence("test1")
             open_mock().__enter__().read.return_value = json_str
@@ -97,6 +121,13 @@ class TestPersistence:
             open_mock.assert_called_with("test1/config.json", "r")
             assert actual_config.cloud_sql_path == test_fixtures.config1.cloud_sql_path
 
+        legacy_json_str = jsonpickle.encode(test_fixtures.config1)
+        with patch("builtins.open", new_callable=mock_open()) as open_mock:
+            persistence = Persistence("test1")
+            open_mock().__enter__().read.return_value = legacy_json_str
+            actual_config = persistence.load_config()
+            assert actual_config.cloud_sql_path == test_fixtures.config1.cloud_sql_path
+
         mock_path.return_value = False
         mock_which.return_value = "/default/cloud_proxy"
         assert persistence.load_config().cloud_sql_path == "/default/cloud_proxy"
@@ -114,7 +145,7 @@ class TestPersistence:
             f = open_mock().__enter__()
             f.write.assert_called_once()
             callargs = f.write.call_args[0][0]
-            actual_running: RunningInstances = jsonpickle.decode(callargs)
+            actual_running: RunningInstances = running_from_dict(loads(callargs))
             assert len(actual_running.instances) == len(
                 test_fixtures.running_instances1.instances
             )
@@ -128,7 +159,7 @@ class TestPersistence:
             f = open_mock().__enter__()
             f.write.assert_called_once()
             callargs = f.write.call_args[0][0]
-            actual_running: RunningInstances = jsonpickle.decode(callargs)
+            actual_running: RunningInstances = running_from_dict(loads(callargs))
             assert len(actual_running.instances) == len(
                 test_fixtures.running_instances1.instances
             )
@@ -137,7 +168,7 @@ class TestPersistence:
     def test_load_running_instances(self, mock_path):
         mock_path.return_value = True
 
-        json_str = jsonpickle.encode(test_fixtures.running_instances1)
+        json_str = dumps(running_to_dict(test_fixtures.running_instances1))
         with patch("builtins.open", new_callable=mock_open()) as open_mock:
             persistence = Persistence("test1")
             open_mock().__enter__().read.return_value = json_str
@@ -146,6 +177,21 @@ class TestPersistence:
             assert len(actual_running.instances) == len(
                 test_fixtures.running_instances1.instances
             )
+            assert (
+                actual_running.instances[test_fixtures.name1].start_time
+                == test_fixtures.start_time1
+            )
+
+        legacy_json_str = jsonpickle.encode(
+            RunningInstances({test_fixtures.connection_name1: test_fixtures.pid1})
+        )
+        with patch("builtins.open", new_callable=mock_open()) as open_mock:
+            persistence = Persistence("test1")
+            open_mock().__enter__().read.return_value = legacy_json_str
+            actual_running = persistence.load_running()
+            assert actual_running.get_running(test_fixtures.connection_name1) == test_fixtures.pid1
+            assert actual_running.get_running_instance(test_fixtures.connection_name1).start_time is None
+
         mock_path.return_value = False
         assert len(persistence.load_running().instances) == 0
 
@@ -154,3 +200,17 @@ class TestPersistence:
         mock_getenv.return_value = "/home/test"
         assert default_base_path() == "/home/test/.cloudsql"
         mock_getenv.assert_called_once_with("HOME")
+
+    def test_open_persistence(self, tmp_path, monkeypatch):
+        monkeypatch.delenv("CLOUD_SQL_STATE_BACKEND", raising=False)
+        assert isinstance(open_persistence(str(tmp_path)), Persistence)
+        monkeypatch.setenv("CLOUD_SQL_STATE_BACKEND", "sqlite")
+        assert isinstance(open_persistence(str(tmp_path)), SqlitePersistence)
+        monkeypatch.delenv("CLOUD_SQL_STATE_BACKEND")
+        assert isinstance(open_persistence(str(tmp_path)), SqlitePersistence)
+
+    def test_load_site_for_nick_name(self, tmp_path):
+        persistence = Persistence(str(tmp_path))
+        persistence.save_site(test_fixtures.site1)
+        site = persistence.load_site_for_nick_name("database-postgres", None)
+        assert len(site.instances) == len(test_fixtures.site1.instances)
@@ -0,0 +1,63 @@
+from _pytest.python_api import raises
+
+from cloud_sql.ports import (
+    PortAllocator,
+    PortRangeError,
+    PortsExhaustedError,
+)
+from tests import test_fixtures
+
+
+class TestPortAllocator:
+    def test_allocate_and_reuse(self):
+        ports = PortAllocator((6000, 6019))
+        assert [ports.allocate() for _ in range(3)] == [6000, 6001, 6002]
+        ports.release(6001)
+        assert ports.is_used(6001) is False
+        assert ports.allocate() == 6001
+        assert ports.allocate() == 6003
+
+    def test_claim(self):
+        ports = PortAllocator((6000, 6019))
+        assert ports.claim(6000) is True
+        assert ports.claim(6000) is False
+        assert ports.claim(7000) is True
+        assert ports.is_used(7000) is True
+        ports.release(7000)
+        assert ports.is_used(7000) is False
+        ports.release(None)
+        assert ports.allocate() == 6001
+
+    def test_skips_full_bytes(self):
+        ports = PortAllocator((6000, 6099))
+        for port in range(6000, 6050):
+            ports.claim(port)
+        assert ports.allocate() == 6050
+
+    def test_exhausted(self):
+        ports = PortAllocator((6000, 6002))
+        for _ in range(3):
+            ports.allocate()
+        with raises(PortsExhaustedError):
+            ports.allocate()
+
+    def test_project_ranges_and_reserved(self):
+        ports = PortAllocator(
+            (6000, 6019),
+            {test_fixtures.project1: (6000, 6004)},
+            [6005, 6001, 9000],
+        )
+        assert ports.allocate() == 6006
+        assert ports.allocate(test_fixtures.project1) == 6000
+        assert ports.allocate(test_fixtures.project1) == 6002
+        assert ports.allocate(test_fixtures.project2) == 6007
+        assert ports.allocate(test_fixtures.project1) == 6003
+        assert ports.allocate(test_fixtures.project1) == 6004
+        with raises(PortsExhaustedError):
+            ports.allocate(test_fixtures.project1)
+
+    def test_invalid_ranges(self):
+        with raises(PortRangeError):
+            PortAllocator((6010, 6000))
+        with raises(PortRangeError):
+            PortAllocator((6000, 6010), {test_fixtures.project1: (5990, 6005)})
@@ -3,48 +3,88 @@ from unittest import mock
 from _pytest.python_api import raises
 
 from cloud_sql.config import default_configuration, Configuration, PathNotFoundError
-from cloud_sql.running_instances import RunningInstances
+from cloud_sql.running_instances import RunningInstance, RunningInstances
 from tests import test_fixtures
 
 
 class TestRunningInstances:
     def test_add_running(self):
         running_instances = RunningInstances({})
+        assert running_instances.dirty is False
         running_instances.add_running(
             test_fixtures.pid1, test_fixtures.connection_name1
         )
+        assert running_instances.dirty is True
         assert (
-            running_instances.instances[test_fixtures.connection_name1]
+            running_instances.instances[test_fixtures.connection_name1].pid
             == test_fixtures.pid1
         )
 
         running_instances.add_running(
-            test_fixtures.pid2, test_fixtures.connection_name1
-        )
-        assert (
-            running_instances.instances[test_fixtures.connection_name1]
-            == test_fixtures.pid2
+            test_fixtures.pid2,
+            test_fixtures.connection_name1,
+            test_fixtures.start_time1,
+            test_fixtures.port1,
+            "/path/to/proxy",
         )
+        running = running_instances.instances[test_fixtures.connection_name1]
+        assert running.pid == test_fixtures.pid2
+        assert running.start_time == test_fixtures.start_time1
+        assert running.port == test_fixtures.port1
+        assert running.path == "/path/to/proxy"
+
+    @mock.patch("cloud_sql.running_instances.time.time", return_value=1000.0)
+    def test_mark_used(self, mock_time):
+        running_instances = RunningInstances({})
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name1)
+        running = running_instances.get_running_instance(test_fixtures.connection_name1)
+        assert running.last_used == 1000.0
+        running_instances.dirty = False
+        running_instances.mark_used(test_fixtures.connection_name1, 1500.0)
+        assert running.last_used == 1500.0
+        assert running_instances.dirty is True
+
+    def test_get_group(self):
+        running_instances = RunningInstances({})
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name1)
+        running_instances.add_running(test_fixtures.pid2, test_fixtures.connection_name2)
+        running_instances.add_running(test_fixtures.pid1, test_fixtures.connection_name3)
+        assert running_instances.get_group(test_fixtures.connection_name3) == [
+            test_fixtures.connection_name1,
+            test_fixtures.connection_name3,
+        ]
+        assert running_instances.get_group(test_fixtures.connection_name2) == [
+            test_fixtures.connection_name2
+        ]
 
     def test_remove_running(self):
         running_instances = RunningInstances(
-            {test_fixtures.connection_name1: test_fixtures.pid1}
+            {test_fixtures.connection_name1: RunningInstance(test_fixtures.pid1, None, None, None)}
         )
         running_instances.remove_running(test_fixtures.connection_name1)
         assert len(running_instances.instances) == 0
+        assert running_instances.dirty is True
 
     def test_get_running(self):
         running_instances = RunningInstances(
-            {test_fixtures.connection_name1: test_fixtures.pid1}
+            {test_fixtures.connection_name1: RunningInstance(test_fixtures.pid1, None, None, None)}
         )
         assert (
             running_instances.get_running(test_fixtures.connection_name1)
             == test_fixtures.pid1
         )
         assert running_instances.get_running(test_fixtures.connection_name2) is None
+        assert (
+            running_instances.get_running_instance(test_fixtures.connection_name1).pid
+            == test_fixtures.pid1
+        )
+        assert running_instances.get_running_instance(test_fixtures.connection_name2) is None
 
     def test_get_all_running(self):
         running_instances = RunningInstances(
-            {test_fixtures.connection_name1: test_fixtures.pid1}
+            {test_fixtures.connection_name1: RunningInstance(test_fixtures.pid1, None, None, None)}
         )
-        assert len(running_instances.get_all_running()) == 1
+        assert running_instances.get_all_running() == {
+            test_fixtures.connection_name1: test_fixtures.pid1
+        }
+        assert len(running_instances.get_all_running_instances()) == 1
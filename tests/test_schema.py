@@ -0,0 +1,138 @@
+import json
+
+import jsonpickle
+from _pytest.python_api import raises
+
+from cloud_sql.config import Configuration
+from cloud_sql.instances import Instance
+from cloud_sql.running_instances import RunningInstances
+from cloud_sql.schema import (
+    SCHEMA_VERSION,
+    SchemaVersionError,
+    config_from_dict,
+    config_to_dict,
+    dumps,
+    instance_from_dict,
+    instance_to_dict,
+    loads,
+    read_document,
+    running_from_dict,
+    running_to_dict,
+    site_from_dict,
+    site_to_dict,
+)
+from tests import test_fixtures
+
+
+class TestSchema:
+    def test_instance_round_trip(self):
+        instance = Instance(
+            test_fixtures.name1,
+            test_fixtures.region1,
+            test_fixtures.project1,
+            test_fixtures.connection_name1,
+            True,
+        )
+        instance.nick_name = "nick"
+        instance.port = test_fixtures.port1
+        instance.set_default(True)
+        instance.fingerprint = "etag-1"
+        instance.set_pinned(True)
+        actual = instance_from_dict(loads(dumps(instance_to_dict(instance))))
+        assert actual.to_dict() == instance.to_dict()
+        assert actual._nick_name == "nick"
+        assert actual._connection_name is None
+
+    def test_site_round_trip(self):
+        data = site_to_dict(test_fixtures.site1)
+        assert data["project_markers"] == {}
+        data["project_markers"] = {test_fixtures.project1: "marker"}
+        assert data["version"] == SCHEMA_VERSION
+        assert "py/object" not in dumps(data)
+        site = site_from_dict(loads(dumps(data)))
+        assert site.dirty is False
+        assert sorted(site.instances.keys()) == sorted(
+            test_fixtures.site1.instances.keys()
+        )
+        assert site.get_instance_by_nick_name(
+            "database-postgres", test_fixtures.project2
+        ).port == test_fixtures.port2
+        assert site.ports.is_used(test_fixtures.port2)
+        assert site.project_markers == {test_fixtures.project1: "marker"}
+
+    def test_config_round_trip(self):
+        config = config_from_dict(loads(dumps(config_to_dict(test_fixtures.config1))))
+        assert config.cloud_sql_path == test_fixtures.config1.cloud_sql_path
+        assert config.enable_iam_by_default == test_fixtures.config1.enable_iam_by_default
+
+        original = Configuration("/a/path", True)
+        original.set_port_range((6000, 6999))
+        original.set_port_range((6000, 6099), test_fixtures.project1)
+        original.reserve_port(6500)
+        original.set_max_proxies(10)
+        config = config_from_dict(loads(dumps(config_to_dict(original))))
+        assert config.port_range == (6000, 6999)
+        assert config.project_port_ranges == {test_fixtures.project1: (6000, 6099)}
+        assert config.reserved_ports == [6500]
+        assert config.max_proxies == 10
+
+    def test_running_round_trip(self):
+        running = running_from_dict(
+            loads(dumps(running_to_dict(test_fixtures.running_instances1)))
+        )
+        actual = running.get_running_instance(test_fixtures.name1)
+        assert actual.pid == test_fixtures.pid1
+        assert actual.start_time == test_fixtures.start_time1
+        assert actual.port == test_fixtures.port1
+        assert running.get_running_instance(test_fixtures.name2).start_time is None
+        assert actual.restarts == []
+
+    def test_running_restarts_round_trip(self):
+        restarts = [{"time": 1700000000.0, "pid": test_fixtures.pid2, "exit_code": 1}]
+        original = RunningInstances({})
+        original.add_running(
+            test_fixtures.pid1, test_fixtures.connection_name1, restarts=restarts
+        )
+        original.mark_used(test_fixtures.connection_name1, 1700000100.0)
+        running = running_from_dict(loads(dumps(running_to_dict(original))))
+        actual = running.get_running_instance(test_fixtures.connection_name1)
+        assert actual.restarts == restarts
+        assert actual.last_used == 1700000100.0
+
+    def test_read_legacy_site(self):
+        instance = Instance(
+            test_fixtures.name1,
+            test_fixtures.region1,
+            test_fixtures.project1,
+            test_fixtures.connection_name1,
+            False,
+        )
+        instance.port = test_fixtures.port1
+        item = test_fixtures.legacy_instance(instance)
+        del item["default"]
+        del item["nick_name"]
+        item["shortname"] = "short"
+
+        data = read_document(test_fixtures.legacy_site_document([item]))
+        assert data["version"] == SCHEMA_VERSION
+        migrated = site_from_dict(data)
+        assert migrated.dirty is True
+        actual = migrated.instances[test_fixtures.connection_name1]
+        assert actual.nick_name == "short"
+        assert actual.default is False
+        assert actual.port == test_fixtures.port1
+
+    def test_read_legacy_config_and_running(self):
+        config = Configuration("/a/path", False)
+        del config.enable_iam_by_default
+        assert config_from_dict(read_document(jsonpickle.encode(config))).enable_iam_by_default is True
+
+        running = RunningInstances({test_fixtures.connection_name1: test_fixtures.pid1})
+        actual = running_from_dict(read_document(jsonpickle.encode(running)))
+        assert actual.get_running(test_fixtures.connection_name1) == test_fixtures.pid1
+
+    def test_read_newer_version(self):
+        with raises(SchemaVersionError):
+            read_document(json.dumps({"version": SCHEMA_VERSION + 1}))
+        with raises(SchemaVersionError):
+            read_document(json.dumps({"py/object": "some.other.Thing"}))
@@ -0,0 +1,111 @@
+from copy import deepcopy
+
+from _pytest.python_api import raises
+
+from cloud_sql.search import SearchIndex, SearchQueryError, parse_query, trigrams
+from tests import test_fixtures
+
+
+class TestSearch:
+    def index(self) -> SearchIndex:
+        instance3 = deepcopy(test_fixtures.instance3)
+        instance3.nick_name = "reporting"
+        instance3.region = "europe-west2"
+        instance3.connection_name = test_fixtures.connection_name3
+        instance3.iam = True
+        return SearchIndex(
+            [test_fixtures.instance1, test_fixtures.instance2, instance3]
+        )
+
+    def names(self, instances):
+        return sorted(instance.connection_name for instance in instances)
+
+    def test_trigrams(self):
+        assert trigrams("abcd") == {"abc", "bcd"}
+        assert trigrams("ab") == set()
+
+    def test_parse_query(self):
+        terms = parse_query("region:Europe-West2 tn proj:x nick:/^rep/")
+        assert [(term.field, term.value) for term in terms] == [
+            ("region", "europe-west2"),
+            (None, "tn"),
+            (None, "proj:x"),
+            ("nick", "/^rep/"),
+        ]
+        assert terms[3].pattern.pattern == "^rep"
+        with raises(SearchQueryError):
+            parse_query("/[/")
+
+    def test_substring(self):
+        index = self.index()
+        assert self.names(index.search("postgres")) == sorted(
+            [
+                test_fixtures.connection_name1,
+                test_fixtures.connection_name2,
+                test_fixtures.connection_name3,
+            ]
+        )
+        assert self.names(index.search("report")) == [test_fixtures.connection_name3]
+        assert self.names(index.search("1236")) == [test_fixtures.connection_name3]
+        assert self.names(index.search("WEST")) == [test_fixtures.connection_name3]
+        assert self.names(index.search("-2")) == [test_fixtures.connection_name2]
+        assert index.search("nothing-like-this") == []
+
+    def test_fields(self):
+        index = self.index()
+        assert self.names(index.search("region:europe-west2 iam:true")) == [
+            test_fixtures.connection_name3
+        ]
+        assert self.names(index.search("iam:false project:project-1")) == [
+            test_fixtures.connection_name1
+        ]
+        assert self.names(index.search(f"port:{test_fixtures.port2}")) == [
+            test_fixtures.connection_name2
+        ]
+        assert index.search("region:europe") == []
+
+    def test_index_matches_scan(self):
+        scan = self.index()
+        indexed = self.index()
+        indexed.build()
+        for query in (
+            "postgres",
+            "report 1236",
+            "WEST",
+            "-2",
+            "region:europe-west2 iam:true",
+            f"port:{test_fixtures.port2}",
+            "region:europe",
+            "nick:/^rep/",
+            "de",
+        ):
+            assert self.names(indexed.search(query)) == self.names(scan.search(query))
+
+    def test_builds_index_when_searched_again(self):
+        index = self.index()
+        index.search("postgres")
+        assert index.trigrams is None
+        assert self.names(index.search("report")) == [test_fixtures.connection_name3]
+        assert index.trigrams is not None
+
+    def test_printed_line_fallback(self):
+        index = self.index()
+        assert self.names(index.search("Default: True")) == [
+            test_fixtures.connection_name2
+        ]
+        assert self.names(index.search(f"Port {test_fixtures.port1}")) == [
+            test_fixtures.connection_name1
+        ]
+        assert len(index.search("IAM Enabled: False")) == 2
+        assert index.search("default: true") == []
+        assert index.search("nick:report Default:") == []
+
+    def test_regex(self):
+        index = self.index()
+        assert self.names(index.search("nick:/^rep/")) == [
+            test_fixtures.connection_name3
+        ]
+        assert self.names(index.search("/instance-123[45]$/")) == [
+            test_fixtures.connection_name1,
+            test_fixtures.connection_name2,
+        ]
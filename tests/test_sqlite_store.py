@@ -0,0 +1,129 @@
+from copy import deepcopy
+
+from _pytest.python_api import raises
+
+from cloud_sql.instances import Site
+from cloud_sql.persistence import Persistence
+from cloud_sql.schema import SchemaVersionError
+from cloud_sql.sqlite_store import SqlitePersistence
+from tests import test_fixtures
+
+
+class TestSqlitePersistence:
+    def test_site_round_trip(self, tmp_path):
+        persistence = SqlitePersistence(str(tmp_path))
+        assert len(persistence.load_site().instances) == 0
+
+        site = Site(
+            {
+                test_fixtures.connection_name1: test_fixtures.instance1,
+                test_fixtures.connection_name2: test_fixtures.instance2,
+            }
+        )
+        site.set_project_marker(test_fixtures.project1, "marker")
+        persistence.save_site(site)
+
+        persistence = SqlitePersistence(str(tmp_path))
+        actual = persistence.load_site()
+        assert sorted(actual.instances.keys()) == sorted(site.instances.keys())
+        assert actual.project_markers == {test_fixtures.project1: "marker"}
+        assert actual.instances[test_fixtures.connection_name2].default is True
+
+        actual.remove_instance(test_fixtures.connection_name1)
+        persistence.save_site(actual)
+        assert list(SqlitePersistence(str(tmp_path)).load_site().instances.keys()) == [
+            test_fixtures.connection_name2
+        ]
+
+    def test_load_site_for_nick_name(self, tmp_path):
+        persistence = SqlitePersistence(str(tmp_path))
+        persistence.save_site(
+            Site(
+                {
+                    test_fixtures.connection_name1: test_fixtures.instance1,
+                    test_fixtures.connection_name2: test_fixtures.instance2,
+                    test_fixtures.connection_name3: test_fixtures.instance3,
+                }
+            )
+        )
+
+        persistence = SqlitePersistence(str(tmp_path))
+        site = persistence.load_site_for_nick_name(
+            "database-postgres", test_fixtures.project2
+        )
+        assert list(site.instances.keys()) == [test_fixtures.connection_name2]
+        assert len(persistence.load_site_for_nick_name("database-postgres", None).instances) == 3
+        assert len(persistence.load_site_for_nick_name("fish", None).instances) == 0
+
+        persistence = SqlitePersistence(str(tmp_path))
+        site = persistence.load_site_for_nick_name(
+            "database-postgres", test_fixtures.project2
+        )
+        instance = site.instances[test_fixtures.connection_name2]
+        instance.set_iam(True)
+        site.mark_dirty(instance)
+        before = persistence.connection.total_changes
+        persistence.save_site(site)
+        assert persistence.connection.total_changes - before == 1
+        actual = SqlitePersistence(str(tmp_path)).load_site()
+        assert len(actual.instances) == 3
+        assert actual.instances[test_fixtures.connection_name2].iam is True
+
+    def test_saves_only_changed_rows(self, tmp_path):
+        persistence = SqlitePersistence(str(tmp_path))
+        persistence.save_site(
+            Site(
+                {
+                    test_fixtures.connection_name1: deepcopy(test_fixtures.instance1),
+                    test_fixtures.connection_name2: deepcopy(test_fixtures.instance2),
+                    test_fixtures.connection_name3: deepcopy(test_fixtures.instance3),
+                }
+            )
+        )
+        site = persistence.load_site()
+        site.rename_instance(site.instances[test_fixtures.connection_name1], "renamed")
+        site.remove_instance(test_fixtures.connection_name3)
+        before = persistence.connection.total_changes
+        persistence.save_site(site)
+        assert persistence.connection.total_changes - before == 2
+        site.mark_saved()
+        assert site.changed == set() and site.removed == set()
+
+        actual = SqlitePersistence(str(tmp_path)).load_site()
+        assert sorted(actual.instances) == sorted(
+            [test_fixtures.connection_name1, test_fixtures.connection_name2]
+        )
+        assert actual.instances[test_fixtures.connection_name1].nick_name == "renamed"
+
+    def test_config_and_running(self, tmp_path):
+        persistence = SqlitePersistence(str(tmp_path))
+        assert persistence.load_config().enable_iam_by_default is True
+        persistence.save_config(test_fixtures.config1)
+        persistence.save_running(test_fixtures.running_instances1)
+
+        persistence = SqlitePersistence(str(tmp_path))
+        assert persistence.load_config().cloud_sql_path == test_fixtures.config1.cloud_sql_path
+        running = persistence.load_running()
+        assert running.get_all_running() == test_fixtures.running_instances1.get_all_running()
+        assert running.get_running_instance(test_fixtures.name1).start_time == test_fixtures.start_time1
+
+    def test_imports_json_state(self, tmp_path):
+        json_persistence = Persistence(str(tmp_path))
+        json_persistence.save_site(test_fixtures.site1)
+        json_persistence.save_config(test_fixtures.config1)
+        json_persistence.save_running(test_fixtures.running_instances1)
+
+        persistence = SqlitePersistence(str(tmp_path))
+        assert len(persistence.load_site().instances) == len(test_fixtures.site1.instances)
+        assert persistence.load_config().cloud_sql_path == test_fixtures.config1.cloud_sql_path
+        assert len(persistence.load_running().instances) == 2
+
+    def test_newer_schema(self, tmp_path):
+        persistence = SqlitePersistence(str(tmp_path))
+        with persistence.connection:
+            persistence.connection.execute(
+                "UPDATE meta SET value = '99' WHERE key = 'schema_version'"
+            )
+        persistence.close()
+        with raises(SchemaVersionError):
+            SqlitePersistence(str(tmp_path))
@@ -0,0 +1,78 @@
+import selectors
+import subprocess
+import sys
+import time
+
+from cloud_sql.supervision import ProcessWatcher, RestartPolicy, is_alive
+from cloud_sql.cloud_sql_proxy import process_start_time
+
+
+class TestRestartPolicy:
+    def test_delay(self):
+        policy = RestartPolicy(initial_delay=1.0, max_delay=10.0)
+        assert policy.delay(0, rng=lambda: 0.0) == 1.0
+        assert policy.delay(2, rng=lambda: 0.0) == 4.0
+        assert policy.delay(2, rng=lambda: 1.0) == 2.0
+        assert policy.delay(10, rng=lambda: 0.0) == 10.0
+
+    def test_recent_restarts(self):
+        policy = RestartPolicy(window=60.0)
+        restarts = [{"time": 100.0}, {"time": 150.0}, {"time": 170.0}]
+        assert policy.recent_restarts(restarts, 200.0) == 2
+        assert policy.recent_restarts([], 200.0) == 0
+
+
+class TestProcessWatcher:
+    def wait_for_exit(self, watcher, selector, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for key, _ in selector.select(0.05):
+                watcher.notify(key.data, key.fd)
+            exited = watcher.collect()
+            if exited:
+                return exited
+        return []
+
+    def test_watch(self):
+        process = subprocess.Popen(
+            [sys.executable, "-c", "import time; time.sleep(30)"]
+        )
+        start_time = process_start_time(process.pid)
+        assert is_alive(process.pid, start_time)
+
+        selector = selectors.DefaultSelector()
+        watcher = ProcessWatcher(selector)
+        watcher.watch("instance", process.pid, start_time)
+        assert watcher.collect() == []
+
+        process.kill()
+        process.wait()
+        assert self.wait_for_exit(watcher, selector) == [
+            ("instance", process.pid)
+        ]
+        assert watcher.watched == {}
+        assert watcher.pidfds == {}
+
+    def test_unwatch(self):
+        process = subprocess.Popen(
+            [sys.executable, "-c", "import time; time.sleep(30)"]
+        )
+        selector = selectors.DefaultSelector()
+        watcher = ProcessWatcher(selector)
+        watcher.watch("instance", process.pid, process_start_time(process.pid))
+        watcher.unwatch("instance")
+        process.kill()
+        process.wait()
+        assert self.wait_for_exit(watcher, selector, 0.2) == []
+
+    def test_watch_reused_pid(self):
+        process = subprocess.Popen(
+            [sys.executable, "-c", "import time; time.sleep(30)"]
+        )
+        try:
+            watcher = ProcessWatcher(selectors.DefaultSelector())
+            watcher.watch("instance", process.pid, 1.0)
+            assert watcher.collect() == [("instance", process.pid)]
+        finally:
+            process.kill()
+            process.wait()